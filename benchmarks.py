@@ -0,0 +1,662 @@
+import sys
+import os
+import time
+
+# Qt benchmarks don't need a visible desktop
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from config import PATH_CONFIG, CANVAS_SIZE_WIDTH, CANVAS_SIZE_HEIGHT
+
+
+_app = None
+
+
+def _qt_app():
+    global _app
+    from PyQt5.QtWidgets import QApplication
+    _app = QApplication.instance() or QApplication(sys.argv)
+    return _app
+
+
+def sprite_memory():
+    _qt_app()
+    from PyQt5.QtCore import QSize
+    from sprite_manager import SpriteManager
+
+    canvas_size = QSize(CANVAS_SIZE_WIDTH, CANVAS_SIZE_HEIGHT)
+    print(f"{'layout':<8} {'frames':>7} {'textures':>9} {'resident KB':>12}")
+    for use_atlas in (False, True):
+        report = SpriteManager(PATH_CONFIG, canvas_size, use_atlas=use_atlas, lazy=False).memory_report()
+        print(f"{report['layout']:<8} {report['frames']:>7} {report['textures']:>9} {report['current_bytes'] // 1024:>12}")
+
+
+def sprite_load(repeats=5):
+    _qt_app()
+    from PyQt5.QtCore import QSize
+    from sprite_manager import SpriteManager
+
+    canvas_size = QSize(CANVAS_SIZE_WIDTH, CANVAS_SIZE_HEIGHT)
+    print(f"{'layout':<8} {'left frames':<12} {'decodes':>8} {'best ms':>8}")
+    for use_atlas in (False, True):
+        for mirror_left in (False, True):
+            timings = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                manager = SpriteManager(PATH_CONFIG, canvas_size, use_atlas=use_atlas, mirror_left=mirror_left, lazy=False)
+                timings.append(time.perf_counter() - start)
+            layout = "atlas" if use_atlas else "legacy"
+            left = "mirrored" if mirror_left else "B files"
+            print(f"{layout:<8} {left:<12} {manager.decode_count:>8} {min(timings) * 1000:>8.1f}")
+
+
+def sprite_first_frame(repeats=5):
+    _qt_app()
+    from PyQt5.QtCore import QSize
+    from sprite_manager import SpriteManager
+
+    canvas_size = QSize(CANVAS_SIZE_WIDTH, CANVAS_SIZE_HEIGHT)
+    print(f"{'loading':<8} {'first frame ms':>15} {'resident KB':>12} {'animations':>11}")
+    for lazy in (False, True):
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            manager = SpriteManager(PATH_CONFIG, canvas_size, lazy=lazy, warmup=False)
+            manager.get_sprite("sit", "R", 0)
+            timings.append(time.perf_counter() - start)
+        report = manager.memory_report()
+        print(f"{'lazy' if lazy else 'eager':<8} {min(timings) * 1000:>15.1f} "
+              f"{report['current_bytes'] // 1024:>12} {report['loaded_animations']:>11}")
+
+
+def _legacy_get_state(machine):
+    # get_state() as it was before snapshots, a fresh dict on every call
+    with machine.lock:
+        display_state = machine.current_state
+        if machine.current_state == "circle":
+            display_state = "fly"
+        if machine.current_state == "hover":
+            display_state = "idle"
+        return {
+            "state": display_state,
+            "direction": machine.direction,
+            "frame_index": machine.frame_index,
+            "position": (int(machine.x), int(machine.y)),
+            "tiredness": machine.tiredness
+        }
+
+
+def state_snapshot(calls=200000):
+    from state_machine import TailsStateMachine
+
+    machine = TailsStateMachine(1920, 1040, CANVAS_SIZE_WIDTH, CANVAS_SIZE_HEIGHT)
+    print(f"{'path':<22} {'calls/s':>12}")
+
+    start = time.perf_counter()
+    for _ in range(calls):
+        _legacy_get_state(machine)
+    print(f"{'dict':<22} {calls / (time.perf_counter() - start):>12,.0f}")
+
+    start = time.perf_counter()
+    for _ in range(calls):
+        machine.get_state()
+    print(f"{'snapshot':<22} {calls / (time.perf_counter() - start):>12,.0f}")
+
+    # One change per four reads, roughly an animation frame against the readers of a tick
+    start = time.perf_counter()
+    for i in range(calls):
+        if i % 4 == 0:
+            machine.increment_frame()
+        machine.get_state()
+    print(f"{'snapshot, 1/4 changed':<22} {calls / (time.perf_counter() - start):>12,.0f}")
+
+    start = time.perf_counter()
+    version = machine.version
+    for _ in range(calls):
+        machine.changed_since(version)
+    print(f"{'changed_since':<22} {calls / (time.perf_counter() - start):>12,.0f}")
+
+
+def update_state(hours=4.0):
+    from simulation import HeadlessSimulator
+
+    print(f"{'scenario':<16} {'ticks':>10} {'ticks/s':>12} {'x realtime':>11}")
+    for name, click_rate in (("autonomous", 0.0), ("busy clicking", 0.05)):
+        report = HeadlessSimulator(seed=1, click_rate=click_rate).run(hours * 3600)
+        speedup = report.simulated_seconds / report.wall_seconds
+        print(f"{name:<16} {report.ticks:>10,} {report.ticks_per_second():>12,.0f} {speedup:>11,.0f}")
+
+
+def swarm(steps=200):
+    import random
+    from simulation import FakeClock
+    from state_machine import TailsStateMachine, Event
+    from swarm import SwarmEngine
+
+    dt = 0.095
+    print(f"{'pets':>6} {'scalar pet-steps/s':>19} {'numpy pet-steps/s':>18} {'numpy ms/step':>14}")
+    for count in (1, 10, 100, 1000, 5000, 20000):
+        clock = FakeClock()
+        engine = SwarmEngine(count, 1920, 1040, CANVAS_SIZE_WIDTH, CANVAS_SIZE_HEIGHT, seed=0, clock=clock)
+        engine.right_click(200, 100)  # Everyone flies, the most expensive path
+        start = time.perf_counter()
+        for _ in range(steps):
+            clock.advance(dt)
+            engine.step(dt)
+        numpy_time = time.perf_counter() - start
+
+        scalar = "-"
+        if count <= 1000:
+            machines = [TailsStateMachine(1920, 1040, CANVAS_SIZE_WIDTH, CANVAS_SIZE_HEIGHT, clock=clock, rng=random.Random(i))
+                        for i in range(count)]
+            for machine in machines:
+                machine.process_event(Event.RIGHT_CLICK, x=200, y=100)
+            start = time.perf_counter()
+            for _ in range(steps):
+                clock.advance(dt)
+                for machine in machines:
+                    machine.process_event(Event.TICK)
+            scalar = f"{count * steps / (time.perf_counter() - start):,.0f}"
+
+        print(f"{count:>6} {scalar:>19} {count * steps / numpy_time:>18,.0f} {numpy_time / steps * 1000:>14.3f}")
+
+
+def trajectory(seconds=5.0, calls=300000):
+    import random
+    from simulation import FakeClock
+    from state_machine import TailsStateMachine, Event, State
+    from config import WALK_SPEED, WALK_INCREMENT, TICK_MS
+
+    # Walk for a fixed time with a timer that fires late by varying amounts, expected distance is WALK_SPEED * seconds
+    print(f"{'timer lateness':<15} {'ticks':>6} {'increments px':>14} {'segments px':>12}")
+    for lateness in (0.0, 0.1, 0.3, 0.6):
+        jitter = random.Random(0)
+        clock = FakeClock()
+        machine = TailsStateMachine(100000, 1040, CANVAS_SIZE_WIDTH, CANVAS_SIZE_HEIGHT, clock=clock)
+        machine.state = State.IDLE
+        start_x = machine.x
+        machine.process_event(Event.RIGHT_CLICK, x=start_x + 100000, y=machine.y)
+        ticks = 0
+        while True:
+            dt = TICK_MS / 1000.0 * (1 + jitter.uniform(0, lateness))
+            if clock.now + dt > seconds:
+                break
+            clock.advance(dt)
+            machine.process_event(Event.TICK)
+            ticks += 1
+        clock.advance(seconds - clock.now)
+        walked = machine.position_at()[0] - start_x
+        print(f"{f'up to {lateness:.0%}':<15} {ticks:>6} {ticks * WALK_INCREMENT:>14.0f} {walked:>12.0f}")
+    print(f"expected {WALK_SPEED * seconds:.0f} px")
+
+    machine = TailsStateMachine(1920, 1040, CANVAS_SIZE_WIDTH, CANVAS_SIZE_HEIGHT)
+    machine.state = State.IDLE
+    machine.process_event(Event.RIGHT_CLICK, x=0, y=100)
+    start = time.perf_counter()
+    for i in range(calls):
+        machine.position_at()
+    print(f"position_at: {(time.perf_counter() - start) / calls * 1e9:.0f} ns")
+
+
+def navigation(calls=100000):
+    from navigation import NavigationMap
+
+    # Four monitors in a row at staggered heights, clicks bounce between the two ends
+    screens = [(i * 1920, i * 120, 1920, 1080) for i in range(4)]
+    work_areas = [(x, y, w, h - 40) for x, y, w, h in screens]
+    start, goal = (300, 700), (3 * 1920 + 900, 900)
+
+    navigator = NavigationMap(screens, work_areas, CANVAS_SIZE_WIDTH, CANVAS_SIZE_HEIGHT)
+    begin = time.perf_counter()
+    for _ in range(calls // 100):
+        navigator.route_cache.clear()
+        navigator.route(start, goal)
+    search = (time.perf_counter() - begin) / (calls // 100)
+
+    begin = time.perf_counter()
+    for _ in range(calls):
+        navigator.route(start, goal)
+    cached = (time.perf_counter() - begin) / calls
+
+    print(f"route: {navigator.route(start, goal)}")
+    print(f"{'A* search':<14} {search * 1e6:>8.1f} us")
+    print(f"{'cached route':<14} {cached * 1e6:>8.1f} us")
+
+
+def replay(hours=1.0):
+    import os
+    import tempfile
+    from simulation import HeadlessSimulator
+    from replay import EventRecorder, replay as replay_log
+
+    # Record a simulated session, then replay it twice, both replays have to agree
+    path = os.path.join(tempfile.mkdtemp(), "session.tlog")
+    simulator = HeadlessSimulator(seed=1, click_rate=0.05)
+    recorder = EventRecorder(path, 1)
+    recorder.attach(simulator.machine)
+    simulator.run(hours * 3600)
+    recorder.close()
+
+    first, second = replay_log(path), replay_log(path)
+    size = os.path.getsize(path)
+    print(f"log {size / 1024:,.0f} KB, {size / recorder.events:.1f} bytes/event")
+    print(f"{first.events:,} events replayed at {max(first.events_per_second(), second.events_per_second()):,.0f} events/s")
+    print(f"deterministic: {first.digest == second.digest}")
+    os.remove(path)
+
+
+def _legacy_idle_seconds(rng, dt):
+    # How long the old per-tick roll kept Tails idle, the threshold was redrawn every tick
+    idle_time = 0.0
+    while True:
+        idle_time += dt
+        if idle_time > rng.uniform(2, 5) and rng.random() < 0.2:
+            return idle_time
+
+
+def wander(samples=3000):
+    import random
+    from simulation import FakeClock
+    from state_machine import TailsStateMachine, Event, State
+
+    dt = 0.095
+    rng = random.Random(0)
+    legacy = sorted(_legacy_idle_seconds(rng, dt) for _ in range(samples))
+
+    # Scheduled rolls, timed from becoming idle until the wander walk starts
+    clock = FakeClock()
+    machine = TailsStateMachine(1920, 1040, CANVAS_SIZE_WIDTH, CANVAS_SIZE_HEIGHT, clock=clock, rng=random.Random(0))
+    scheduled = []
+    ticks = 0
+    start = time.perf_counter()
+    while len(scheduled) < samples:
+        machine.state = State.IDLE
+        machine.process_event(Event.TICK)
+        idle_since = clock.now
+        while machine.state == State.IDLE:
+            clock.advance(dt)
+            machine.process_event(Event.TICK)
+            ticks += 1
+        scheduled.append(clock.now - idle_since)
+    scheduled.sort()
+    elapsed = time.perf_counter() - start
+
+    print("documented: a roll every 2-5 s with a 20% chance, mean 17.5 s")
+    print(f"{'idle seconds':<22} {'mean':>6} {'p10':>6} {'p50':>6} {'p90':>6}")
+    for name, values in (("per-tick roll (legacy)", legacy), ("timer wheel", scheduled)):
+        count = len(values)
+        print(f"{name:<22} {sum(values) / count:>6.1f} {values[count // 10]:>6.1f} "
+              f"{values[count // 2]:>6.1f} {values[count * 9 // 10]:>6.1f}")
+    print(f"idle ticks: {ticks / elapsed:,.0f}/s, {machine.timers.stats['slots_scanned']:,} slot scans for {ticks:,} ticks")
+
+
+def _legacy_next_state(state_transitions, current_state, event):
+    # TailsStateMachine._get_next_state before the transition table was compiled
+    event_name = event.name.lower()
+    transitions = state_transitions.get(current_state, {})
+    next_state = transitions.get(event_name, transitions.get("default", current_state))
+    if isinstance(next_state, list):
+        next_state = next_state[0]
+    return next_state
+
+
+def dispatch(calls=300000):
+    from config import STATE_TRANSITIONS
+    from state_machine import TailsStateMachine, Event, State, TRANSITION_TABLE
+
+    events = [Event.TARGET_REACHED, Event.RIGHT_CLICK, Event.TIRED, Event.RECOVERED, Event.CIRCLE_COMPLETE]
+    print(f"{'path':<26} {'ns/event':>9}")
+
+    start = time.perf_counter()
+    for i in range(calls):
+        _legacy_next_state(STATE_TRANSITIONS, "walk", events[i % 5])
+    print(f"{'dict lookup (legacy)':<26} {(time.perf_counter() - start) / calls * 1e9:>9.0f}")
+
+    targets = TRANSITION_TABLE.targets
+    start = time.perf_counter()
+    for i in range(calls):
+        targets[State.WALK][events[i % 5]][0]
+    print(f"{'compiled table lookup':<26} {(time.perf_counter() - start) / calls * 1e9:>9.0f}")
+
+    machine = TailsStateMachine(1920, 1040, CANVAS_SIZE_WIDTH, CANVAS_SIZE_HEIGHT)
+    start = time.perf_counter()
+    for i in range(calls):
+        machine.process_event(Event.RIGHT_CLICK, x=(i % 2) * 500, y=machine.y)
+    print(f"{'process_event RIGHT_CLICK':<26} {(time.perf_counter() - start) / calls * 1e9:>9.0f}")
+
+    start = time.perf_counter()
+    for i in range(calls):
+        machine.process_event(Event.TICK)
+    print(f"{'process_event TICK':<26} {(time.perf_counter() - start) / calls * 1e9:>9.0f}")
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def chat_latency(messages=20):
+    # Message typed to text in the bubble, through the worker, chat session and DialogManager, against the local stub
+    app = _qt_app()
+    from PyQt5.QtCore import QObject
+    from state_machine import TailsStateMachine
+    from gemini_manager import GeminiManager
+    from gemini_connection import GeminiConnection
+    from chat_session import ChatSession
+    from stub_server import StubServer, StubSettings
+
+    class BubbleProbe(QObject):
+        # A QObject slot so the time is taken on the GUI thread, when the bubble itself updates
+        def __init__(self):
+            super().__init__()
+            self.times = []
+
+        def shown(self, text, *args):
+            self.times.append(time.perf_counter())
+
+    server = StubServer(StubSettings(first_token_ms=200, tokens_per_second=200))
+    url = server.start()
+    machine = TailsStateMachine(1920, 1040, CANVAS_SIZE_WIDTH, CANVAS_SIZE_HEIGHT)
+    # No pacing, this measures the chat path rather than the free tier's 10 requests a minute
+    manager = GeminiManager(machine, connection=GeminiConnection(stub_url=url, rpm=0, tpm=0), cache_path=None)
+    manager._init_LLM(None)
+    manager.session = ChatSession(manager.connection, "stub", manager.tails_prompt)
+    probe = BubbleProbe()
+    manager.show_speech_bubble_signal.connect(probe.shown)
+    # The code options dialog is modal and would wait for a click
+    manager.handle_code_request_signal.disconnect()
+
+    first, full = [], []
+    for i in range(messages):
+        probe.times.clear()
+        start = time.perf_counter()
+        manager._submit(lambda request, text=f"question {i}": manager._generate_response(text, request))
+        while manager.worker.current or manager.worker.depth or not probe.times:
+            app.processEvents()
+            time.sleep(0.001)
+        app.processEvents()
+        first.append(probe.times[0] - start)
+        full.append(probe.times[-1] - start)
+    manager.close()
+    server.stop()
+
+    print(f"stub: 200 ms to first token, 200 tokens/s, {messages} messages")
+    print(f"{'':<14} {'p50 ms':>8} {'p95 ms':>8}")
+    print(f"{'first text':<14} {_percentile(first, 0.5) * 1000:>8.0f} {_percentile(first, 0.95) * 1000:>8.0f}")
+    print(f"{'full response':<14} {_percentile(full, 0.5) * 1000:>8.0f} {_percentile(full, 0.95) * 1000:>8.0f}")
+
+
+def chat_throughput(requests=48):
+    # Raw backend throughput at several concurrency levels, then the same load queued through the single chat worker
+    import threading
+    from llm_backend import StubBackend
+    from llm_worker import LLMWorker
+    from stub_server import StubServer, StubSettings
+
+    server = StubServer(StubSettings(first_token_ms=100, tokens_per_second=400))
+    url = server.start()
+    backend = StubBackend(url)
+
+    def one_request(latencies):
+        start = time.perf_counter()
+        "".join(backend.stream("stub", f"question {len(latencies)}"))
+        latencies.append(time.perf_counter() - start)
+
+    print(f"{'path':<16} {'in flight':>9} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8}")
+    for concurrency in (1, 4, 16):
+        latencies = []
+
+        def run():
+            while len(latencies) < requests:
+                one_request(latencies)
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=run) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        print(f"{'backend':<16} {concurrency:>9} {len(latencies) / elapsed:>7.1f} "
+              f"{_percentile(latencies, 0.5) * 1000:>8.0f} {_percentile(latencies, 0.95) * 1000:>8.0f}")
+
+    # Every request at once with no key, nothing is superseded, so this is the worst case queue
+    worker = LLMWorker(max_queue=requests, timeout=600)
+    latencies = []
+    done = threading.Event()
+    start = time.perf_counter()
+    for _ in range(requests):
+        submitted = time.perf_counter()
+
+        def run(request, submitted=submitted):
+            "".join(backend.stream("stub", "question"))
+            latencies.append(time.perf_counter() - submitted)
+            if len(latencies) == requests:
+                done.set()
+        worker.submit(run)
+    done.wait()
+    elapsed = time.perf_counter() - start
+    summary = worker.summary()
+    print(f"{'chat worker':<16} {requests:>9} {requests / elapsed:>7.1f} "
+          f"{_percentile(latencies, 0.5) * 1000:>8.0f} {_percentile(latencies, 0.95) * 1000:>8.0f}")
+    print(f"worker queue wait: mean {summary['wait_ms']:.0f} ms, max {summary['max_wait_ms']:.0f} ms")
+    worker.stop()
+    server.stop()
+
+
+def rate_limit(requests=40):
+    # A burst of chat requests against a stub that 429s a third of the time, half of them duplicates
+    import threading
+    from llm_backend import StubBackend
+    from rate_limiter import RateLimitedBackend
+    from stub_server import StubServer, StubSettings
+
+    server = StubServer(StubSettings(first_token_ms=50, tokens_per_second=2000, fail_rate=0.3, fail_status=429, retry_after=0.25))
+    url = server.start()
+    limiter = RateLimitedBackend(StubBackend(url), rpm=600, tpm=0, max_retries=6, backoff=0.1)
+    results = []
+
+    def one(i):
+        # Even requests all ask the same thing and can share one response
+        prompt = "same question" if i % 2 == 0 else f"question {i}"
+        try:
+            "".join(limiter.stream("stub", prompt))
+            results.append(True)
+        except Exception:
+            results.append(False)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=one, args=(i,)) for i in range(requests)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    server.stop()
+
+    summary = limiter.summary()
+    print(f"{requests} requests at 600 rpm in {elapsed:.2f} s, {sum(results)} succeeded, {server.settings.stats['requests']} reached the server")
+    print(f"coalesced {summary['coalesced']}, 429s {summary['rate_limited']}, retries {summary['retries']}")
+    print(f"throttled {summary['throttled']} for {summary['throttle_seconds']:.2f} s total, "
+          f"queue delay mean {summary['queue_delay_ms']:.0f} ms, max {summary['max_queue_delay_ms']:.0f} ms")
+
+
+MERGE_SOURCE = """import os
+import dataclasses
+
+GREETING = "hi"
+
+
+class Greeter:
+    punctuation = "!"
+
+    def greet(self, name):
+        return f"{GREETING} {name}"
+
+    def leave(self):
+        return "bye"
+
+
+@dataclasses.dataclass
+class Point:
+    x: int = 0
+
+    def norm(self):
+        return abs(self.x)
+
+
+def main():
+    print(Greeter().greet(os.sep))
+
+
+if __name__ == "__main__":
+    main()
+"""
+
+
+def _merge_case(name, check):
+    # One code_merge behavior, a failure is printed rather than raised so every case gets a line
+    try:
+        problem = check()
+    except Exception as e:
+        problem = f"{type(e).__name__}: {e}"
+    print(f"{name:<36} {'ok' if not problem else 'FAILED, ' + problem}")
+
+
+def _run_merged(source, main=False):
+    import io
+    import contextlib
+
+    namespace = {"__name__": "__main__" if main else "merged"}
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        exec(compile(source, "<merged>", "exec"), namespace)
+    return namespace, output.getvalue()
+
+
+def code_merge():
+    import stat
+    import tempfile
+    from code_merge import plan_merge, build_prompt, parse_edits, apply_edits, atomic_write
+
+    # What a region merge sends compared to the whole file, for a method of the largest module here
+    with open("state_machine.py", encoding="utf-8") as f:
+        big = f.read()
+    snippet = "class TailsStateMachine:\n    def get_state(self):\n        return None\n"
+    prompt = build_prompt(plan_merge(big, snippet), big, snippet)
+    print(f"one method of state_machine.py: {len(prompt):,} char prompt, the whole file is {len(big):,} chars")
+
+    def replace_method():
+        plan = plan_merge(MERGE_SOURCE, "class Greeter:\n    def greet(self, name):\n        return name\n")
+        if [region.name for region in plan.regions] != ["Greeter.greet"]:
+            return f"regions {[region.name for region in plan.regions]}"
+        reply = "### REGION Greeter.greet\n```python\ndef greet(self, name):\n    return f\"{GREETING}, {name}{self.punctuation}\"\n```\n"
+        namespace, _ = _run_merged(apply_edits(MERGE_SOURCE, plan, parse_edits(reply)))
+        greeter = namespace["Greeter"]()
+        if greeter.greet("you") != "hi, you!" or greeter.leave() != "bye":
+            return f"greet gave {greeter.greet('you')!r}"
+
+    def add_before_main():
+        plan = plan_merge(MERGE_SOURCE, "def farewell():\n    print(Greeter().leave())\n")
+        merged = apply_edits(MERGE_SOURCE, plan, {})
+        if not merged.index("def farewell") < merged.index("if __name__"):
+            return "farewell was added after the script code"
+        _, output = _run_merged(merged + "    farewell()\n", main=True)
+        if output.split() != ["hi", os.sep, "bye"]:
+            return f"printed {output!r}"
+
+    def insert_import():
+        plan = plan_merge(MERGE_SOURCE, "import json\n\ndef dump(point):\n    return json.dumps(point.x)\n")
+        if plan.imports != ["import json\n"]:
+            return f"imports {plan.imports}"
+        merged = apply_edits(MERGE_SOURCE, plan, {})
+        if not merged.startswith("import os\nimport dataclasses\nimport json\n"):
+            return "import json isn't with the other imports"
+        namespace, _ = _run_merged(merged)
+        if namespace["dump"](namespace["Point"](3)) != "3":
+            return "dump() is wrong"
+
+    def decorated_class():
+        plan = plan_merge(MERGE_SOURCE, "class Point:\n    x: int = 0\n    y: int = 0\n")
+        if [region.name for region in plan.regions] != ["Point"]:
+            return f"regions {[region.name for region in plan.regions]}"
+        lines = MERGE_SOURCE.splitlines(keepends=True)
+        if not plan.regions[0].text(lines).startswith("@dataclasses.dataclass\n"):
+            return "the region doesn't include the decorator"
+        prompt = build_prompt(plan, MERGE_SOURCE, "")
+        if 'GREETING = "hi"' not in prompt or 'punctuation = "!"' not in prompt or "x: int = 0" not in prompt:
+            return "the outline is missing globals or class attributes"
+        reply = ("### REGION Point\n```python\n@dataclasses.dataclass\nclass Point:\n    x: int = 0\n    y: int = 0\n\n"
+                 "    def norm(self):\n        return abs(self.x) + abs(self.y)\n```\n")
+        merged = apply_edits(MERGE_SOURCE, plan, parse_edits(reply))
+        namespace, _ = _run_merged(merged)
+        if merged.count("@dataclasses.dataclass") != 1 or namespace["Point"](1, -2).norm() != 3:
+            return "the class wasn't replaced with its decorator"
+
+    def top_level_fallback():
+        if plan_merge(MERGE_SOURCE, "print('hello')\nmain()\n") is not None:
+            return "statements were planned as a region merge"
+        if plan_merge(MERGE_SOURCE, "def broken(:\n") is not None:
+            return "a snippet that doesn't parse was planned"
+
+    def unusable_edit():
+        plan = plan_merge(MERGE_SOURCE, "def main():\n    pass\n")
+        try:
+            apply_edits(MERGE_SOURCE, plan, {"main": "def other():\n    pass\n"})
+        except ValueError:
+            return None
+        return "an edit that drops main() was applied"
+
+    def write_keeps_mode():
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "script.py")
+        atomic_write(path, "x = 1\n")
+        umask = os.umask(0)
+        os.umask(umask)
+        if stat.S_IMODE(os.stat(path).st_mode) != 0o666 & ~umask:
+            return f"new file mode {oct(stat.S_IMODE(os.stat(path).st_mode))}"
+        os.chmod(path, 0o755)
+        atomic_write(path, "x = 2\n")
+        with open(path, encoding="utf-8") as f:
+            content = f.read()
+        if content != "x = 2\n" or stat.S_IMODE(os.stat(path).st_mode) != 0o755:
+            return "content or mode wasn't kept"
+        if os.listdir(directory) != ["script.py"]:
+            return f"left behind {os.listdir(directory)}"
+
+    _merge_case("replace a method", replace_method)
+    _merge_case("add a function before if __name__", add_before_main)
+    _merge_case("insert a missing import", insert_import)
+    _merge_case("decorated class as a whole region", decorated_class)
+    _merge_case("fall back on top-level statements", top_level_fallback)
+    _merge_case("reject an edit that drops the region", unusable_edit)
+    _merge_case("atomic_write keeps the file mode", write_keeps_mode)
+
+
+BENCHMARKS = {
+    "sprite_memory": sprite_memory,
+    "sprite_load": sprite_load,
+    "sprite_first_frame": sprite_first_frame,
+    "state_snapshot": state_snapshot,
+    "update_state": update_state,
+    "swarm": swarm,
+    "dispatch": dispatch,
+    "trajectory": trajectory,
+    "navigation": navigation,
+    "replay": replay,
+    "wander": wander,
+    "chat_latency": chat_latency,
+    "chat_throughput": chat_throughput,
+    "rate_limit": rate_limit,
+    "code_merge": code_merge,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"Unknown benchmark: {name} (available: {', '.join(BENCHMARKS)})")
+            continue
+        print(f"== {name} ==")
+        start = time.perf_counter()
+        BENCHMARKS[name]()
+        print(f"({time.perf_counter() - start:.2f}s)\n")
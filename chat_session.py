@@ -0,0 +1,88 @@
+from threading import Lock
+
+from config import CHAT_HISTORY_TOKENS, CHAT_KEEP_TURNS
+from utils import log
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English, good enough for budgeting
+    return len(text) // 4 + 1
+
+
+class ChatSession:
+    # One conversation, the persona goes in the system instruction and the history is trimmed to a token budget
+    def __init__(self, connection, model, system_instruction, token_budget=CHAT_HISTORY_TOKENS, keep_turns=CHAT_KEEP_TURNS):
+        self.connection = connection  # GeminiConnection, summaries go through the same client as the chat
+        self.model = model
+        self.system_instruction = system_instruction
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns  # Most recent user/model pairs that are never summarized away
+        self.lock = Lock()
+
+        self.history = []  # {"role": "user" | "model", "parts": [{"text": ...}]}
+        self.summary = None  # Short summary of turns that no longer fit
+        self.stats = {
+            "turns": 0,
+            "summaries": 0,
+            "last_prompt_bytes": 0,
+            "total_prompt_bytes": 0,
+            "legacy_prompt_bytes": 0,  # What resending the persona with a single line would have cost
+        }
+
+    @staticmethod
+    def _turn(role, text):
+        return {"role": role, "parts": [{"text": text}]}
+
+    def _history_tokens(self):
+        tokens = estimate_tokens(self.summary) if self.summary else 0
+        return tokens + sum(estimate_tokens(turn["parts"][0]["text"]) for turn in self.history)
+
+    def prepare(self, message):
+        # Contents and config for models.generate_content(_stream)
+        with self.lock:
+            contents = []
+            if self.summary:
+                contents.append(self._turn("user", f"(Summary of our conversation so far: {self.summary})"))
+                contents.append(self._turn("model", "Got it."))
+            contents.extend(self.history)
+            contents.append(self._turn("user", message))
+
+            prompt_bytes = len(self.system_instruction.encode()) + sum(
+                len(turn["parts"][0]["text"].encode()) for turn in contents
+            )
+            self.stats["last_prompt_bytes"] = prompt_bytes
+            self.stats["total_prompt_bytes"] += prompt_bytes
+            self.stats["legacy_prompt_bytes"] += len(f"{self.system_instruction}\nUser: {message}\nTails:".encode())
+            return contents, {"system_instruction": self.system_instruction}
+
+    def commit(self, message, reply):
+        # Adds a finished turn, then summarizes the oldest turns if the history went over budget
+        with self.lock:
+            self.history.append(self._turn("user", message))
+            self.history.append(self._turn("model", reply))
+            self.stats["turns"] += 1
+            if self._history_tokens() <= self.token_budget or len(self.history) <= self.keep_turns * 2:
+                return
+            # Counted from the front, a slice from -0 would keep everything when keep_turns is 0
+            split = len(self.history) - self.keep_turns * 2
+            old = self.history[:split]
+            self.history = self.history[split:]
+            previous = self.summary
+
+        # The network call happens outside the lock so new turns aren't held up
+        summary = self._summarize(previous, old)
+        with self.lock:
+            self.summary = summary
+            self.stats["summaries"] += 1
+
+    def _summarize(self, previous, turns):
+        transcript = "\n".join(f"{turn['role']}: {turn['parts'][0]['text']}" for turn in turns)
+        if previous:
+            transcript = f"Earlier summary: {previous}\n{transcript}"
+        try:
+            prompt = f"Summarize this conversation in at most three short sentences, keep names, facts and decisions:\n{transcript}"
+            response = self.connection.call(lambda backend: backend.generate(self.model, prompt))
+            return response.strip()
+        except Exception as e:
+            # Losing old turns beats failing the chat, keep whatever summary we had
+            log(f"Couldn't summarize chat history: {e}", level="WARNING")
+            return previous
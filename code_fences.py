@@ -0,0 +1,133 @@
+import re
+
+# Finds fenced code blocks in model output as it streams in, a block is ready as soon as its closing fence arrives
+
+OPENING = re.compile(r"^(\s*)(`{3,}|~{3,})\s*([^`\s]*)[^`]*$")
+ONE_LINE = re.compile(r"^\s*(`{3,})([^`\n]+?)\1\s*$")
+
+
+def scan_quotes(text, quote=None):
+    # The string still open at the end of text, given the one open at its start. Python-style quoting,
+    # close enough for most languages. Single-quoted strings end with the line, triple-quoted ones don't
+    i = 0
+    while i < len(text):
+        if quote:
+            if text[i] == "\\":
+                i += 2
+                continue
+            if text.startswith(quote, i):
+                i += len(quote)
+                quote = None
+                continue
+            if text[i] == "\n" and len(quote) == 1:
+                quote = None
+            i += 1
+            continue
+        if text[i] == "#":
+            end = text.find("\n", i)
+            if end == -1:
+                break
+            i = end
+        elif text[i] in "'\"":
+            quote = text[i] * 3 if text.startswith(text[i] * 3, i) else text[i]
+            i += len(quote)
+            continue
+        i += 1
+    return quote
+
+
+class CodeBlock:
+    def __init__(self, language, code, closed=True):
+        self.language = language  # Lowercased tag after the opening fence, "" if there wasn't one
+        self.code = code
+        self.closed = closed  # False when the response ended inside the block
+
+    def __repr__(self):
+        return f"CodeBlock({self.language!r}, {len(self.code)} chars{'' if self.closed else ', unclosed'})"
+
+
+class CodeFenceParser:
+    # Fed text in whatever pieces it arrives in, only whole lines are looked at
+    def __init__(self):
+        self.pending = ""  # Text after the last newline
+        self.fence = None  # Opening fence of the block we're in
+        self.indent = 0
+        self.language = ""
+        self.lines = []
+        self.quote = None  # String open at the end of the block so far
+        self.blocks = []
+
+    def feed(self, text):
+        # Returns the blocks completed by this piece of text
+        self.pending += text
+        # CRLF output would leave a \r on every line of code, one split across pieces is whole in pending by now
+        *lines, self.pending = self.pending.replace("\r\n", "\n").split("\n")
+        found = []
+        for line in lines:
+            block = self._line(line)
+            if block:
+                found.append(block)
+        return found
+
+    def finish(self):
+        # End of the response, an unclosed block still counts since markdown runs it to the end
+        found = self.feed("\n") if self.pending else []
+        if self.fence is not None:
+            if any(line.strip() for line in self.lines):
+                found.append(self._close("", closed=False))
+            else:
+                self.fence = None
+        return found
+
+    def _line(self, line):
+        if self.fence is None:
+            one_line = ONE_LINE.match(line)
+            if one_line:
+                # ```print("hi")``` on one line
+                return self._emit(CodeBlock("", one_line.group(2).strip()))
+            opening = OPENING.match(line)
+            if opening:
+                self.indent = len(opening.group(1).expandtabs())
+                self.fence = opening.group(2)
+                self.language = opening.group(3).lower()
+                self.lines = []
+                self.quote = None
+            return None
+
+        stripped = line.strip()
+        # A closing fence uses the same character and is at least as long, so ```` can wrap a block that shows ```
+        if stripped and stripped[0] == self.fence[0] and set(stripped) == {self.fence[0]} and len(stripped) >= len(self.fence):
+            return self._close("")
+        # Models sometimes put the closing fence right after the last line of code,
+        # but ``` at the end of a line inside a string or docstring is just code
+        code = line.rstrip()[:-len(self.fence)]
+        if (self.fence[0] == "`" and line.rstrip().endswith(self.fence) and not code.endswith("`")
+                and scan_quotes(code, self.quote) is None):
+            return self._close(code)
+        self.lines.append(self._dedent(line))
+        self.quote = scan_quotes(line + "\n", self.quote)
+        return None
+
+    def _dedent(self, line):
+        # Code in a list item is indented along with its fence, that indent isn't part of the code
+        expanded = line.expandtabs()
+        strip = min(self.indent, len(expanded) - len(expanded.lstrip()))
+        return expanded[strip:]
+
+    def _close(self, last_line, closed=True):
+        if last_line.strip():
+            self.lines.append(self._dedent(last_line))
+        block = CodeBlock(self.language, "\n".join(self.lines), closed)
+        self.fence = None
+        self.lines = []
+        return self._emit(block)
+
+    def _emit(self, block):
+        self.blocks.append(block)
+        return block
+
+
+def extract_code_blocks(text):
+    # Every block in a finished response
+    parser = CodeFenceParser()
+    return parser.feed(text) + parser.finish()
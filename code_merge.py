@@ -0,0 +1,277 @@
+import os
+import re
+import ast
+import tempfile
+import textwrap
+
+# Merges a Python snippet into a file by the functions and classes it touches, so only those regions go to the model
+
+DEFINITIONS = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+IMPORTS = (ast.Import, ast.ImportFrom)
+ASSIGNMENTS = (ast.Assign, ast.AnnAssign)
+REGION_HEADER = re.compile(r"^###\s*REGION\s+([\w.]+)\s*$", re.MULTILINE)
+
+
+class Region:
+    def __init__(self, name, node, lines):
+        self.name = name  # "function", "Class" or "Class.method"
+        self.node = node
+        # 1-based and inclusive, decorators belong to the region
+        self.start = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+        self.end = node.end_lineno
+        line = lines[node.lineno - 1]
+        self.indent = line[:len(line) - len(line.lstrip())]
+
+    def text(self, lines):
+        return "".join(lines[self.start - 1:self.end])
+
+
+class MergePlan:
+    def __init__(self):
+        self.regions = []  # Existing regions the model rewrites
+        self.additions = []  # (class name or None, snippet text) for definitions the file doesn't have yet
+        self.imports = []  # Import lines the file is missing
+
+
+def find_regions(tree, lines):
+    regions = {}
+    for node in tree.body:
+        if isinstance(node, DEFINITIONS):
+            regions[node.name] = Region(node.name, node, lines)
+            if isinstance(node, ast.ClassDef):
+                for child in node.body:
+                    if isinstance(child, DEFINITIONS):
+                        regions[f"{node.name}.{child.name}"] = Region(f"{node.name}.{child.name}", child, lines)
+    return regions
+
+
+def _header(node, lines):
+    # Decorators and the def/class line(s), up to where the body starts
+    start = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+    body_start = node.body[0].lineno
+    return "".join(lines[start - 1:max(body_start - 1, node.lineno)])
+
+
+def _assignment(node, lines):
+    # Short assignments as written, longer ones by name so a big literal doesn't swamp the outline
+    line = lines[node.lineno - 1]
+    if node.lineno == node.end_lineno and len(line) <= 100:
+        return line if line.endswith("\n") else line + "\n"
+    indent = line[:len(line) - len(line.lstrip())]
+    if isinstance(node, ast.AnnAssign):
+        target = f"{ast.unparse(node.target)}: {ast.unparse(node.annotation)}"
+        if node.value is None:
+            return f"{indent}{target}\n"
+    else:
+        target = " = ".join(ast.unparse(target) for target in node.targets)
+    return f"{indent}{target} = ...\n"
+
+
+def outline(tree, lines):
+    # Every signature, global and class attribute in the file, so the model knows what it can use without seeing the bodies
+    parts = []
+    for node in tree.body:
+        if isinstance(node, IMPORTS):
+            parts.append("".join(lines[node.lineno - 1:node.end_lineno]))
+        elif isinstance(node, ASSIGNMENTS):
+            parts.append(_assignment(node, lines))
+        elif isinstance(node, DEFINITIONS):
+            parts.append(_header(node, lines))
+            if isinstance(node, ast.ClassDef):
+                for child in node.body:
+                    if isinstance(child, DEFINITIONS):
+                        parts.append(_header(child, lines))
+                    elif isinstance(child, ASSIGNMENTS):
+                        parts.append(_assignment(child, lines))
+    return "".join(parts)
+
+
+def _is_docstring(node):
+    return isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant) and isinstance(node.value.value, str)
+
+
+def _segment(snippet_lines, node):
+    start = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+    return "".join(snippet_lines[start - 1:node.end_lineno])
+
+
+def plan_merge(source, snippet):
+    # None when the snippet isn't just imports and definitions, the caller falls back to a whole-file merge
+    try:
+        tree = ast.parse(source)
+        snippet_tree = ast.parse(textwrap.dedent(snippet))
+    except SyntaxError:
+        return None
+    lines = source.splitlines(keepends=True)
+    snippet_lines = textwrap.dedent(snippet).splitlines(keepends=True)
+    regions = find_regions(tree, lines)
+    methods = {}
+    for name in regions:
+        if "." in name:
+            methods.setdefault(name.split(".", 1)[1], []).append(name)
+
+    existing_imports = {ast.unparse(node) for node in tree.body if isinstance(node, IMPORTS)}
+    plan = MergePlan()
+    chosen = []
+    for node in snippet_tree.body:
+        if isinstance(node, IMPORTS):
+            if ast.unparse(node) not in existing_imports:
+                plan.imports.append(ast.unparse(node) + "\n")
+        elif _is_docstring(node):
+            continue
+        elif isinstance(node, ast.ClassDef) and node.name in regions:
+            members = [child for child in node.body if not _is_docstring(child)]
+            if not all(isinstance(child, DEFINITIONS) for child in members):
+                # Class attributes changed too, the whole class is the region
+                chosen.append(node.name)
+                continue
+            for child in members:
+                name = f"{node.name}.{child.name}"
+                if name in regions:
+                    chosen.append(name)
+                else:
+                    plan.additions.append((node.name, _segment(snippet_lines, child)))
+        elif isinstance(node, DEFINITIONS):
+            if node.name in regions:
+                chosen.append(node.name)
+            elif len(methods.get(node.name, [])) == 1:
+                # A method shown on its own, outside its class
+                chosen.append(methods[node.name][0])
+            else:
+                plan.additions.append((None, _segment(snippet_lines, node)))
+        else:
+            return None
+
+    # A method inside a class that's already being rewritten would be replaced twice
+    names = set(chosen)
+    plan.regions = sorted(
+        {regions[name] for name in chosen if "." not in name or name.split(".", 1)[0] not in names},
+        key=lambda region: region.start
+    )
+    return plan
+
+
+def build_prompt(plan, source, snippet):
+    lines = source.splitlines(keepends=True)
+    outline_text = outline(ast.parse(source), lines)
+    regions = "\n".join(f"### REGION {region.name}\n```python\n{region.text(lines)}```" for region in plan.regions)
+    return f"""You are an expert code assistant. This is the outline of a Python file, signatures and assignments only:
+---OUTLINE START---
+{outline_text}---OUTLINE END---
+
+These are the parts of the file the new code touches:
+{regions}
+
+Here is the code to implement:
+---CODE START---
+{snippet}
+---CODE END---
+
+Update each region to implement the new code, merging it in the most logical way. Reply with every region you changed,
+each as a "### REGION <name>" line followed by a ```python block holding the complete new definition. Nothing else.
+"""
+
+
+def parse_edits(response):
+    # {region name: code} from the model's reply
+    edits = {}
+    headers = list(REGION_HEADER.finditer(response))
+    for i, header in enumerate(headers):
+        end = headers[i + 1].start() if i + 1 < len(headers) else len(response)
+        block = re.search(r"```(?:\w+)?\n(.*?)```", response[header.end():end], re.DOTALL)
+        if block:
+            edits[header.group(1)] = block.group(1)
+    return edits
+
+
+def _reindent(text, indent):
+    text = textwrap.dedent(text).strip("\n") + "\n"
+    return "".join(indent + line if line.strip() else line for line in text.splitlines(keepends=True))
+
+
+def _check_definition(region, code):
+    try:
+        tree = ast.parse(textwrap.dedent(code))
+    except SyntaxError as e:
+        raise ValueError(f"the new {region.name} doesn't parse: {e}")
+    expected = region.name.rsplit(".", 1)[-1]
+    if not any(isinstance(node, DEFINITIONS) and node.name == expected for node in tree.body):
+        raise ValueError(f"the new {region.name} doesn't define {expected}")
+
+
+def apply_edits(source, plan, edits):
+    # Returns the patched source, raises ValueError if an edit is unusable or the result doesn't parse
+    lines = source.splitlines(keepends=True)
+    if lines and not lines[-1].endswith("\n"):
+        lines[-1] += "\n"
+    patches = []  # (start, end, new lines), end exclusive and 0-based
+    for region in plan.regions:
+        code = edits.get(region.name)
+        if code is None:
+            continue  # The model left it as it was
+        _check_definition(region, code)
+        patches.append((region.start - 1, region.end, _reindent(code, region.indent).splitlines(keepends=True)))
+
+    tree = ast.parse(source)
+    classes = {node.name: node for node in tree.body if isinstance(node, ast.ClassDef)}
+    imports = [node for node in tree.body if isinstance(node, IMPORTS)]
+    if imports:
+        imports_at = imports[-1].end_lineno
+    else:
+        # After a module docstring if there is one
+        imports_at = tree.body[0].end_lineno if tree.body and _is_docstring(tree.body[0]) else 0
+    # New functions and classes go after the last existing one, ahead of trailing code like if __name__ == "__main__"
+    definitions = [node for node in tree.body if isinstance(node, DEFINITIONS)]
+    definitions_at = definitions[-1].end_lineno if definitions else imports_at
+    added = []
+    for class_name, text in plan.additions:
+        if class_name is None:
+            added += ["\n", "\n"] + _reindent(text, "").splitlines(keepends=True)
+            continue
+        node = classes[class_name]
+        body_line = lines[node.body[-1].lineno - 1]
+        indent = body_line[:len(body_line) - len(body_line.lstrip())]
+        patches.append((node.end_lineno, node.end_lineno, ["\n"] + _reindent(text, indent).splitlines(keepends=True)))
+
+    if added:
+        if not definitions:
+            # Script code follows, usually after a blank line of its own
+            added.append("\n")
+        patches.append((definitions_at, definitions_at, added))
+    if plan.imports:
+        # Listed after the additions so at the same spot the imports end up above them
+        patches.append((imports_at, imports_at, plan.imports))
+
+    # Bottom up so earlier line numbers stay valid, inserts before replacements at the same spot
+    for start, end, new in sorted(patches, key=lambda patch: (patch[0], patch[1]), reverse=True):
+        lines[start:end] = new
+    result = "".join(lines)
+    try:
+        ast.parse(result)
+    except SyntaxError as e:
+        raise ValueError(f"merged file doesn't parse: {e}")
+    return result
+
+
+def atomic_write(path, text):
+    # Written next to the target then swapped in, a crash never leaves half a file
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tails-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            mode = os.stat(path).st_mode & 0o7777
+        else:
+            # mkstemp makes the file 0600, a new file gets what open() would have given it
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0o666 & ~umask
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
@@ -28,6 +28,23 @@ WALK_INCREMENT = WALK_SPEED * TICK_MS / 1000.0  # Pixels to move per tick when w
 FLY_INCREMENT = FLY_SPEED * TICK_MS / 1000.0  # Pixels to move per tick when flying
 CIRCLE_DURATION = 5.0  # Duration of circling animation in seconds
 CIRCLE_RADIUS = 50  # Radius of circle flight pattern in pixels
+LANDING_ARC_LIFT = 40  # Sideways swoop in pixels when flying back down to stand
+
+# Game loop settings
+SIM_STEP_MS = TICK_MS  # Fixed simulation step, Tails' movement is timed by trajectory so only the swarm's increments assume it matches TICK_MS
+ANIMATION_MS = TICK_MS  # Time between animation frames
+RENDER_FPS = 30  # Render rate while Tails is moving, positions are sampled from the current trajectory
+IDLE_RENDER_FPS = 1000 / ANIMATION_MS  # Render rate while standing still, one wakeup per animation frame
+MAX_CATCHUP_STEPS = 5  # Simulation steps run in one wakeup before the backlog is dropped
+SCHEDULER_RESOLUTION_MS = 50  # Timer wheel tick for wandering, tiredness and movement timers
+SCHEDULER_SLOTS = 256  # Timer wheel size, timers further out than slots * resolution wait for extra turns
+
+# Binary log of every state machine event for replay.py, None to disable recording
+RECORD_EVENTS = None
+RECORD_FLUSH_S = 5.0  # Seconds between flushes, a crash or killed console loses at most this much of the log
+
+# Extra companions driven by the vectorized swarm engine (needs numpy), 0 for just Tails
+SWARM_SIZE = 0
 
 # Tiredness parameters
 TIREDNESS_DECREASE_RATE = 2.0  # Decrease per second when walking
@@ -39,6 +56,23 @@ RECOVERY_THRESHOLD = 30  # Threshold to return to idle after sitting
 CANVAS_SIZE_WIDTH = 300
 CANVAS_SIZE_HEIGHT = 300
 
+# Sprite memory layout
+SPRITE_ATLAS = True  # Pack trimmed frames into shared atlas textures instead of one canvas per frame
+ATLAS_MAX_SIZE = 2048  # Maximum width/height of an atlas texture in pixels
+ATLAS_PADDING = 1  # Transparent gap between packed frames to avoid sampling bleed
+SPRITE_MIRROR_LEFT = True  # Build left-facing frames by mirroring the right-facing ones instead of loading the B files
+SPRITE_LAZY = True  # Load each animation the first time it's shown instead of all at startup
+SPRITE_CACHE_BUDGET = 8 * 1024 * 1024  # Bytes of loaded animations kept before the least recently used is dropped
+SPRITE_WARMUP = True  # Decode the next likely animations in the background
+
+# Animations likely to follow each one, used for background warm-up
+SPRITE_WARMUP_NEXT = {
+    "idle": ["run", "fly"],
+    "run": ["idle", "sit"],
+    "fly": ["idle"],
+    "sit": ["idle"],
+}
+
 # Sprite naming conventions
 SPRITE_CONFIG = {
     "run": {
@@ -60,31 +94,70 @@ SPRITE_CONFIG = {
     "bubble": "bubble.png"
 }
 
-# State transition configuration for the FSM
+# State transition configuration for the FSM, compiled into an indexed table at startup
+# A list means the handler picks one of them, e.g. walking or flying depending on the click position
 STATE_TRANSITIONS = {
     "idle": {
         "right_click": ["walk", "fly"],  # Depends on click position
-        "tired": "sit",
+        "wander": "walk",
+        "sit_requested": "sit",
         "default": "idle"
     },
     "walk": {
-        "target_reached": "idle",
+        "target_reached": ["idle", "hover"],  # Depends on whether the target is on the taskbar
+        "tired": "sit",
         "right_click": ["walk", "fly"],  # Depends on click position
+        "sit_requested": "sit",
+        "stand_requested": "idle",
         "default": "walk"
     },
     "fly": {
         "target_reached": "circle",
         "right_click": ["walk", "fly"],  # Depends on click position
+        "sit_requested": "sit",
+        "stand_requested": ["idle", "fly"],  # Flies down first when in the air
         "default": "fly"
     },
     "circle": {
         "circle_complete": "idle",
         "right_click": ["walk", "fly"],  # Depends on click position
+        "sit_requested": "sit",
+        "stand_requested": ["idle", "fly"],  # Flies down first when in the air
         "default": "circle"
     },
     "sit": {
         "recovered": "idle",
         "right_click": ["walk", "fly"],  # Depends on click position
+        "stand_requested": "idle",
         "default": "sit"
+    },
+    "hover": {
+        "right_click": ["walk", "fly"],  # Depends on click position
+        "sit_requested": "sit",
+        "default": "hover"
     }
-}
\ No newline at end of file
+}
+
+INITIAL_STATE = "sit"
+
+# Gemini settings
+GEMINI_MODEL = "gemini-2.5-flash"
+GEMINI_STREAMING = True  # Show responses in the speech bubble as they arrive instead of all at once
+GEMINI_FAKE = False  # Use the offline fake backend from fake_gemini.py instead of the real API
+CHAT_HISTORY_TOKENS = 2000  # Estimated tokens of chat history kept before older turns are summarized
+CHAT_KEEP_TURNS = 3  # Latest exchanges always sent word for word
+GEMINI_WARMUP_DELAY_MS = 3000  # Build and connect the client this long after startup when a GEM key is set
+GEMINI_KEEPALIVE_S = 240  # Ping the API after this long unused so the connection stays open, 0 to disable
+GEMINI_MAX_FAILURES = 1  # Failed calls in a row (bad requests don't count) before the client is rebuilt
+LLM_QUEUE_SIZE = 8  # Model requests allowed to wait for the worker before new ones are turned away
+LLM_REQUEST_TIMEOUT_S = 45  # A response not finished this long after the message was sent is dropped
+RESPONSE_CACHE_PATH = os.path.join(BASE_PATH, "responses.db")  # SQLite file for cached responses and pre-made greetings, None to disable
+RESPONSE_CACHE_TTL_S = 7 * 24 * 3600  # Cached responses older than this are asked again
+RESPONSE_CACHE_MAX_ENTRIES = 500  # Least recently used responses are dropped past this many
+GREETING_POOL_SIZE = 5  # Greetings generated in the background so opening the chat is instant
+LLM_STUB_URL = None  # e.g. "http://127.0.0.1:8765" to chat with stub_server.py instead of Gemini
+RATE_LIMIT_RPM = 10  # Requests per minute the key allows (free tier gemini-2.5-flash is 10), 0 for no pacing
+RATE_LIMIT_TPM = 250000  # Estimated input tokens per minute the key allows, 0 for no pacing
+RATE_LIMIT_MAX_RETRIES = 4  # Retries after a 429 or server error before giving up
+RATE_LIMIT_BACKOFF_S = 1.0  # First retry waits up to this long, doubling each time
+RATE_LIMIT_MAX_BACKOFF_S = 30.0  # Longest backoff unless the server asks for more
@@ -2,24 +2,56 @@ import os
 import platform
 import subprocess
 import tempfile
-from PyQt5.QtWidgets import QApplication, QLineEdit, QVBoxLayout, QPushButton, QDialog, QHBoxLayout, QLabel, QWidget, QTextEdit
-from PyQt5.QtGui import QColor, QPalette, QFont, QFontDatabase, QPainter, QPainterPath
+import time
+from PyQt5.QtWidgets import QLineEdit, QVBoxLayout, QPushButton, QDialog, QHBoxLayout, QLabel, QWidget, QTextEdit
+from PyQt5.QtGui import QColor, QPalette, QFont, QFontDatabase, QPainter, QPainterPath, QTextCursor
 from PyQt5.QtCore import Qt, QPoint, QRectF, QTimer
 from utils import log
+from screen_geometry import ScreenGeometry
+from config import GEMINI_MODEL
+from code_merge import plan_merge, build_prompt, parse_edits, apply_edits, atomic_write
+from rate_limiter import RequestCancelled
 
 class DialogManager:
-    def __init__(self, tails_state_machine=None, gemini_manager=None):
+    def __init__(self, tails_state_machine=None, gemini_manager=None, screen_geometry=None):
         self.tails_state_machine = tails_state_machine
         self.active_speech_bubble = None
         self.gemini_manager = gemini_manager
 
+        # Work areas are pushed here when screens change, placing dialogs never asks Qt
+        self.screen_geometry = screen_geometry or ScreenGeometry()
+        self.screen_geometry.changed.connect(self._on_screen_geometry_changed)
+        self.work_area = self.screen_geometry.primary_available
+        self.work_areas = self.screen_geometry.work_areas()
+
+        # State machine version and position the bubble was last placed for
+        self.bubble_state_version = None
+        self.bubble_position = None
+        # Text in the active bubble, so a streamed response can append to it
+        self.bubble_text = None
+        self.bubble_text_edit = None
+
         self.speech_bubble_follow_timer = QTimer()
         self.speech_bubble_follow_timer.timeout.connect(self.update_speech_bubble)
 
+    def _on_screen_geometry_changed(self):
+        self.work_area = self.screen_geometry.primary_available
+        self.work_areas = self.screen_geometry.work_areas()
+        # Re-place the bubble on the next follow tick even if Tails hasn't moved
+        self.bubble_state_version = None
+        self.bubble_position = None
+
+    def _work_area_at(self, x, y):
+        point = QPoint(x, y)
+        for work_area in self.work_areas:
+            if work_area.contains(point):
+                return work_area
+        return self.work_area
+
     def _get_tails_position(self):
         if self.tails_state_machine:
             state = self.tails_state_machine.get_state()
-            return state["position"]
+            return state.position
         return None, None
 
     def _create_temporary_parent(self, parent_x, parent_y):
@@ -106,7 +138,7 @@ class DialogManager:
         )
 
         # Position
-        screen_geometry = QApplication.primaryScreen().availableGeometry()
+        screen_geometry = self.work_area
         dialog.move(
             (screen_geometry.width() - dialog.width()) // 2,
             (screen_geometry.height() - dialog.height()) // 2,
@@ -198,7 +230,7 @@ class DialogManager:
         if dummy_parent:
             dialog.move(tails_x - dialog.width() // 2, tails_y - dialog.height() - 120)
         else:
-            screen_geometry = QApplication.primaryScreen().availableGeometry()
+            screen_geometry = self.work_area
             dialog.move(
                 (screen_geometry.width() - dialog.width()) // 2,
                 (screen_geometry.height() - dialog.height()) // 2,
@@ -221,6 +253,17 @@ class DialogManager:
             log("Speech bubble hidden.", level="INFO")
 
     def show_speech_bubble(self, text, bubble_width=300, bubble_height=100):
+        # Streaming re-sends the whole text so far, only the new part is added to the visible bubble
+        bubble = self.active_speech_bubble
+        if (bubble and bubble.isVisible() and self.bubble_text and text.startswith(self.bubble_text)
+                and bubble.width() == bubble_width and bubble.height() == bubble_height):
+            if len(text) > len(self.bubble_text):
+                self.bubble_text_edit.moveCursor(QTextCursor.End)
+                self.bubble_text_edit.insertPlainText(text[len(self.bubble_text):])
+                self.bubble_text_edit.ensureCursorVisible()
+            self.bubble_text = text
+            return
+
         self._hide_speech_bubble()
 
         tails_x, tails_y = self._get_tails_position()
@@ -334,8 +377,7 @@ class DialogManager:
             offset_x = 0
             offset_y = -bubble_dialog.height() - 10
 
-            screen = QApplication.primaryScreen()
-            screen_geometry = screen.availableGeometry()
+            screen_geometry = self._work_area_at(tails_x, tails_y)
 
             target_x = tails_x + offset_x - (bubble_dialog.width() // 2)
             target_y = tails_y + offset_y
@@ -349,13 +391,17 @@ class DialogManager:
 
             bubble_dialog.move(target_x, target_y)
         else:
-            screen_geometry = QApplication.primaryScreen().availableGeometry()
+            screen_geometry = self.work_area
             bubble_dialog.move(
                 (screen_geometry.width() - bubble_dialog.width()) // 2,
                 (screen_geometry.height() - bubble_dialog.height()) // 2,
             )
 
         self.active_speech_bubble = bubble_dialog
+        self.bubble_text = text
+        self.bubble_text_edit = text_edit
+        self.bubble_state_version = None
+        self.bubble_position = None
         bubble_dialog.show()
 
         # Removed the hide timer start
@@ -364,13 +410,23 @@ class DialogManager:
 
     def update_speech_bubble(self):
         if self.active_speech_bubble:
+            # Nothing to do unless Tails moved since the last update
+            state_machine = self.tails_state_machine
+            if state_machine:
+                if not state_machine.changed_since(self.bubble_state_version):
+                    return
+                snapshot = state_machine.get_state()
+                self.bubble_state_version = snapshot.version
+                if snapshot.position == self.bubble_position:
+                    return
+                self.bubble_position = snapshot.position
+
             tails_x, tails_y = self._get_tails_position()
             if tails_x is not None and tails_y is not None:
                 offset_x = 0
                 offset_y = -self.active_speech_bubble.height() - 10
 
-                screen = QApplication.primaryScreen()
-                screen_geometry = screen.availableGeometry()
+                screen_geometry = self._work_area_at(tails_x, tails_y)
 
                 target_x = tails_x + offset_x - (self.active_speech_bubble.width() // 2)
                 target_y = tails_y + offset_y
@@ -383,6 +439,90 @@ class DialogManager:
                 )
                 self.active_speech_bubble.move(target_x, target_y)
 
+    def _merge_code(self, file_path, file_content, code, request=None):
+        # New file content with the code merged in, only the touched functions and classes go to the model for Python files
+        start = time.perf_counter()
+        plan = plan_merge(file_content, code) if file_path.endswith(".py") and file_content.strip() else None
+        if plan is not None:
+            prompt = build_prompt(plan, file_content, code) if plan.regions else ""
+            try:
+                edits = parse_edits(self._ask_gemini(prompt, request)) if prompt else {}
+                merged = apply_edits(file_content, plan, edits)
+                log(f"Merged {len(plan.regions)} regions, {len(plan.additions)} additions and {len(plan.imports)} imports "
+                    f"with a {len(prompt)} char prompt (the whole file is {len(file_content)} chars) "
+                    f"in {(time.perf_counter() - start) * 1000:.0f} ms", level="INFO")
+                return merged
+            except ValueError as e:
+                log(f"Region merge didn't apply ({e}), merging the whole file instead", level="WARNING")
+
+        gemini_prompt = f"""
+        You are an expert code assistant. Here is the current content of the file:
+        ---FILE START---\n{file_content}\n---FILE END---
+
+        Here is the code to implement:
+        ---CODE START---\n{code}\n---CODE END---
+
+        Please update the file content by implementing the new code as needed, merging or integrating it in the most logical way. Only return the full updated file content, nothing else.
+        """
+        new_content = self.gemini_manager._extract_code(self._ask_gemini(gemini_prompt, request))
+        log(f"Merged the whole file with a {len(gemini_prompt)} char prompt in {(time.perf_counter() - start) * 1000:.0f} ms", level="INFO")
+        if not new_content:
+            log("Tails couldn't generate merged code. Writing original code to file.", level="WARNING")
+            return code
+        return new_content
+
+    def _ask_gemini(self, prompt, request=None):
+        # Same warm client as the chat
+        return self.gemini_manager.connection.call(lambda backend: backend.generate(GEMINI_MODEL, prompt), cancel=request).strip()
+
+    def _queue_merge(self, file_path, file_content, code):
+        # The model call can sit in rate limit pacing and backoff, so it runs on the LLM worker and the file is written back here
+        # file_content goes along with the result, the file isn't written if it changed while the model was working
+        finished = []
+
+        def run(request):
+            try:
+                content = self._merge_code(file_path, file_content, code, request)
+            except RequestCancelled:
+                return  # expired() below says so
+            except Exception as e:
+                log(f"Failed to merge code with Gemini model: {e}. Writing original code to file instead.", level="ERROR")
+                content = code
+            finished.append(True)
+            self.gemini_manager.write_code_signal.emit(file_path, content, file_content)
+
+        def expired(request):
+            # Also called when the merge finished past the deadline, its result was written anyway
+            if not finished:
+                self._merge_dropped(file_path, file_content, code, "timed out")
+
+        if self.gemini_manager.worker.submit(run, on_expired=expired) is None:
+            self._merge_dropped(file_path, file_content, code, "couldn't be queued")
+
+    def _merge_dropped(self, file_path, file_content, code, reason):
+        # Without a merge the snippet alone would replace the file, so an existing one is left as it is
+        if os.path.exists(file_path):
+            log(f"Merge into {file_path} {reason}, leaving the file unchanged.", level="WARNING")
+            self.gemini_manager.show_speech_bubble_signal.emit(
+                f"Merging into {os.path.basename(file_path)} {reason}, so I left it unchanged. Try Implement Code again?", 300, 100, 7000)
+        else:
+            self.gemini_manager.write_code_signal.emit(file_path, code, file_content)
+
+    def _write_code(self, file_path, content, original):
+        try:
+            current = ""
+            if os.path.exists(file_path):
+                with open(file_path, "r", encoding="utf-8") as f:
+                    current = f.read()
+            if current != original:
+                log(f"{file_path} changed while Tails was merging, not overwriting it.", level="WARNING")
+                self.show_speech_bubble(f"{os.path.basename(file_path)} changed while I was working on it, so I left it alone.")
+                return
+            atomic_write(file_path, content)
+            log(f"File {file_path} updated by Tails.", level="INFO")
+        except Exception as e:
+            log(f"Error writing {file_path}: {e}", level="ERROR")
+
     # Here because it needs to run on the GUI thread
     def _handle_code(self, code):
         selected_option = self.get_option(
@@ -408,38 +548,11 @@ class DialogManager:
                         log(f"Error reading existing file {file_path}: {e}", level="ERROR")
                         file_content = ""
 
-                if self.gemini_manager and self.gemini_manager.client and self.gemini_manager.api_key_set_successfully:
-                    gemini_prompt = f"""
-                    You are an expert code assistant. Here is the current content of the file:
-                    ---FILE START---\n{file_content}\n---FILE END---
-
-                    Here is the code to implement:
-                    ---CODE START---\n{code}\n---CODE END---
-
-                    Please update the file content by implementing the new code as needed, merging or integrating it in the most logical way. Only return the full updated file content, nothing else.
-                    """
-                    try:
-                        response = self.gemini_manager.client.models.generate_content(
-                            model="gemini-2.5-flash",
-                            contents=gemini_prompt
-                        )
-                        new_content = self.gemini_manager._extract_code(response.text.strip())
-                        if new_content:
-                            with open(file_path, "w", encoding="utf-8") as f:
-                                f.write(new_content)
-                            log(f"File {file_path} updated by Tails.", level="INFO")
-                        else:
-                            log("Tails couldn't generate merged code. Writing original code to file.", level="WARNING")
-                            with open(file_path, "w", encoding="utf-8") as f:
-                                f.write(code)
-                    except Exception as e:
-                        log(f"Failed to merge code with Gemini model: {e}. Writing original code to file instead.", level="ERROR")
-                        with open(file_path, "w", encoding="utf-8") as f:
-                            f.write(code)
+                if self.gemini_manager and self.gemini_manager.api_key_set_successfully:
+                    self._queue_merge(file_path, file_content, code)
                 else:
                     log("Gemini client not initialized or API key not set. Cannot merge code. Writing original code to file.", level="WARNING")
-                    with open(file_path, "w", encoding="utf-8") as f:
-                        f.write(code)
+                    atomic_write(file_path, code)
             else:
                 log("File path input cancelled.", level="INFO")
 
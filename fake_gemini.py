@@ -0,0 +1,59 @@
+import time
+import random
+
+# Offline stand-in for genai.Client, only the parts GeminiBackend uses
+RESPONSES = [
+    "Hey! I'm here, what are we working on?",
+    "Sure, you can reverse a list with slicing:\n```python\nitems = [1, 2, 3]\nprint(items[::-1])\n```",
+    "That error usually means the file path is wrong, try printing it before you open it.",
+    "Restarting the router fixes that more often than you'd think.",
+]
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModels:
+    def __init__(self, first_token_delay, chunk_delay, chunk_size, responses, seed):
+        self.first_token_delay = first_token_delay
+        self.chunk_delay = chunk_delay
+        self.chunk_size = chunk_size
+        self.responses = responses
+        self.rng = random.Random(seed)
+        self.calls = 0
+
+    def _pick(self, contents):
+        self.calls += 1
+        text = str(contents).lower()
+        # Code questions get the code answer so the code dialog path can be tried too
+        if "list" in text or "code" in text:
+            return self.responses[1]
+        return self.rng.choice(self.responses)
+
+    def get(self, model):
+        return FakeResponse(model)
+
+    def count_tokens(self, model, contents):
+        response = FakeResponse(None)
+        response.total_tokens = len(str(contents)) // 4 + 1
+        return response
+
+    def generate_content(self, model, contents, config=None):
+        text = self._pick(contents)
+        time.sleep(self.first_token_delay + self.chunk_delay * (len(text) // self.chunk_size))
+        return FakeResponse(text)
+
+    def generate_content_stream(self, model, contents, config=None):
+        text = self._pick(contents)
+        time.sleep(self.first_token_delay)
+        for start in range(0, len(text), self.chunk_size):
+            if start:
+                time.sleep(self.chunk_delay)
+            yield FakeResponse(text[start:start + self.chunk_size])
+
+
+class FakeGeminiClient:
+    def __init__(self, first_token_delay=0.4, chunk_delay=0.05, chunk_size=12, responses=RESPONSES, seed=0):
+        self.models = FakeModels(first_token_delay, chunk_delay, chunk_size, responses, seed)
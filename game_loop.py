@@ -0,0 +1,78 @@
+import time
+from PyQt5.QtCore import QTimer, Qt
+
+class GameLoop:
+    def __init__(self, simulate, animate, render, step_ms, animation_ms, active_fps, idle_fps,
+                 max_catchup_steps=5, slack_ms=5, poll_input=None, clock=time.monotonic):
+        self.poll_input = poll_input  # Called first on every wakeup to apply queued input
+        self.simulate = simulate  # Called with the fixed step in seconds
+        self.animate = animate  # Called once per animation frame
+        self.render = render  # Called after every wakeup, positions come from the trajectory so there's nothing to interpolate
+        self.step = step_ms / 1000.0
+        self.animation_step = animation_ms / 1000.0
+        self.active_interval = round(1000 / active_fps)
+        self.idle_interval = round(1000 / idle_fps)
+        self.max_catchup_steps = max_catchup_steps
+        # Timers fire a little early or late, a step that's due within the slack runs now instead of a wakeup later
+        self.slack = slack_ms / 1000.0
+        self.clock = clock
+
+        self.accumulator = 0.0
+        self.animation_accumulator = 0.0
+        self.last_time = None
+        self.active = False
+
+        # Counters for checking wakeups and dropped simulation time
+        self.stats = {
+            "wakeups": 0,
+            "steps": 0,
+            "animation_frames": 0,
+            "dropped_steps": 0,
+        }
+
+        self.timer = QTimer()
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self._tick)
+
+    def start(self):
+        self.last_time = self.clock()
+        self.timer.start(self.idle_interval)
+
+    def stop(self):
+        self.timer.stop()
+
+    def set_active(self, active):
+        # Render smoothly while moving, drop to one wakeup per animation frame otherwise
+        if active != self.active:
+            self.active = active
+            self.timer.setInterval(self.active_interval if active else self.idle_interval)
+
+    def _tick(self):
+        now = self.clock()
+        frame_time = now - self.last_time
+        self.last_time = now
+        self.stats["wakeups"] += 1
+
+        if self.poll_input:
+            self.poll_input()
+
+        # Fixed-step simulation, catching up on missed steps but never spiralling
+        self.accumulator += frame_time
+        steps = 0
+        while self.accumulator >= self.step - self.slack and steps < self.max_catchup_steps:
+            self.simulate(self.step)
+            self.accumulator -= self.step
+            steps += 1
+        if self.accumulator >= self.step:
+            self.stats["dropped_steps"] += int(self.accumulator // self.step)
+            self.accumulator %= self.step
+        self.stats["steps"] += steps
+
+        # Animation runs on its own clock so frame rate doesn't depend on simulation rate
+        self.animation_accumulator += frame_time
+        if self.animation_accumulator >= self.animation_step - self.slack:
+            self.animate()
+            self.stats["animation_frames"] += 1
+            self.animation_accumulator = min(self.animation_accumulator - self.animation_step, self.animation_step)
+
+        self.render()
@@ -0,0 +1,129 @@
+import time
+import threading
+
+from config import (
+    GEMINI_MODEL, GEMINI_FAKE, GEMINI_KEEPALIVE_S, GEMINI_MAX_FAILURES, LLM_STUB_URL, RATE_LIMIT_RPM, RATE_LIMIT_TPM
+)
+from llm_backend import GeminiBackend, StubBackend
+from rate_limiter import RateLimitedBackend, RequestCancelled
+from utils import log
+
+class GeminiConnection:
+    # One backend for the whole app, its HTTP connection pool is reused by every chat and by the code helper
+    def __init__(self, stub_url=LLM_STUB_URL, rpm=RATE_LIMIT_RPM, tpm=RATE_LIMIT_TPM):
+        self.lock = threading.Lock()
+        self.stub_url = stub_url
+        self.backend = None
+        # Outlives rebuilt clients so the per-minute budget isn't reset by a reconnect
+        self.limiter = RateLimitedBackend(None, rpm, tpm)
+        self.api_key = None
+        self.failures = 0  # Consecutive failed calls, the client is rebuilt once this reaches GEMINI_MAX_FAILURES
+        self.last_used = 0.0
+        self._keepalive = None
+        self._stopped = threading.Event()
+        self.stats = {
+            "builds": 0,
+            "calls": 0,
+            "failures": 0,
+            "rebuilds": 0,
+            "pings": 0,
+        }
+
+    @property
+    def needs_key(self):
+        return not (GEMINI_FAKE or self.stub_url)
+
+    def _build(self, api_key):
+        if self.stub_url:
+            return StubBackend(self.stub_url)
+        if GEMINI_FAKE:
+            from fake_gemini import FakeGeminiClient
+            return GeminiBackend(FakeGeminiClient())
+        from google import genai
+        return GeminiBackend(genai.Client(api_key=api_key))
+
+    def configure(self, api_key):
+        # Cheap when the key hasn't changed, a healthy client is kept rather than rebuilt
+        with self.lock:
+            if self.backend is not None and api_key == self.api_key and self.failures < GEMINI_MAX_FAILURES:
+                return self.backend
+            start = time.perf_counter()
+            self.limiter.backend = self._build(api_key)
+            self.backend = self.limiter
+            self.api_key = api_key
+            self.failures = 0
+            self.stats["builds"] += 1
+            log(f"Gemini client built in {(time.perf_counter() - start) * 1000:.0f} ms", level="INFO")
+            return self.backend
+
+    def warm_up(self, api_key):
+        # Runs in the background shortly after startup, builds the client and opens its connection
+        self.api_key = api_key  # Calls made before the thread gets going use the same key
+        def run():
+            try:
+                self.configure(api_key)
+                self.ping()
+            except Exception as e:
+                log(f"Gemini warm-up failed: {e}", level="WARNING")
+        threading.Thread(target=run, daemon=True).start()
+
+        if GEMINI_KEEPALIVE_S > 0 and self._keepalive is None:
+            self._keepalive = threading.Thread(target=self._keep_warm, daemon=True)
+            self._keepalive.start()
+
+    def ping(self):
+        self.call(lambda backend: backend.ping(GEMINI_MODEL), retry=False)
+        self.stats["pings"] += 1
+
+    def _keep_warm(self):
+        while not self._stopped.wait(GEMINI_KEEPALIVE_S):
+            if self.backend is None or time.monotonic() - self.last_used < GEMINI_KEEPALIVE_S:
+                continue
+            try:
+                self.ping()
+            except Exception as e:
+                log(f"Gemini keepalive ping failed: {e}", level="WARNING")
+
+    def call(self, request, retry=True, cancel=None):
+        # Runs request(backend), tracking health, a failure that leaves the client unhealthy is retried once on a fresh one.
+        # cancel is the LLMRequest the call is for, rate limit waits raise RequestCancelled once it's abandoned.
+        backend = self.backend
+        if backend is None:
+            backend = self.configure(self.api_key)
+        self.stats["calls"] += 1
+        with self.limiter.cancelled_by(cancel):
+            try:
+                result = request(backend)
+            except RequestCancelled:
+                raise
+            except Exception as e:
+                if not self.report_failure(e) or not retry:
+                    raise
+                return request(self.configure(self.api_key))
+        self.report_success()
+        return result
+
+    def report_success(self):
+        self.failures = 0
+        self.last_used = time.monotonic()
+
+    def report_failure(self, error):
+        # True when the client was thrown away and a retry would get a new one
+        code = getattr(error, "code", None)
+        if isinstance(code, int) and 400 <= code < 500:
+            # The request was bad, not the connection
+            return False
+        self.stats["failures"] += 1
+        self.failures += 1
+        log(f"Gemini call failed ({self.failures} in a row): {error}", level="WARNING")
+        if self.failures >= GEMINI_MAX_FAILURES:
+            self.stats["rebuilds"] += 1
+            self.backend = None
+            return True
+        return False
+
+    def healthy(self):
+        return self.backend is not None and self.failures < GEMINI_MAX_FAILURES
+
+    def close(self):
+        self._stopped.set()
@@ -1,35 +1,74 @@
 import sys
 import os
-import re
 import platform
 import subprocess
 import webbrowser
-from google import genai
 from PyQt5.QtWidgets import QApplication
 from PyQt5.QtGui import QFontDatabase
 from PyQt5.QtCore import QTimer, QObject, pyqtSignal
 from utils import log
 from dialog_manager import DialogManager
-import threading
+import time
+from collections import deque
+from config import GEMINI_MODEL, GEMINI_STREAMING, RESPONSE_CACHE_PATH, GREETING_POOL_SIZE
+from chat_session import ChatSession
+from gemini_connection import GeminiConnection
+from llm_worker import LLMWorker, BACKGROUND
+from response_cache import ResponseCache, persona_key
+from rate_limiter import error_code, RequestCancelled
+from code_fences import CodeFenceParser, extract_code_blocks
+
+GREETING_PROMPT = "(The user just opened the chat, greet them in one short line.)"
+
+class ResponseTimings:
+    # Time to first token and total latency for recent requests
+    def __init__(self, history=50):
+        self.requests = deque(maxlen=history)
+
+    def record(self, first_token, total, chars, streamed):
+        self.requests.append({"first_token": first_token, "total": total, "chars": chars, "streamed": streamed})
+
+    def summary(self):
+        if not self.requests:
+            return {"count": 0, "first_token_ms": 0.0, "total_ms": 0.0}
+        count = len(self.requests)
+        return {
+            "count": count,
+            "first_token_ms": sum(r["first_token"] for r in self.requests) / count * 1000,
+            "total_ms": sum(r["total"] for r in self.requests) / count * 1000,
+        }
+
 
 class GeminiManager(QObject):
     show_speech_bubble_signal = pyqtSignal(str, int, int, int)
     hide_speech_bubble_signal = pyqtSignal()
     handle_code_request_signal = pyqtSignal(str)
+    write_code_signal = pyqtSignal(str, str, str)
     set_api_key_signal = pyqtSignal()
     get_user_input_signal = pyqtSignal(str, str, bool)
     option_dialog_signal = pyqtSignal(str, list)
 
-    def __init__(self, tails_state_machine):
+    def __init__(self, tails_state_machine, screen_geometry=None, connection=None, cache_path=RESPONSE_CACHE_PATH):
         super().__init__()
-        self.client = None
+        # Built once and reused by every Talk, see warm_up()
+        self.connection = connection or GeminiConnection()
+        # Every model request runs here, off the GUI thread and one at a time
+        self.worker = LLMWorker()
+        self.cache = self._open_cache(cache_path)
         self.api_key_set_successfully = False
+        self.timings = ResponseTimings()
+        self.session = None
         self.tails_state_machine = tails_state_machine
-        self.dialog_manager = DialogManager(tails_state_machine=self.tails_state_machine, gemini_manager=self)
+        self.dialog_manager = DialogManager(
+            tails_state_machine=self.tails_state_machine,
+            gemini_manager=self,
+            screen_geometry=screen_geometry
+        )
 
         self.show_speech_bubble_signal.connect(self.dialog_manager.show_speech_bubble)
         self.hide_speech_bubble_signal.connect(self.dialog_manager._hide_speech_bubble)
         self.handle_code_request_signal.connect(self.dialog_manager._handle_code)
+        self.write_code_signal.connect(self.dialog_manager._write_code)
         self.set_api_key_signal.connect(self.set_api_key)
 
         self.tails_prompt = """
@@ -46,14 +85,38 @@ class GeminiManager(QObject):
         - Don't fill the code with comments, put comments, yes, but keep it minimal.
         """
 
+    def _open_cache(self, path):
+        if not path:
+            return None
+        try:
+            return ResponseCache(path)
+        except Exception as e:
+            # Chatting works without it, just slower
+            log(f"Couldn't open the response cache at {path}: {e}", level="WARNING")
+            return None
+
+    def warm_up(self):
+        # Called shortly after startup so the first Talk doesn't pay for client setup and the TLS handshake
+        api_key = os.environ.get("GEM")
+        if api_key or not self.connection.needs_key:
+            self.connection.warm_up(api_key)
+            self._refill_greetings()
+
+    def close(self):
+        self.worker.stop()
+        self.connection.close()
+        if self.cache:
+            self.cache.close()
+
     def _init_LLM(self, api_key):
-        if not api_key:
+        if not api_key and self.connection.needs_key:
             log("API key is empty.", level="INFO")
             return False
         try:
-            self.client = genai.Client(api_key=api_key)
+            # Reuses the warm client unless the key changed or it was marked unhealthy
+            self.connection.configure(api_key)
             self.api_key_set_successfully = True
-            log("Gemini API client initialized successfully.", level="INFO")
+            log("Gemini API client ready.", level="INFO")
             return True
         except Exception as e:
             log(f"Error initializing Gemini API with provided key: {e}", level="ERROR")
@@ -104,26 +167,174 @@ class GeminiManager(QObject):
         return self.api_key_set_successfully
 
     def _extract_code(self, response):
-        match = re.search(r"```(?:\w+)?\n(.*?)```", response, re.DOTALL)
-        if match:
-            return match.group(1).strip()
+        blocks = extract_code_blocks(response)
+        if blocks:
+            return blocks[0].code.strip()
         return None
 
-    def _generate_response(self, full_prompt, user_input):
+    def _generate(self, contents, config=None, request=None, on_code=None):
+        # Returns the full response text, retried once on a rebuilt client if the connection failed.
+        # None means the request was superseded or timed out and nothing more was shown.
         try:
-            if self.client:
-                response = self.client.models.generate_content(
-                    model="gemini-2.5-flash",
-                    contents=full_prompt
-                )
-                tails_response = response.text.strip()
+            return self.connection.call(lambda backend: self._generate_with(backend, contents, config, request, on_code), cancel=request)
+        except RequestCancelled:
+            return None
 
-                log(f"Tails: {tails_response}", level="INFO")
-                self.show_speech_bubble_signal.emit(tails_response, 300, 100, 7000)
+    def _generate_with(self, backend, contents, config, request, on_code):
+        # Streamed into the speech bubble as it arrives when enabled, on_code gets each code block once it's closed
+        start = time.perf_counter()
+        if not GEMINI_STREAMING:
+            text = backend.generate(GEMINI_MODEL, contents, config).strip()
+            if request and request.abandoned:
+                return None
+            elapsed = time.perf_counter() - start
+            self.timings.record(elapsed, elapsed, len(text), False)
+            self.show_speech_bubble_signal.emit(text, 300, 100, 7000)
+            if on_code:
+                for block in extract_code_blocks(text):
+                    on_code(block)
+            return text
+
+        text = ""
+        first_token = None
+        fences = CodeFenceParser()
+        for chunk_text in backend.stream(GEMINI_MODEL, contents, config):
+            if request and request.abandoned:
+                # Leaving the loop closes the stream, a newer message gets the bubble
+                return None
+            if first_token is None:
+                first_token = time.perf_counter() - start
+                chunk_text = chunk_text.lstrip()
+            text += chunk_text
+            # The bubble appends to itself when the new text continues what it's showing
+            self.show_speech_bubble_signal.emit(text, 300, 100, 7000)
+            if on_code:
+                for block in fences.feed(chunk_text):
+                    on_code(block)
+
+        if on_code:
+            for block in fences.finish():
+                on_code(block)
+        total = time.perf_counter() - start
+        text = text.strip()
+        self.timings.record(total if first_token is None else first_token, total, len(text), True)
+        log(f"Response took {total * 1000:.0f} ms, first token after {(first_token or total) * 1000:.0f} ms", level="INFO")
+        return text
+
+    @staticmethod
+    def _without_greeting(contents):
+        # The greeting differs every session, keeping it in the cache key would mean a first question never hits
+        kept = []
+        skip_reply = False
+        for turn in contents:
+            if turn["role"] == "user" and turn["parts"][0]["text"] == GREETING_PROMPT:
+                skip_reply = True
+                continue
+            if skip_reply and turn["role"] == "model":
+                skip_reply = False
+                continue
+            skip_reply = False
+            kept.append(turn)
+        return kept
+
+    def _send(self, message, request=None, cacheable=True, on_code=None):
+        # The chat this message belongs to, a new one may have been opened by the time the reply is in
+        session = self.session
+        contents, config = session.prepare(message)
+        key = self.cache.key(GEMINI_MODEL, self.tails_prompt, self._without_greeting(contents)) if self.cache and cacheable else None
+        reply = self.cache.get(key) if key else None
+        if reply is not None:
+            stats = self.cache.summary()
+            log(f"Answered from the response cache, hit ratio {stats['hit_ratio']:.0%}, "
+                f"{stats['saved_seconds']:.1f} s saved so far", level="INFO")
+            self.show_speech_bubble_signal.emit(reply, 300, 100, 7000)
+            if on_code:
+                for block in extract_code_blocks(reply):
+                    on_code(block)
+        else:
+            start = time.perf_counter()
+            reply = self._generate(contents, config, request, on_code)
+            if reply is None:
+                log(f"Dropped the response to request {request.id}, it was superseded or timed out", level="INFO")
+                return None
+            if key:
+                self.cache.put(key, reply, time.perf_counter() - start)
+        session.commit(message, reply)
+        log(f"Sent {session.stats['last_prompt_bytes']} prompt bytes "
+            f"({session.stats['total_prompt_bytes']} this chat, {session.stats['legacy_prompt_bytes']} without a session)", level="INFO")
+        return reply
+
+    def _greet(self, request):
+        # Only used when the greeting pool is empty, cached greetings would make every chat open the same way
+        greeting = self._send(GREETING_PROMPT, request, cacheable=False)
+        if greeting:
+            log(f"Tails: {greeting}", level="INFO")
+
+    def _pooled_greeting(self):
+        # A greeting made earlier in the background, shown without waiting on the network
+        if not self.cache:
+            return None
+        greeting = self.cache.pop_greeting(persona_key(GEMINI_MODEL, self.tails_prompt))
+        if greeting:
+            self.session.commit(GREETING_PROMPT, greeting)
+        return greeting
 
-                code = self._extract_code(tails_response)
-                if code:
-                    self.handle_code_request_signal.emit(code)
+    def _refill_greetings(self):
+        if self.cache:
+            self.worker.submit(self._refill_greeting, priority=BACKGROUND)
+
+    def _refill_greeting(self, request):
+        # One greeting per request so a message typed meanwhile only waits for a single short call
+        persona = persona_key(GEMINI_MODEL, self.tails_prompt)
+        count = self.cache.greeting_count(persona)
+        if count >= GREETING_POOL_SIZE:
+            return
+        try:
+            greeting = self.connection.call(lambda backend: backend.generate(
+                GEMINI_MODEL,
+                GREETING_PROMPT,
+                {"system_instruction": self.tails_prompt, "temperature": 1.0}
+            ), cancel=request)
+        except RequestCancelled:
+            return
+        if request.abandoned:
+            return
+        self.cache.add_greeting(persona, greeting.strip())
+        if count + 1 < GREETING_POOL_SIZE:
+            self._refill_greetings()
+
+    def _on_request_expired(self, request):
+        self.show_speech_bubble_signal.emit("That's taking way too long, try asking again?", 300, 100, 7000)
+
+    def _submit(self, run):
+        # Chat requests share a key, so a new message cancels the answer still coming for the previous one
+        request = self.worker.submit(run, key="chat", on_expired=self._on_request_expired)
+        if request is None:
+            self.show_speech_bubble_signal.emit("Still working on your last few messages, give me a sec.", 300, 100, 7000)
+            return
+        queue = self.worker.summary()
+        log(f"Queued request {request.id}, {queue['depth']} waiting, average wait {queue['wait_ms']:.0f} ms", level="INFO")
+
+    def _offer_code(self, block, offered):
+        # The first block opens the code options as soon as it's closed, while the rest of the answer streams in.
+        # offered is per response, a retried stream sends the same blocks again.
+        if any(previous.code == block.code for previous in offered):
+            return
+        offered.append(block)
+        if len(offered) == 1:
+            self.handle_code_request_signal.emit(block.code.strip())
+        else:
+            log(f"Tails sent another {block.language or 'code'} block, only the first is offered", level="INFO")
+
+    def _generate_response(self, user_input, request=None):
+        try:
+            if self.api_key_set_successfully:
+                offered = []
+                tails_response = self._send(user_input, request, on_code=lambda block: self._offer_code(block, offered))
+                if tails_response is None:
+                    return
+
+                log(f"Tails: {tails_response}", level="INFO")
 
                 unsure_phrases = ["i'm not sure", "i don't know", "let me check", "i need to look that up"]
                 if any(phrase in tails_response.lower() for phrase in unsure_phrases):
@@ -134,13 +345,18 @@ class GeminiManager(QObject):
                 self.show_speech_bubble_signal.emit("My systems are offline, can't chat right now.", 300, 100, 7000)
 
         except Exception as e:
+            if error_code(e) == 429:
+                # Still rate limited after every retry, the raw error is a wall of JSON
+                log(f"Rate limited after retrying: {e} ({self.connection.limiter.summary()})", level="WARNING")
+                self.show_speech_bubble_signal.emit("I've hit my message limit for now, try me again in a minute.", 300, 100, 7000)
+                return
             error_msg = f"Uh-oh! Something glitched during response generation: {e}"
             log(f"Tails: {error_msg}", level="ERROR")
             self.show_speech_bubble_signal.emit(error_msg, 300, 100, 7000)
 
     def chat(self):
         env_api_key = os.environ.get("GEM")
-        if env_api_key:
+        if env_api_key or not self.connection.needs_key:
             if not self._init_LLM(env_api_key):
                 self.set_api_key()
                 if not self.api_key_set_successfully:
@@ -158,15 +374,17 @@ class GeminiManager(QObject):
 
         log("Tails is booting up...", level="INFO")
         try:
-            if self.client:
-                response = self.client.models.generate_content(
-                    model="gemini-2.5-flash",
-                    contents=self.tails_prompt
-                )
-                greeting = response.text.strip()
-                log(f"Tails: {greeting}", level="INFO")
-                # Show initial greeting bubble, which will auto-hide
-                self.show_speech_bubble_signal.emit(greeting, 300, 100, 7000)
+            if self.api_key_set_successfully:
+                # New conversation, the persona is sent as the system instruction rather than with every message
+                self.session = ChatSession(self.connection, GEMINI_MODEL, self.tails_prompt)
+                # Show initial greeting bubble, which will auto-hide. A live one is generated on the worker so animation keeps running.
+                greeting = self._pooled_greeting()
+                if greeting:
+                    log(f"Tails: {greeting}", level="INFO")
+                    self.show_speech_bubble_signal.emit(greeting, 300, 100, 7000)
+                else:
+                    self._submit(self._greet)
+                self._refill_greetings()
             else:
                 log("Gemini client is not available. Cannot start chat.", level="ERROR")
                 return
@@ -182,12 +400,15 @@ class GeminiManager(QObject):
 
                 if user_input is None:
                     log("User cancelled chat input. Exiting chat loop.", level="INFO")
+                    # An answer still streaming in would write over the farewell
+                    self.worker.cancel("chat")
                     farewell = "See ya next time!"
                     log(f"Tails: {farewell}", level="INFO")
                     self.show_speech_bubble_signal.emit(farewell, 300, 100)
                     self.hide_speech_bubble_signal.emit()
                     break
                 elif user_input.lower() in ["exit", "quit"]:
+                    self.worker.cancel("chat")
                     farewell = "bye!"
                     log(f"Tails: {farewell}", level="INFO")
                     self.show_speech_bubble_signal.emit(farewell, 300, 100)
@@ -195,12 +416,11 @@ class GeminiManager(QObject):
                     break
 
                 log(f"You: {user_input}", level="INFO")
-                full_prompt = f"{self.tails_prompt}\nUser: {user_input}\nTails:"
 
-                response_thread = threading.Thread(target=self._generate_response, args=(full_prompt, user_input))
-                response_thread.start()
+                self._submit(lambda request, text=user_input: self._generate_response(text, request))
 
             except KeyboardInterrupt:
+                self.worker.cancel("chat")
                 farewell = "\nWhoa! That was fast. See ya next time!"
                 log(f"Tails: {farewell}", level="INFO")
                 self.show_speech_bubble_signal.emit(farewell, 300, 100, 7000)
@@ -209,3 +429,8 @@ class GeminiManager(QObject):
                 error_msg = f"Uh-oh! Something glitched: {e}"
                 log(f"Tails: {error_msg}", level="ERROR")
                 self.show_speech_bubble_signal.emit(error_msg, 300, 100, 7000)
+
+        if self.cache:
+            stats = self.cache.summary()
+            log(f"Response cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_ratio']:.0%}), "
+                f"{stats['saved_seconds']:.1f} s saved", level="INFO")
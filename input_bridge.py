@@ -0,0 +1,58 @@
+import time
+from collections import deque
+
+class ClickBridge:
+    def __init__(self, clock=time.monotonic, max_pending=64, history=200):
+        self.clock = clock
+        # deque.append/popleft are atomic, so the hook thread never waits on a lock
+        self._events = deque(maxlen=max_pending)
+        self._applied_at = None  # Hook timestamp of the click waiting for its first rendered frame
+        self.latencies = deque(maxlen=history)
+        self.stats = {
+            "received": 0,
+            "coalesced": 0,
+        }
+
+    def push(self, x, y):
+        # Runs on the OS hook thread, keep it to a timestamp and an append
+        self._events.append((self.clock(), x, y))
+
+    def drain(self):
+        # Runs on the GUI thread once per frame, a burst of clicks collapses to the latest target
+        oldest = latest = None
+        count = 0
+        while True:
+            try:
+                latest = self._events.popleft()
+            except IndexError:
+                break
+            if oldest is None:
+                oldest = latest
+            count += 1
+
+        if latest is None:
+            return None
+
+        self.stats["received"] += count
+        self.stats["coalesced"] += count - 1
+        if self._applied_at is None:
+            # Latency is measured from the oldest click that hasn't been rendered yet
+            self._applied_at = oldest[0]
+        return latest[1], latest[2]
+
+    def frame_rendered(self):
+        if self._applied_at is not None:
+            self.latencies.append(self.clock() - self._applied_at)
+            self._applied_at = None
+
+    def latency_stats(self):
+        # Click-to-motion latency in milliseconds over the recent history
+        if not self.latencies:
+            return {"count": 0, "mean_ms": 0.0, "p95_ms": 0.0, "max_ms": 0.0}
+        ordered = sorted(self.latencies)
+        return {
+            "count": len(ordered),
+            "mean_ms": sum(ordered) / len(ordered) * 1000,
+            "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+            "max_ms": ordered[-1] * 1000,
+        }
@@ -0,0 +1,89 @@
+import json
+import urllib.request
+import urllib.error
+from abc import ABC, abstractmethod
+
+# What Tails needs from a model, GeminiConnection.call() hands one of these to every request
+
+
+class BackendError(Exception):
+    # An HTTP-level failure, code is the status so callers can tell bad requests from outages
+    def __init__(self, code, message, retry_after=None):
+        super().__init__(f"{code}: {message}")
+        self.code = code
+        self.retry_after = retry_after  # Seconds the server asked us to wait, if it said
+
+
+class LLMBackend(ABC):
+    @abstractmethod
+    def generate(self, model, contents, config=None):
+        # Full response text
+        pass
+
+    @abstractmethod
+    def stream(self, model, contents, config=None):
+        # Yields response text in pieces as it's produced
+        pass
+
+    @abstractmethod
+    def count_tokens(self, model, contents):
+        pass
+
+    @abstractmethod
+    def ping(self, model):
+        # Cheapest request that still goes over the connection
+        pass
+
+
+class GeminiBackend(LLMBackend):
+    # genai.Client, or FakeGeminiClient which has the same shape
+    def __init__(self, client):
+        self.client = client
+
+    def generate(self, model, contents, config=None):
+        return self.client.models.generate_content(model=model, contents=contents, config=config).text or ""
+
+    def stream(self, model, contents, config=None):
+        for chunk in self.client.models.generate_content_stream(model=model, contents=contents, config=config):
+            if chunk.text:
+                yield chunk.text
+
+    def count_tokens(self, model, contents):
+        return self.client.models.count_tokens(model=model, contents=contents).total_tokens
+
+    def ping(self, model):
+        self.client.models.get(model=model)
+
+
+class StubBackend(LLMBackend):
+    # Talks to stub_server.py, so the whole chat path can be timed without the real API
+    def __init__(self, url, timeout=60):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def _open(self, path, payload=None):
+        data = json.dumps(payload).encode() if payload is not None else None
+        request = urllib.request.Request(self.url + path, data=data, headers={"Content-Type": "application/json"})
+        try:
+            return urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            retry_after = e.headers.get("Retry-After")
+            raise BackendError(e.code, e.read().decode(errors="replace"), float(retry_after) if retry_after else None)
+
+    def generate(self, model, contents, config=None):
+        with self._open("/generate", {"model": model, "contents": contents, "config": config}) as response:
+            return json.load(response)["text"]
+
+    def stream(self, model, contents, config=None):
+        # One JSON object per line, flushed as the stub produces them
+        with self._open("/stream", {"model": model, "contents": contents, "config": config}) as response:
+            for line in response:
+                if line.strip():
+                    yield json.loads(line)["text"]
+
+    def count_tokens(self, model, contents):
+        with self._open("/count_tokens", {"model": model, "contents": contents}) as response:
+            return json.load(response)["total_tokens"]
+
+    def ping(self, model):
+        self._open(f"/models/{model}").close()
@@ -0,0 +1,177 @@
+import time
+import heapq
+import itertools
+import threading
+from collections import deque
+
+from config import LLM_QUEUE_SIZE, LLM_REQUEST_TIMEOUT_S
+from utils import log
+
+# Lower runs first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+
+class LLMRequest:
+    def __init__(self, request_id, run, priority, deadline, key, on_expired=None):
+        self.id = request_id
+        self.run = run  # Called with the request on the worker thread
+        self.priority = priority
+        self.deadline = deadline  # time.monotonic() after which the result is no longer wanted
+        self.key = key  # A newer request with the same key supersedes this one
+        self.on_expired = on_expired  # Called on the worker thread if the deadline passes first
+        self.submitted = time.monotonic()
+        self.started = None
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def expired(self):
+        return time.monotonic() > self.deadline
+
+    @property
+    def abandoned(self):
+        # Checked between streamed chunks, nothing more should reach the bubble once this is True
+        return self.cancelled or self.expired
+
+    def wait(self, seconds):
+        # Sleeps up to seconds, returns True as soon as the request is cancelled or its deadline passes
+        if self._cancelled.wait(max(0.0, min(seconds, self.deadline - time.monotonic()))):
+            return True
+        return self.abandoned
+
+
+class LLMWorker:
+    # One thread runs every model request in priority order, so responses never overlap in the bubble
+    def __init__(self, max_queue=LLM_QUEUE_SIZE, timeout=LLM_REQUEST_TIMEOUT_S):
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.condition = threading.Condition()
+        self.queue = []  # Heap of (priority, order, request)
+        self.order = itertools.count()
+        self.ids = itertools.count(1)
+        self.current = None
+        self.latest = {}  # key -> newest request submitted with it
+        self.wait_times = deque(maxlen=50)
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "cancelled": 0, "expired": 0, "rejected": 0}
+        self._stopped = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, run, priority=INTERACTIVE, timeout=None, key=None, on_expired=None):
+        # Returns the queued LLMRequest, or None when the queue is full of more urgent work
+        request = LLMRequest(next(self.ids), run, priority, time.monotonic() + (timeout or self.timeout), key, on_expired)
+        with self.condition:
+            if key is not None and key in self.latest:
+                # A newer message makes the older one's answer stale, queued or already running
+                self.latest[key].cancel()
+            if len(self.queue) >= self.max_queue and not self._make_room(priority):
+                self.stats["rejected"] += 1
+                log(f"LLM queue full, dropped request {request.id}", level="WARNING")
+                return None
+            if key is not None:
+                self.latest[key] = request
+            heapq.heappush(self.queue, (priority, next(self.order), request))
+            self.stats["submitted"] += 1
+            self.condition.notify()
+        return request
+
+    def _make_room(self, priority):
+        # Cancelled requests go first, then the least urgent one if it's less urgent than the newcomer
+        live = [entry for entry in self.queue if not entry[2].cancelled]
+        if len(live) < len(self.queue):
+            self.stats["cancelled"] += len(self.queue) - len(live)
+            self.queue = live
+            heapq.heapify(self.queue)
+            return len(self.queue) < self.max_queue
+        worst = max(self.queue)
+        if worst[0] <= priority:
+            return False
+        self.queue.remove(worst)
+        heapq.heapify(self.queue)
+        worst[2].cancel()
+        self.stats["cancelled"] += 1
+        return True
+
+    def _next(self):
+        with self.condition:
+            while not self.queue and not self._stopped:
+                self.condition.wait()
+            if self._stopped:
+                return None
+            request = heapq.heappop(self.queue)[2]
+            self.current = request
+            return request
+
+    def _run(self):
+        while True:
+            request = self._next()
+            if request is None:
+                return
+            request.started = time.monotonic()
+            self.wait_times.append(request.started - request.submitted)
+            try:
+                if request.cancelled:
+                    self.stats["cancelled"] += 1
+                elif request.expired:
+                    self._expire(request)
+                else:
+                    request.run(request)
+                    if request.cancelled:
+                        self.stats["cancelled"] += 1
+                    elif request.expired:
+                        self._expire(request)
+                    else:
+                        self.stats["completed"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                log(f"LLM request {request.id} failed: {e}", level="ERROR")
+            finally:
+                with self.condition:
+                    self.current = None
+                    if request.key is not None and self.latest.get(request.key) is request:
+                        del self.latest[request.key]
+
+    def _expire(self, request):
+        self.stats["expired"] += 1
+        log(f"LLM request {request.id} missed its deadline after {time.monotonic() - request.submitted:.1f} s", level="WARNING")
+        if request.on_expired:
+            request.on_expired(request)
+
+    def cancel(self, key):
+        # Drops the newest request submitted with key, whether it's queued or running
+        with self.condition:
+            request = self.latest.get(key)
+        if request is not None:
+            request.cancel()
+
+    @property
+    def depth(self):
+        # Requests waiting, not counting the one running
+        with self.condition:
+            return sum(1 for entry in self.queue if not entry[2].cancelled)
+
+    def summary(self):
+        waits = list(self.wait_times)
+        return {
+            **self.stats,
+            "depth": self.depth,
+            "busy": self.current is not None,
+            "wait_ms": sum(waits) / len(waits) * 1000 if waits else 0.0,
+            "max_wait_ms": max(waits) * 1000 if waits else 0.0,
+        }
+
+    def stop(self):
+        with self.condition:
+            self._stopped = True
+            for _, _, request in self.queue:
+                request.cancel()
+            if self.current:
+                self.current.cancel()
+            self.condition.notify_all()
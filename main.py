@@ -37,6 +37,8 @@ if __name__ == "__main__":
 
     try:
         tails = TailsApp(PATH_CONFIG)
+        # Stops the game loop, mouse hook and LLM worker and closes the event log and response cache
+        app.aboutToQuit.connect(tails.close)
         print("This is the console for Tails, do not close this.")
     except Exception as e:
         print(e)
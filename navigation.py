@@ -0,0 +1,148 @@
+import heapq
+import math
+
+class Surface:
+    # Somewhere Tails can stand, the bottom of a screen's work area (the taskbar edge, or the screen bottom without one)
+    def __init__(self, index, x1, x2, y):
+        self.index = index
+        self.x1 = x1
+        self.x2 = x2
+        self.y = y
+
+    def clamp_x(self, x):
+        return min(max(x, self.x1), self.x2)
+
+
+class NavigationMap:
+    # Routes between screens in window coordinates (the canvas' top-left corner, like TailsStateMachine.x/y).
+    # Screens and work areas are (x, y, width, height) tuples from QApplication.screens().
+    def __init__(self, screens, work_areas, canvas_width, canvas_height):
+        self.screens = screens
+        self.work_areas = work_areas
+        self.canvas_width = canvas_width
+        self.canvas_height = canvas_height
+
+        # Tails is on a screen while the middle of his canvas is on it
+        half_w, half_h = canvas_width / 2, canvas_height / 2
+        self.regions = [(x - half_w, y - half_h, x + w - half_w, y + h - half_h) for x, y, w, h in screens]
+
+        self.surfaces = []
+        for index, (x, y, w, h) in enumerate(work_areas):
+            self.surfaces.append(Surface(index, x, max(x, x + w - canvas_width), y + h - canvas_height))
+
+        self.portals = []  # (x, y, region a, region b) where two screens touch
+        for a in range(len(self.regions)):
+            for b in range(a + 1, len(self.regions)):
+                portal = self._portal(a, b)
+                if portal:
+                    self.portals.append((portal[0], portal[1], a, b))
+
+        # Portals reachable from each region, straight lines within one screen are always valid
+        self.region_portals = [[i for i, portal in enumerate(self.portals) if region in portal[2:]]
+                               for region in range(len(self.regions))]
+
+        self.route_cache = {}  # (start surface, goal surface) -> portal indices
+        self.stats = {"lookups": 0, "searches": 0}
+
+    def _portal(self, a, b):
+        ax1, ay1, ax2, ay2 = self.regions[a]
+        bx1, by1, bx2, by2 = self.regions[b]
+        floor = min(self.surfaces[a].y, self.surfaces[b].y)
+
+        # Side by side, cross at the lower of the two floors so walks between similar screens stay low
+        if ax2 == bx1 or bx2 == ax1:
+            top, bottom = max(ay1, by1), min(ay2, by2)
+            if top <= bottom:
+                return (ax2 if ax2 == bx1 else ax1), min(max(floor, top), bottom)
+        # Stacked, cross in the middle of the shared edge
+        if ay2 == by1 or by2 == ay1:
+            left, right = max(ax1, bx1), min(ax2, bx2)
+            if left <= right:
+                return (left + right) / 2, (ay2 if ay2 == by1 else ay1)
+        return None
+
+    def region_at(self, x, y):
+        # Index of the screen containing the point, the nearest one for points in a gap
+        best, best_distance = 0, math.inf
+        for index, (x1, y1, x2, y2) in enumerate(self.regions):
+            dx = max(x1 - x, 0, x - x2)
+            dy = max(y1 - y, 0, y - y2)
+            if dx == 0 and dy == 0:
+                return index
+            distance = dx * dx + dy * dy
+            if distance < best_distance:
+                best, best_distance = index, distance
+        return best
+
+    def surface_at(self, x, y):
+        return self.surfaces[self.region_at(x, y)]
+
+    def clamp(self, x, y):
+        # Nearest point that's actually on a screen
+        x1, y1, x2, y2 = self.regions[self.region_at(x, y)]
+        return min(max(x, x1), x2), min(max(y, y1), y2)
+
+    def route(self, start, goal):
+        # Waypoints from start to goal, including both ends, with the goal moved onto a screen if needed
+        goal = self.clamp(*goal)
+        start_region = self.region_at(*start)
+        goal_region = self.region_at(*goal)
+        if start_region == goal_region:
+            return [start, goal]
+
+        self.stats["lookups"] += 1
+        key = (start_region, goal_region)
+        portals = self.route_cache.get(key)
+        if portals is None:
+            self.stats["searches"] += 1
+            portals = self._search(start_region, goal_region)
+            self.route_cache[key] = portals
+        return [start] + [self.portals[i][:2] for i in portals] + [goal]
+
+    def _search(self, start_region, goal_region):
+        # A* over portals between the two surfaces' midpoints, the result is reused for any click on the same pair
+        start_surface, goal_surface = self.surfaces[start_region], self.surfaces[goal_region]
+        start = ((start_surface.x1 + start_surface.x2) / 2, start_surface.y)
+        goal = ((goal_surface.x1 + goal_surface.x2) / 2, goal_surface.y)
+
+        def estimate(point):
+            return math.hypot(goal[0] - point[0], goal[1] - point[1])
+
+        # Search states are (portal index, region we're in after crossing it), None is the start or the goal
+        start_key, goal_key = (None, start_region), (None, None)
+        frontier = [(estimate(start), 0.0, 0, start_key)]
+        came_from = {start_key: None}
+        best_cost = {start_key: 0.0}
+        pushed = 1
+        while frontier:
+            _, cost, _, key = heapq.heappop(frontier)
+            if key == goal_key:
+                path = []
+                key = came_from[key]
+                while key[0] is not None:
+                    path.append(key[0])
+                    key = came_from[key]
+                return tuple(reversed(path))
+            if cost > best_cost[key]:
+                continue
+
+            node, region = key
+            point = start if node is None else self.portals[node][:2]
+            moves = []
+            if region == goal_region:
+                moves.append((goal_key, goal))
+            for neighbor in self.region_portals[region]:
+                x, y, a, b = self.portals[neighbor]
+                if neighbor != node:
+                    # Crossing the portal puts us on the screen on its other side
+                    moves.append(((neighbor, b if a == region else a), (x, y)))
+
+            for next_key, next_point in moves:
+                new_cost = cost + math.hypot(next_point[0] - point[0], next_point[1] - point[1])
+                if new_cost < best_cost.get(next_key, math.inf):
+                    best_cost[next_key] = new_cost
+                    came_from[next_key] = key
+                    heapq.heappush(frontier, (new_cost + estimate(next_point), new_cost, pushed, next_key))
+                    pushed += 1
+        # Screens that don't touch, fly straight there
+        return ()
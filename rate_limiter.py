@@ -0,0 +1,257 @@
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+import urllib.error
+from collections import deque
+from contextlib import contextmanager
+
+from config import RATE_LIMIT_RPM, RATE_LIMIT_TPM, RATE_LIMIT_MAX_RETRIES, RATE_LIMIT_BACKOFF_S, RATE_LIMIT_MAX_BACKOFF_S
+from chat_session import estimate_tokens
+from llm_backend import LLMBackend
+from utils import log
+
+RETRYABLE = (429, 500, 502, 503, 504)
+# Dropped or refused connections are worth another try too, a lasting outage ends up in GeminiConnection's rebuild
+TRANSIENT = (ConnectionError, TimeoutError, urllib.error.URLError)
+try:
+    # google-genai talks over httpx, whose connect/read/protocol errors aren't OSErrors
+    import httpx
+    TRANSIENT += (httpx.TransportError,)
+except ImportError:
+    pass
+
+
+class RequestCancelled(Exception):
+    # The request a call was made for was superseded or timed out while it waited on pacing or a retry
+    pass
+
+
+def error_code(error):
+    # BackendError and google.genai's APIError both carry the HTTP status as code
+    code = getattr(error, "code", None)
+    return code if isinstance(code, int) else None
+
+
+def parse_retry_after(error):
+    # Seconds the server asked for, from a Retry-After header or Gemini's RetryInfo ("retryDelay": "17s")
+    retry_after = getattr(error, "retry_after", None)
+    if retry_after is not None:
+        return float(retry_after)
+    match = re.search(r"retry(?:Delay|[ _-]after|[ _-]in)['\"]?\s*[:=]?\s*['\"]?(\d+(?:\.\d+)?)\s*s", str(error), re.IGNORECASE)
+    return float(match.group(1)) if match else None
+
+
+class TokenBucket:
+    # Refills continuously up to one minute's worth, a reservation can overdraw and the caller waits it back
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def reserve(self, amount, now):
+        # Seconds to wait before the reserved amount is really there
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= amount
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class Flight:
+    # One request in progress, identical requests made meanwhile read its chunks instead of sending their own
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.chunks = []
+        self.done = False
+        self.error = None
+
+    def add(self, chunk):
+        with self.condition:
+            self.chunks.append(chunk)
+            self.condition.notify_all()
+
+    def finish(self, error=None):
+        with self.condition:
+            self.done = True
+            self.error = error
+            self.condition.notify_all()
+
+    def follow(self):
+        index = 0
+        while True:
+            with self.condition:
+                while index == len(self.chunks) and not self.done:
+                    self.condition.wait()
+                chunks = self.chunks[index:]
+                index = len(self.chunks)
+                done, error = self.done, self.error
+            yield from chunks
+            if done and index == len(self.chunks):
+                if error:
+                    raise error
+                return
+
+
+class RateLimitedBackend(LLMBackend):
+    # Paces requests to the key's per-minute limits, backs off and retries on 429s and outages,
+    # and lets identical requests in flight at the same time share one response
+    def __init__(self, backend, rpm=RATE_LIMIT_RPM, tpm=RATE_LIMIT_TPM, max_retries=RATE_LIMIT_MAX_RETRIES,
+                 backoff=RATE_LIMIT_BACKOFF_S, max_backoff=RATE_LIMIT_MAX_BACKOFF_S, rng=None):
+        self.backend = backend
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.rng = rng or random.Random()
+        self.lock = threading.Lock()
+        self.local = threading.local()  # .request is the LLMRequest the call on this thread is for, if any
+        self.blocked_until = 0.0  # Set from a 429, nothing is sent before then
+        self.flights = {}
+        self.delays = deque(maxlen=50)
+        self.stats = {
+            "requests": 0,
+            "throttled": 0,  # Requests that waited on the buckets or a 429 pause
+            "throttle_seconds": 0.0,
+            "rate_limited": 0,  # 429s received
+            "retries": 0,
+            "coalesced": 0,
+        }
+
+    @contextmanager
+    def cancelled_by(self, request):
+        # Waits made on this thread meanwhile give up as soon as request is abandoned
+        previous = getattr(self.local, "request", None)
+        self.local.request = request
+        try:
+            yield
+        finally:
+            self.local.request = previous
+
+    def _check(self):
+        request = getattr(self.local, "request", None)
+        if request is not None and request.abandoned:
+            raise RequestCancelled(f"request {request.id} was abandoned before it was sent")
+
+    def _wait(self, seconds):
+        # A plain sleep would hold the worker and spend quota on an answer nobody wants anymore
+        request = getattr(self.local, "request", None)
+        if request is None:
+            time.sleep(seconds)
+        elif request.wait(seconds):
+            raise RequestCancelled(f"request {request.id} was abandoned while waiting {seconds:.1f} s to be sent")
+
+    def _pace(self, tokens):
+        with self.lock:
+            now = time.monotonic()
+            wait = max(0.0, self.blocked_until - now)
+            if self.requests:
+                wait = max(wait, self.requests.reserve(1, now))
+            if self.tokens:
+                wait = max(wait, self.tokens.reserve(tokens, now))
+            self.stats["requests"] += 1
+            if wait > 0:
+                self.stats["throttled"] += 1
+                self.stats["throttle_seconds"] += wait
+        self.delays.append(wait)
+        if wait > 0:
+            log(f"Throttling model request for {wait:.1f} s to stay under the rate limit", level="INFO")
+            try:
+                self._wait(wait)
+            except RequestCancelled:
+                # Nothing was sent, the next request shouldn't wait for this one's share
+                with self.lock:
+                    if self.requests:
+                        self.requests.tokens += 1
+                    if self.tokens:
+                        self.tokens.tokens += tokens
+                raise
+
+    def _backoff(self, attempt, error):
+        # Full jitter on an exponential delay, never shorter than what the server asked for
+        delay = self.rng.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        retry_after = parse_retry_after(error)
+        if error_code(error) == 429:
+            with self.lock:
+                self.stats["rate_limited"] += 1
+                if retry_after:
+                    # Everything else waits too, the limit is per key not per request
+                    self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+        if retry_after:
+            delay = max(delay, retry_after)
+        with self.lock:
+            self.stats["retries"] += 1
+        log(f"Model request failed ({error}), retrying in {delay:.1f} s", level="WARNING")
+        self._wait(delay)
+
+    def _send(self, start, tokens):
+        # Yields chunks from start(), retrying with backoff as long as nothing has been yielded yet
+        attempt = 0
+        while True:
+            self._check()
+            self._pace(tokens)
+            produced = False
+            try:
+                for chunk in start():
+                    produced = True
+                    yield chunk
+                return
+            except Exception as e:
+                retryable = error_code(e) in RETRYABLE or isinstance(e, TRANSIENT)
+                if produced or not retryable or attempt >= self.max_retries:
+                    raise
+                self._backoff(attempt, e)
+                attempt += 1
+
+    def _shared(self, kind, model, contents, config, start):
+        key = hashlib.sha256(json.dumps([kind, model, contents, config], sort_keys=True, default=str).encode()).hexdigest()
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+            else:
+                self.stats["coalesced"] += 1
+        if not leader:
+            yield from flight.follow()
+            return
+
+        tokens = estimate_tokens(json.dumps(contents, default=str)) + estimate_tokens(json.dumps(config, default=str))
+        error = None
+        try:
+            for chunk in self._send(start, tokens):
+                flight.add(chunk)
+                yield chunk
+        except BaseException as e:
+            # Includes GeneratorExit when the reader stops early, followers get the same ending
+            error = e if isinstance(e, Exception) else RuntimeError("the shared request was abandoned")
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.finish(error)
+
+    def generate(self, model, contents, config=None):
+        return "".join(self._shared("generate", model, contents, config,
+                                    lambda: iter([self.backend.generate(model, contents, config)])))
+
+    def stream(self, model, contents, config=None):
+        return self._shared("stream", model, contents, config, lambda: self.backend.stream(model, contents, config))
+
+    def count_tokens(self, model, contents):
+        return self.backend.count_tokens(model, contents)
+
+    def ping(self, model):
+        # Model metadata doesn't count against the generate quota
+        self.backend.ping(model)
+
+    def summary(self):
+        delays = list(self.delays)
+        return {
+            **self.stats,
+            "queue_delay_ms": sum(delays) / len(delays) * 1000 if delays else 0.0,
+            "max_queue_delay_ms": max(delays) * 1000 if delays else 0.0,
+        }
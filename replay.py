@@ -0,0 +1,214 @@
+import time
+import random
+import struct
+import hashlib
+import argparse
+
+from state_machine import TailsStateMachine, Event
+from navigation import NavigationMap
+from simulation import FakeClock
+from config import RECORD_FLUSH_S
+
+# Header: magic, format version, RNG seed, screen width, taskbar y, canvas size, clock at start, screen count
+HEADER = struct.Struct("<4sHQiiiidH")
+SCREEN = struct.Struct("<8i")  # Geometry then work area, x/y/width/height each
+MAGIC = b"TLOG"
+VERSION = 2
+
+# Every record starts with the event code and the state machine's clock when it was processed
+RECORD = struct.Struct("<Bd")
+CLICK = struct.Struct("<dd")
+SCREEN_CHANGED = 0x40  # Not an Event, set_screen() was called, followed by SCREEN_HEADER and the screens
+SCREEN_HEADER = struct.Struct("<iiH")  # Screen width, taskbar y, screen count
+
+
+class EventRecorder:
+    def __init__(self, path, seed, flush_s=RECORD_FLUSH_S):
+        self.path = path
+        self.seed = seed
+        self.flush_s = flush_s
+        self.file = None
+        self.events = 0
+        self.flushed = 0.0  # Machine time of the last flush
+
+    def attach(self, machine):
+        # Header describes everything replay needs to rebuild the same machine
+        self.file = open(self.path, "wb")
+        screens = self._screens(machine.navigator)
+        self.file.write(HEADER.pack(
+            MAGIC, VERSION, self.seed, machine.screen_width, machine.taskbar_y,
+            machine.canvas_width, machine.canvas_height, machine.now, len(screens)
+        ))
+        self.file.write(b"".join(screens))
+        self.flushed = machine.now
+        machine.recorder = self
+
+    @staticmethod
+    def _screens(navigator):
+        if not navigator:
+            return []
+        return [SCREEN.pack(*geometry, *work_area) for geometry, work_area in zip(navigator.screens, navigator.work_areas)]
+
+    def record_screen(self, now, screen_width, taskbar_y, navigator):
+        if self.file is None:
+            return
+        screens = self._screens(navigator)
+        self.file.write(RECORD.pack(SCREEN_CHANGED, now) + SCREEN_HEADER.pack(screen_width, taskbar_y, len(screens)))
+        self.file.write(b"".join(screens))
+        self._wrote(now)
+
+    def record(self, event, now, kwargs):
+        if self.file is None:
+            return
+        # Ticks need nothing but the clock, the machine works from timestamps rather than step sizes
+        if event == Event.RIGHT_CLICK:
+            if kwargs.get("x") is None or kwargs.get("y") is None:
+                return
+            self.file.write(RECORD.pack(event, now) + CLICK.pack(kwargs["x"], kwargs["y"]))
+        else:
+            self.file.write(RECORD.pack(event, now))
+        self._wrote(now)
+
+    def _wrote(self, now):
+        self.events += 1
+        if now - self.flushed >= self.flush_s:
+            self.file.flush()
+            self.flushed = now
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+class EventLog:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.data = f.read()
+
+        (magic, version, self.seed, self.screen_width, self.taskbar_y, self.canvas_width,
+         self.canvas_height, self.start_time, screen_count) = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} Tails event log")
+
+        self.screens, self.work_areas, self.events_offset = self._read_screens(HEADER.size, screen_count)
+
+    def _read_screens(self, offset, count):
+        screens = []
+        work_areas = []
+        for _ in range(count):
+            values = SCREEN.unpack_from(self.data, offset)
+            screens.append(values[:4])
+            work_areas.append(values[4:])
+            offset += SCREEN.size
+        return screens, work_areas, offset
+
+    def navigator(self, screens, work_areas):
+        if not screens:
+            return None
+        return NavigationMap(screens, work_areas, self.canvas_width, self.canvas_height)
+
+    def build_machine(self):
+        clock = FakeClock(self.start_time)
+        navigator = self.navigator(self.screens, self.work_areas)
+        machine = TailsStateMachine(
+            self.screen_width,
+            self.taskbar_y,
+            self.canvas_width,
+            self.canvas_height,
+            clock=clock,
+            rng=random.Random(self.seed),
+            navigator=navigator
+        )
+        return machine, clock
+
+    def events(self):
+        # Yields (event, clock time, kwargs) in recorded order, screen changes come through as SCREEN_CHANGED
+        data = self.data
+        offset = self.events_offset
+        while offset < len(data):
+            code, now = RECORD.unpack_from(data, offset)
+            offset += RECORD.size
+            if code == SCREEN_CHANGED:
+                screen_width, taskbar_y, count = SCREEN_HEADER.unpack_from(data, offset)
+                screens, work_areas, offset = self._read_screens(offset + SCREEN_HEADER.size, count)
+                yield SCREEN_CHANGED, now, {
+                    "screen_width": screen_width,
+                    "taskbar_y": taskbar_y,
+                    "navigator": self.navigator(screens, work_areas),
+                }
+                continue
+            event = Event(code)
+            if event == Event.RIGHT_CLICK:
+                x, y = CLICK.unpack_from(data, offset)
+                offset += CLICK.size
+                yield event, now, {"x": x, "y": y}
+            else:
+                yield event, now, {}
+
+
+class ReplayReport:
+    def __init__(self):
+        self.events = 0
+        self.ticks = 0
+        self.clicks = 0
+        self.wall_seconds = 0.0
+        self.simulated_seconds = 0.0
+        self.digest = ""  # Hash of the state after every event, equal digests mean identical behavior
+        self.final_state = None
+
+    def events_per_second(self):
+        return self.events / self.wall_seconds if self.wall_seconds else 0.0
+
+    def format(self):
+        state = self.final_state
+        return "\n".join([
+            f"replayed {self.events:,} events ({self.ticks:,} ticks, {self.clicks} clicks) covering "
+            f"{self.simulated_seconds / 60:.1f} min in {self.wall_seconds * 1000:.0f} ms "
+            f"({self.events_per_second():,.0f} events/s)",
+            f"final state {state.state} facing {state.direction} at {state.position}, tiredness {state.tiredness:.1f}",
+            f"digest {self.digest}",
+        ])
+
+
+def replay(path, log=None):
+    # Runs the log through a fresh state machine as fast as possible
+    log = log or EventLog(path)
+    machine, clock = log.build_machine()
+    report = ReplayReport()
+    digest = hashlib.sha1()
+    pack_state = struct.Struct("<Bddd").pack
+
+    start = time.perf_counter()
+    for event, now, kwargs in log.events():
+        clock.now = now
+        if event == SCREEN_CHANGED:
+            machine.set_screen(**kwargs)
+        else:
+            machine.process_event(event, **kwargs)
+        digest.update(pack_state(machine.state, machine.x, machine.y, machine.tiredness))
+        report.events += 1
+        if event == Event.TICK:
+            report.ticks += 1
+        elif event == Event.RIGHT_CLICK:
+            report.clicks += 1
+    report.wall_seconds = time.perf_counter() - start
+
+    report.simulated_seconds = clock.now - log.start_time
+    report.digest = digest.hexdigest()
+    report.final_state = machine.get_state()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a recorded Tails event log headlessly")
+    parser.add_argument("log")
+    parser.add_argument("--repeat", type=int, default=1, help="replay this many times and report the fastest")
+    parser.add_argument("--expect", help="digest the replay must produce, exits with an error otherwise")
+    args = parser.parse_args()
+
+    event_log = EventLog(args.log)
+    report = min((replay(args.log, event_log) for _ in range(args.repeat)), key=lambda r: r.wall_seconds)
+    print(report.format())
+    if args.expect and report.digest != args.expect:
+        raise SystemExit(f"digest mismatch, expected {args.expect}")
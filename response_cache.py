@@ -0,0 +1,136 @@
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+from config import RESPONSE_CACHE_TTL_S, RESPONSE_CACHE_MAX_ENTRIES
+from utils import log
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL,
+    latency REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+CREATE TABLE IF NOT EXISTS greetings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    persona TEXT NOT NULL,
+    text TEXT NOT NULL,
+    created REAL NOT NULL
+);
+"""
+
+
+def normalize(text):
+    # "How do I reverse a list?" and "How do I  reverse a list" share an entry. Case is kept,
+    # Foo and foo or List and list are different questions to a coding assistant
+    return re.sub(r"\s+", " ", text).strip().rstrip("?!. ")
+
+
+def persona_key(model, system_instruction):
+    return hashlib.sha256(f"{model}\n{normalize(system_instruction or '')}".encode()).hexdigest()
+
+
+class ResponseCache:
+    # Model responses in one SQLite file, keyed by model, persona and the whole conversation so far
+    def __init__(self, path, ttl=RESPONSE_CACHE_TTL_S, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        # Used from the worker thread and the GUI thread, the lock keeps them from overlapping
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "saved_seconds": 0.0, "greetings_served": 0}
+        self._purge_expired()
+
+    @staticmethod
+    def key(model, system_instruction, contents):
+        turns = [(turn["role"], normalize(turn["parts"][0]["text"])) for turn in contents]
+        payload = json.dumps([persona_key(model, system_instruction), turns], separators=(",", ":"))
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.db.execute("SELECT response, created, latency FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                self.stats["misses"] += 1
+                return None
+            self.db.execute("UPDATE responses SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+            self.db.commit()
+            self.stats["hits"] += 1
+            self.stats["saved_seconds"] += row[2]
+            return row[0]
+
+    def put(self, key, response, latency):
+        # latency is what the miss cost, every later hit counts it as saved
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created, last_used, latency) VALUES (?, ?, ?, ?, ?)",
+                (key, response, now, now, latency)
+            )
+            self.stats["stores"] += 1
+            self._evict()
+            self.db.commit()
+
+    def _evict(self):
+        # Least recently used entries go once the table is over its size
+        count = self.db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        self.db.execute(
+            "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used LIMIT ?)",
+            (count - self.max_entries,)
+        )
+        self.stats["evictions"] += count - self.max_entries
+
+    def _purge_expired(self):
+        cutoff = time.time() - self.ttl
+        with self.lock:
+            expired = self.db.execute("DELETE FROM responses WHERE created < ?", (cutoff,)).rowcount
+            self.db.execute("DELETE FROM greetings WHERE created < ?", (cutoff,))
+            self.db.commit()
+        if expired:
+            log(f"Dropped {expired} expired cached responses", level="INFO")
+
+    def pop_greeting(self, persona):
+        # Each pooled greeting is used once so opening the chat doesn't always say the same thing
+        with self.lock:
+            row = self.db.execute(
+                "SELECT id, text FROM greetings WHERE persona = ? AND created >= ? ORDER BY id LIMIT 1",
+                (persona, time.time() - self.ttl)
+            ).fetchone()
+            if row is None:
+                return None
+            self.db.execute("DELETE FROM greetings WHERE id = ?", (row[0],))
+            self.db.commit()
+            self.stats["greetings_served"] += 1
+            return row[1]
+
+    def add_greeting(self, persona, text):
+        with self.lock:
+            self.db.execute("INSERT INTO greetings (persona, text, created) VALUES (?, ?, ?)", (persona, text, time.time()))
+            self.db.commit()
+
+    def greeting_count(self, persona):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM greetings WHERE persona = ?", (persona,)).fetchone()[0]
+
+    def hit_ratio(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
+
+    def summary(self):
+        return {**self.stats, "hit_ratio": self.hit_ratio()}
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,80 @@
+import math
+
+class Timer:
+    __slots__ = ("due", "action", "cancelled")
+
+    def __init__(self, due, action):
+        self.due = due
+        self.action = action
+        self.cancelled = False
+
+
+class TimerWheel:
+    # Hashed timer wheel, a timer lives in the slot for its due tick and is only looked at when that slot comes round
+    def __init__(self, resolution=0.05, slots=256, start=0.0):
+        self.resolution = resolution
+        self.slots = [[] for _ in range(slots)]
+        self.current_tick = math.floor(start / resolution)
+        self.pending = 0
+        self.next_due = math.inf  # Earliest due time, can be early after a cancel but never late
+        self.stats = {"scheduled": 0, "fired": 0, "cancelled": 0, "slots_scanned": 0}
+
+    def schedule(self, due, action):
+        timer = Timer(due, action)
+        tick = max(math.floor(due / self.resolution), self.current_tick)
+        self.slots[tick % len(self.slots)].append(timer)
+        self.pending += 1
+        self.next_due = min(self.next_due, due)
+        self.stats["scheduled"] += 1
+        return timer
+
+    def cancel(self, timer):
+        # Removal is lazy, the slot drops it next time it's scanned
+        if timer is not None and not timer.cancelled:
+            timer.cancelled = True
+            self.pending -= 1
+            self.stats["cancelled"] += 1
+
+    def fire_due(self, now):
+        # Runs every timer due at or before now, earliest first, and returns whether any action returned True.
+        # Actions can cancel or schedule timers, one cancelled by an earlier action in the same batch doesn't run.
+        if now < self.next_due:
+            # Nothing is due yet, so there's no slot worth looking at
+            return False
+
+        result = False
+        for timer in self._collect(now):
+            if timer.cancelled:
+                continue
+            timer.cancelled = True
+            self.pending -= 1
+            self.stats["fired"] += 1
+            result = timer.action(timer.due) or result
+        return result
+
+    def _collect(self, now):
+        target = math.floor(now / self.resolution)
+        due = []
+        slots = self.slots
+        # The current slot is scanned again next time since it can still hold timers due later in this tick
+        last = min(target, self.current_tick + len(slots) - 1)
+        for tick in range(self.current_tick, last + 1):
+            slot = slots[tick % len(slots)]
+            if not slot:
+                continue
+            self.stats["slots_scanned"] += 1
+            keep = []
+            for timer in slot:
+                if timer.cancelled:
+                    continue
+                if timer.due <= now:
+                    due.append(timer)
+                else:
+                    keep.append(timer)
+            slot[:] = keep
+        self.current_tick = max(self.current_tick, target)
+        # Only after something came due or a cancel left next_due early, timers are few so a full pass is cheap
+        self.next_due = min((timer.due for slot in slots for timer in slot if not timer.cancelled), default=math.inf)
+
+        due.sort(key=lambda timer: timer.due)
+        return due
@@ -0,0 +1,58 @@
+from PyQt5.QtCore import QObject, QRect, pyqtSignal
+from PyQt5.QtWidgets import QApplication
+
+class ScreenGeometry(QObject):
+    # Screen and work-area rects read from Qt once, then only again when Qt says they changed
+    changed = pyqtSignal()
+
+    def __init__(self):
+        super().__init__()
+        self.version = 0
+        self.primary = QRect()
+        self.primary_available = QRect()
+        self.screens = []  # (geometry, available geometry) QRects for every screen, primary first
+        self._watched = set()
+
+        app = QApplication.instance()
+        app.screenAdded.connect(self._on_screens_changed)
+        app.screenRemoved.connect(self._on_screens_changed)
+        app.primaryScreenChanged.connect(self._on_screens_changed)
+        self._read()
+
+    def _read(self):
+        primary = QApplication.primaryScreen()
+        screens = [primary] + [screen for screen in QApplication.screens() if screen is not primary]
+
+        for screen in screens:
+            # Taskbar moves and resolution changes arrive per screen
+            if screen not in self._watched:
+                screen.geometryChanged.connect(self._on_screens_changed)
+                screen.availableGeometryChanged.connect(self._on_screens_changed)
+        self._watched = set(screens)
+
+        # QRects are copied so nothing holds on to a screen Qt might delete
+        self.screens = [(QRect(screen.geometry()), QRect(screen.availableGeometry())) for screen in screens]
+        self.primary, self.primary_available = self.screens[0]
+        self.version += 1
+
+    def _on_screens_changed(self, *args):
+        self._read()
+        self.changed.emit()
+
+    @property
+    def screen_width(self):
+        return self.primary.width()
+
+    @property
+    def taskbar_y(self):
+        return self.primary_available.y() + self.primary_available.height()
+
+    def rect_tuples(self):
+        # Plain (x, y, width, height) tuples for NavigationMap
+        return (
+            [(g.x(), g.y(), g.width(), g.height()) for g, _ in self.screens],
+            [(a.x(), a.y(), a.width(), a.height()) for _, a in self.screens],
+        )
+
+    def work_areas(self):
+        return [available for _, available in self.screens]
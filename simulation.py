@@ -0,0 +1,119 @@
+import math
+import time
+import random
+import argparse
+
+from state_machine import TailsStateMachine, Event
+from config import SIM_STEP_MS, CANVAS_SIZE_WIDTH, CANVAS_SIZE_HEIGHT
+
+class FakeClock:
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, dt):
+        self.now += dt
+
+
+class SimulationReport:
+    def __init__(self):
+        self.simulated_seconds = 0.0
+        self.wall_seconds = 0.0
+        self.ticks = 0
+        self.clicks = 0
+        self.transitions = 0
+        self.distance = 0.0
+        self.residency = {}  # state -> simulated seconds spent in it
+        self.tiredness_curve = []  # (simulated seconds, tiredness)
+
+    def ticks_per_second(self):
+        return self.ticks / self.wall_seconds if self.wall_seconds else 0.0
+
+    def format(self, width=40):
+        lines = [
+            f"simulated {self.simulated_seconds / 3600:.2f} h in {self.wall_seconds * 1000:.0f} ms "
+            f"({self.ticks:,} ticks, {self.ticks_per_second():,.0f} ticks/s)",
+            f"clicks {self.clicks}, transitions {self.transitions}, distance {self.distance:,.0f} px",
+            "state residency:",
+        ]
+        total = sum(self.residency.values()) or 1.0
+        for state, seconds in sorted(self.residency.items(), key=lambda item: -item[1]):
+            share = seconds / total
+            lines.append(f"  {state:<7} {'#' * round(share * width):<{width}} {share * 100:5.1f}%")
+
+        if self.tiredness_curve:
+            lines.append("tiredness:")
+            step = max(1, len(self.tiredness_curve) // 10)
+            for t, tiredness in self.tiredness_curve[::step]:
+                lines.append(f"  {t / 60:7.1f} min {'=' * round(tiredness / 100 * width):<{width}} {tiredness:5.1f}")
+        return "\n".join(lines)
+
+
+class HeadlessSimulator:
+    def __init__(self, seed=0, screen_width=1920, taskbar_y=1040, click_rate=0.0,
+                 step=SIM_STEP_MS / 1000.0, canvas_width=CANVAS_SIZE_WIDTH, canvas_height=CANVAS_SIZE_HEIGHT):
+        self.clock = FakeClock()
+        self.step = step
+        self.click_rate = click_rate  # Average right-clicks per simulated second
+        self.click_rng = random.Random(seed + 1)
+        self.machine = TailsStateMachine(
+            screen_width,
+            taskbar_y,
+            canvas_width,
+            canvas_height,
+            clock=self.clock,
+            rng=random.Random(seed)
+        )
+
+    def _maybe_click(self):
+        if self.click_rate <= 0 or self.click_rng.random() >= self.click_rate * self.step:
+            return False
+        machine = self.machine
+        x = self.click_rng.randint(0, machine.screen_width - machine.canvas_width)
+        y = self.click_rng.randint(0, machine.taskbar_y - machine.canvas_height)
+        machine.process_event(Event.RIGHT_CLICK, x=x, y=y)
+        return True
+
+    def run(self, duration, sample_every=60.0):
+        machine = self.machine
+        report = SimulationReport()
+        residency = report.residency
+        ticks = math.ceil(duration / self.step)
+        next_sample = 0.0
+
+        start = time.perf_counter()
+        for _ in range(ticks):
+            state = machine.current_state
+            x, y = machine.x, machine.y
+
+            if self._maybe_click():
+                report.clicks += 1
+
+            self.clock.advance(self.step)
+            machine.process_event(Event.TICK)
+
+            residency[state] = residency.get(state, 0.0) + self.step
+            report.distance += math.hypot(machine.x - x, machine.y - y)
+            if machine.current_state != state:
+                report.transitions += 1
+            if self.clock.now >= next_sample:
+                report.tiredness_curve.append((self.clock.now, machine.tiredness))
+                next_sample += sample_every
+
+        report.wall_seconds = time.perf_counter() - start
+        report.ticks = ticks
+        report.simulated_seconds = ticks * self.step
+        return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate Tails' behavior without a display")
+    parser.add_argument("--hours", type=float, default=8.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--click-rate", type=float, default=0.0, help="average right-clicks per second")
+    args = parser.parse_args()
+
+    simulator = HeadlessSimulator(seed=args.seed, click_rate=args.click_rate)
+    print(simulator.run(args.hours * 3600).format())
@@ -1,101 +1,415 @@
 import os
-from PyQt5.QtGui import QPixmap, QPainter
-from PyQt5.QtCore import Qt, QSize
+import threading
+from collections import OrderedDict
+from PyQt5.QtGui import QPixmap, QPainter, QImage
+from PyQt5.QtCore import Qt, QSize, QRect, QPoint
 
-from config import FRAME_COUNTS, SPRITE_CONFIG
+from config import (
+    FRAME_COUNTS, SPRITE_CONFIG, SPRITE_ATLAS, SPRITE_MIRROR_LEFT, ATLAS_MAX_SIZE, ATLAS_PADDING,
+    SPRITE_LAZY, SPRITE_CACHE_BUDGET, SPRITE_WARMUP, SPRITE_WARMUP_NEXT
+)
+from utils import log
 
-class SpriteManager:    
-    def __init__(self, path_config, canvas_size):
+class SpriteFrame:
+    def __init__(self, pixmap, source, offset, canvas_size):
+        self.pixmap = pixmap  # Texture holding the frame (atlas page or full canvas)
+        self.source = source  # Rect of the frame inside the texture
+        self.offset = offset  # Top-left of the frame on the canvas
+        self.canvas_size = canvas_size
+
+    def size(self):
+        return self.canvas_size
+
+    def target_rect(self):
+        return QRect(self.offset, self.source.size())
+
+    def window_rect(self, x, y):
+        # Screen rect of the visible pixels when the canvas sits at (x, y)
+        return QRect(x + self.offset.x(), y + self.offset.y(), self.source.width(), self.source.height())
+
+
+class SpriteAtlas:
+    def __init__(self, max_size=ATLAS_MAX_SIZE, padding=ATLAS_PADDING):
+        self.max_size = max_size
+        self.padding = padding
+        self.pages = []
+        self._pending = []
+
+    def add(self, image):
+        # Returns a slot index, placements are resolved by build()
+        self._pending.append(image)
+        return len(self._pending) - 1
+
+    def _layout(self, order, page_width):
+        # Shelf packing into pages no wider than page_width
+        placements = [None] * len(self._pending)
+        page_layouts = [[]]
+        page_sizes = []
+        x = y = shelf_height = used_width = 0
+
+        for i in order:
+            image = self._pending[i]
+            w = image.width() + self.padding
+            h = image.height() + self.padding
+
+            if x + w > page_width:
+                # Start a new shelf
+                y += shelf_height
+                x = shelf_height = 0
+            if y + h > self.max_size:
+                # Start a new page
+                page_sizes.append(QSize(used_width, y + shelf_height))
+                page_layouts.append([])
+                x = y = shelf_height = used_width = 0
+
+            page_layouts[-1].append((i, x, y))
+            placements[i] = (len(page_layouts) - 1, QRect(x, y, image.width(), image.height()))
+            x += w
+            shelf_height = max(shelf_height, h)
+            used_width = max(used_width, x)
+
+        page_sizes.append(QSize(used_width, y + shelf_height))
+        return placements, page_sizes, page_layouts
+
+    def build(self):
+        # Tallest frames first so each shelf wastes as little height as possible
+        order = sorted(range(len(self._pending)), key=lambda i: self._pending[i].height(), reverse=True)
+
+        # Try a range of page widths and keep the layout with the smallest total area
+        widest = max((image.width() + self.padding for image in self._pending), default=1)
+        best = None
+        for page_width in range(widest, self.max_size + 1, 32):
+            layout = self._layout(order, page_width)
+            area = sum(size.width() * size.height() for size in layout[1])
+            if best is None or area < best[0]:
+                best = (area, layout)
+        placements, page_sizes, page_layouts = best[1] if best else self._layout(order, self.max_size)
+
+        for size, layout in zip(page_sizes, page_layouts):
+            page = QImage(size, QImage.Format_ARGB32_Premultiplied)
+            page.fill(Qt.transparent)
+            painter = QPainter(page)
+            for i, px, py in layout:
+                painter.drawImage(px, py, self._pending[i])
+            painter.end()
+            self.pages.append(QPixmap.fromImage(page))
+
+        self._pending = []
+        return [(self.pages[page], rect) for page, rect in placements]
+
+    def memory_bytes(self):
+        return sum(p.width() * p.height() * p.depth() // 8 for p in self.pages)
+
+
+class SpriteManager:
+    def __init__(self, path_config, canvas_size, use_atlas=SPRITE_ATLAS, mirror_left=SPRITE_MIRROR_LEFT,
+                 lazy=SPRITE_LAZY, cache_budget=SPRITE_CACHE_BUDGET, warmup=SPRITE_WARMUP):
         self.path_config = path_config
         self.canvas_size = canvas_size
-        self.sprites = {}
-        
+        self.use_atlas = use_atlas
+        self.mirror_left = mirror_left
+        self.lazy = lazy
+        self.cache_budget = cache_budget
+        self.warmup = warmup
+        self.sprites = OrderedDict()  # Loaded animations, least recently used first when lazy
+        self.sprite_bytes = {}
+        self.decode_count = 0
+        self._decoded = {}
+        self._decoded_lock = threading.Lock()
+        self._warming = set()
+        self._last_key = None
+        self._fallback = None
+
         # Define frame file mappings based on actual filenames
         self.frame_mappings = {
             # Right-facing animations
             "run_R": [f"tailsRun{i}.png" for i in range(1, FRAME_COUNTS.get("run", 4) + 1)],
-            "walk_R": [f"tailsRun{i}.png" for i in range(1, FRAME_COUNTS.get("run", 4) + 1)],  # Alias for run
             "idle_R": [f"tailsIdle{i}.png" for i in range(1, FRAME_COUNTS.get("idle", 4) + 1)],
             "fly_R": [f"tailsFly{i}.png" for i in range(1, FRAME_COUNTS.get("fly", 4) + 1)],
             "sit_R": [f"tailsSit{i}.png" for i in range(1, FRAME_COUNTS.get("sit", 4) + 1)],
-            
+
             # Left-facing animations
             "run_L": [f"tailsRunB{i}.png" for i in range(1, FRAME_COUNTS.get("run", 4) + 1)],
-            "walk_L": [f"tailsRunB{i}.png" for i in range(1, FRAME_COUNTS.get("run", 4) + 1)],  # Alias for run
             "idle_L": [f"tailsIdleB{i}.png" for i in range(1, FRAME_COUNTS.get("idle", 4) + 1)],
             "fly_L": [f"tailsFlyB{i}.png" for i in range(1, FRAME_COUNTS.get("fly", 4) + 1)],
             "sit_L": [f"tailsSitB{i}.png" for i in range(1, FRAME_COUNTS.get("sit", 4) + 1)]
         }
-        
-        self._load_all_sprites()
-    
-    def _load_all_sprites(self):
+
+        # Keys that share another animation's frames
+        self.aliases = {
+            "walk_R": "run_R",
+            "walk_L": "run_L",
+        }
+
+        if self.mirror_left:
+            # Left-facing frames are mirrored from the right-facing files instead of decoding the B assets
+            for key in [k for k in self.frame_mappings if k.endswith("_L")]:
+                self.frame_mappings[key] = self.frame_mappings[key[:-2] + "_R"]
+
+        if not self.lazy:
+            self._store(self._load_sprites(list(self.frame_mappings)))
+
+    def _load_sprites(self, keys):
+        if self.use_atlas:
+            sprites = self._load_atlas(keys)
+        else:
+            sprites = self._load_all_sprites(keys)
+
+        # Decoded images are only needed while building the frames
+        with self._decoded_lock:
+            for key in keys:
+                for filename in self.frame_mappings[key]:
+                    self._decoded.pop(self._frame_path(key, filename), None)
+        return sprites
+
+    def _store(self, sprites):
+        for key, frames in sprites.items():
+            self.sprites[key] = frames
+            textures = {frame.pixmap.cacheKey(): frame.pixmap for frame in frames}
+            self.sprite_bytes[key] = sum(p.width() * p.height() * p.depth() // 8 for p in textures.values())
+
+    def _directory_type(self, key):
+        return key.split('_')[0]  # Extract animation type from key
+
+    def _frame_path(self, key, filename):
+        return os.path.join(self.path_config[self._directory_type(key)], filename)
+
+    def _load_all_sprites(self, keys):
+        sprites = {}
         # Load each animation state based on frame mappings
-        for key, frame_files in self.frame_mappings.items():
-            anim_type = key.split('_')[0]  # Extract animation type from key
-            direction = key.split('_')[1]  # Extract direction from key
-            
-            # Use run for walk
-            directory_type = "run" if anim_type == "walk" else anim_type
-            
+        for key in keys:
+            directory_type = self._directory_type(key)
+
             if directory_type in self.path_config:
                 directory = self.path_config[directory_type]
-                self.sprites[key] = self._load_frames_from_list(
-                    directory, 
-                    frame_files,
-                    self._get_y_offset_func(directory_type)
+                sprites[key] = self._load_frames_from_list(
+                    directory,
+                    self.frame_mappings[key],
+                    self._get_y_offset_func(directory_type),
+                    mirrored=self._is_mirrored(key)
                 )
-    
-    def _load_frames_from_list(self, directory, frame_files, y_offset_func):
+        return sprites
+
+    def _is_mirrored(self, key):
+        return self.mirror_left and key.endswith("_L")
+
+    def _decode(self, file_path):
+        # Safe off the GUI thread, QImage (unlike QPixmap) isn't tied to the display
+        with self._decoded_lock:
+            image = self._decoded.get(file_path)
+        if image is None:
+            image = QImage(file_path).convertToFormat(QImage.Format_ARGB32_Premultiplied)
+            with self._decoded_lock:
+                self._decoded[file_path] = image
+                self.decode_count += 1
+        return image
+
+    def _read_image(self, file_path, mirrored=False):
+        # Each file is decoded once per load, mirrored variants are derived in memory
+        image = self._decode(file_path)
+        return image.mirrored(True, False) if mirrored else image
+
+    def _load_frames_from_list(self, directory, frame_files, y_offset_func, mirrored=False):
         frames = []
         for filename in frame_files:
             file_path = os.path.join(directory, filename)
-            
+
             if not os.path.exists(file_path):
                 print(f"Warning: Frame {file_path} not found")
                 continue
-            
-            pixmap = QPixmap(file_path)
-            
+
+            image = self._read_image(file_path, mirrored)
+
             canvas = QPixmap(self.canvas_size)
             canvas.fill(Qt.transparent)
-            
+
             painter = QPainter(canvas)
-            x = (self.canvas_size.width() - pixmap.width()) // 2
-            y = y_offset_func(self.canvas_size.height(), pixmap.height())
-            painter.drawPixmap(x, y, pixmap)
+            x = (self.canvas_size.width() - image.width()) // 2
+            y = y_offset_func(self.canvas_size.height(), image.height())
+            painter.drawImage(x, y, image)
             painter.end()
-            
-            frames.append(canvas)
-        
+
+            # Tight bounds are computed once so the window only covers visible pixels
+            bounds = self._alpha_bounds(canvas.toImage())
+            frames.append(SpriteFrame(canvas, bounds, bounds.topLeft(), self.canvas_size))
+
         return frames
-    
+
+    def _load_atlas(self, keys):
+        atlas = SpriteAtlas()
+        slots = {}  # (file path, mirrored) -> (atlas slot, canvas offset)
+        key_paths = {}
+
+        for key in keys:
+            directory_type = self._directory_type(key)
+
+            if directory_type not in self.path_config:
+                continue
+
+            directory = self.path_config[directory_type]
+            y_offset_func = self._get_y_offset_func(directory_type)
+            mirrored = self._is_mirrored(key)
+            paths = []
+            for filename in self.frame_mappings[key]:
+                source = (os.path.join(directory, filename), mirrored)
+
+                if source not in slots:
+                    if not os.path.exists(source[0]):
+                        print(f"Warning: Frame {source[0]} not found")
+                        continue
+                    image, offset = self._load_trimmed_frame(source[0], y_offset_func, mirrored)
+                    slots[source] = (atlas.add(image), offset)
+                paths.append(source)
+            key_paths[key] = paths
+
+        placements = atlas.build()
+        frames = {}
+        for source, (slot, offset) in slots.items():
+            page, rect = placements[slot]
+            frames[source] = SpriteFrame(page, rect, offset, self.canvas_size)
+
+        if not self.lazy:
+            log(f"Sprite atlas: {len(atlas.pages)} textures, {atlas.memory_bytes() // 1024} KB", level="INFO")
+
+        return {key: [frames[p] for p in paths] for key, paths in key_paths.items()}
+
+    def _load_trimmed_frame(self, file_path, y_offset_func, mirrored=False):
+        image = self._read_image(file_path, mirrored)
+
+        x = (self.canvas_size.width() - image.width()) // 2
+        y = y_offset_func(self.canvas_size.height(), image.height())
+
+        # Anything hanging off the canvas was never visible in the canvas layout either
+        visible = QRect(QPoint(0, 0), self.canvas_size).translated(-x, -y)
+        bounds = self._alpha_bounds(image.copy(visible)).translated(visible.topLeft())
+        return image.copy(bounds), QPoint(x + bounds.x(), y + bounds.y())
+
+    @staticmethod
+    def _alpha_bounds(image):
+        # Tight bounds of every pixel with non-zero alpha
+        alpha = image.convertToFormat(QImage.Format_Alpha8)
+        stride = alpha.bytesPerLine()
+        width = alpha.width()
+        data = alpha.constBits().asstring(alpha.sizeInBytes())
+
+        left, right, top, bottom = width, -1, None, None
+        for row in range(alpha.height()):
+            line = data[row * stride:row * stride + width]
+            stripped = line.lstrip(b"\0")
+            if not stripped:
+                continue
+            if top is None:
+                top = row
+            bottom = row
+            left = min(left, width - len(stripped))
+            right = max(right, len(line.rstrip(b"\0")) - 1)
+
+        if top is None:
+            return QRect(0, 0, 1, 1)
+        return QRect(left, top, right - left + 1, bottom - top + 1)
+
     def _get_y_offset_func(self, animation_type):
         if animation_type == "walk":
             animation_type = "run"
-            
+
         if animation_type == "fly":
             return lambda H, h: (H - h) // 2  # Center vertically
         else:
             return lambda H, h: H - h  # Align to bottom
-    
+
+    def _get_frames(self, key):
+        key = self.aliases.get(key, key)
+
+        frames = self.sprites.get(key)
+        if frames is not None:
+            if self.lazy:
+                self.sprites.move_to_end(key)
+            return frames
+
+        if not self.lazy or key not in self.frame_mappings:
+            return None
+
+        self._store(self._load_sprites([key]))
+        self._evict()
+        return self.sprites.get(key)
+
+    def _evict(self):
+        # Drop least recently used animations until we're back under budget, never the one in use
+        while len(self.sprites) > 1 and sum(self.sprite_bytes.values()) > self.cache_budget:
+            key, _ = self.sprites.popitem(last=False)
+            del self.sprite_bytes[key]
+
+    def _schedule_warmup(self, key):
+        state, direction = key.split('_')
+        opposite = "L" if direction == "R" else "R"
+        candidates = [f"{state}_{opposite}"] + [f"{s}_{direction}" for s in SPRITE_WARMUP_NEXT.get(state, [])]
+
+        candidates = [self.aliases.get(c, c) for c in candidates if self.aliases.get(c, c) in self.frame_mappings]
+
+        # Only the latest predictions stay decoded, so the idle footprint doesn't grow with every warm-up
+        keep = {self._frame_path(c, filename) for c in candidates for filename in self.frame_mappings[c]}
+        with self._decoded_lock:
+            for file_path in [p for p in self._decoded if p not in keep]:
+                del self._decoded[file_path]
+
+        keys = [c for c in candidates if c not in self.sprites and c not in self._warming]
+        if not keys:
+            return
+
+        self._warming.update(keys)
+        threading.Thread(target=self._warm_up, args=(keys,), daemon=True).start()
+
+    def _warm_up(self, keys):
+        # Decode only, the GUI thread turns the images into pixmaps when the animation is first shown
+        for key in keys:
+            for filename in self.frame_mappings[key]:
+                file_path = self._frame_path(key, filename)
+                if os.path.exists(file_path):
+                    self._decode(file_path)
+            self._warming.discard(key)
+
+    def memory_report(self):
+        # Legacy layout keeps one full canvas per frame per key, aliases included
+        canvas_bytes = self.canvas_size.width() * self.canvas_size.height() * 4
+        legacy_frames = sum(len(files) for files in self.frame_mappings.values())
+        legacy_frames += sum(len(self.frame_mappings[key]) for key in self.aliases.values())
+
+        textures = {}
+        for frames in self.sprites.values():
+            for frame in frames:
+                textures[frame.pixmap.cacheKey()] = frame.pixmap
+        current_bytes = sum(p.width() * p.height() * p.depth() // 8 for p in textures.values())
+
+        return {
+            "layout": "atlas" if self.use_atlas else "legacy",
+            "frames": legacy_frames,
+            "loaded_animations": len(self.sprites),
+            "textures": len(textures),
+            "legacy_bytes": legacy_frames * canvas_bytes,
+            "current_bytes": current_bytes,
+        }
+
     def get_sprite(self, state, direction, frame_index):
         key = f"{state}_{direction}"
-        
-        if key not in self.sprites:
+        frames = self._get_frames(key)
+
+        if not frames:
             print(f"Warning: Sprite set {key} not found")
-            fallback = QPixmap(self.canvas_size)
-            fallback.fill(Qt.transparent)
-            return fallback
-        
-        frames = self.sprites[key]
-        
+            if self._fallback is None:
+                fallback = QPixmap(self.canvas_size)
+                fallback.fill(Qt.transparent)
+                self._fallback = SpriteFrame(fallback, fallback.rect(), QPoint(0, 0), self.canvas_size)
+            return self._fallback
+
+        if self.lazy and self.warmup and key != self._last_key:
+            self._last_key = key
+            self._schedule_warmup(self.aliases.get(key, key))
+
         if state == "sit" and frame_index >= len(frames):
             # After the first complete loop, only use frames 5-10 for sitting
             # (indexes 4 to 9)
             frame_index = ((frame_index - 4) % 6) + 4
         else:
             frame_index = frame_index % len(frames)
-        
+
         return frames[frame_index]
-    
\ No newline at end of file
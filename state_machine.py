@@ -2,26 +2,131 @@ import time
 import math
 import random
 from threading import Lock
-from enum import Enum, auto
+from enum import IntEnum
 
 from config import (
-    STATE_TRANSITIONS, WALK_INCREMENT, FLY_INCREMENT, 
+    STATE_TRANSITIONS, INITIAL_STATE, WALK_SPEED, FLY_SPEED, LANDING_ARC_LIFT,
     CIRCLE_DURATION, CIRCLE_RADIUS, TIREDNESS_DECREASE_RATE, 
-    TIREDNESS_RECOVERY_RATE, TIRED_THRESHOLD, RECOVERY_THRESHOLD
+    TIREDNESS_RECOVERY_RATE, TIRED_THRESHOLD, RECOVERY_THRESHOLD,
+    SCHEDULER_RESOLUTION_MS, SCHEDULER_SLOTS
 )
+from trajectory import LineSegment, PolylineSegment, EasedArcSegment, CircleSegment
+from scheduler import TimerWheel
+from utils import log
 
-class Event(Enum):
-    RIGHT_CLICK = auto()
-    TARGET_REACHED = auto()
-    TIRED = auto()
-    RECOVERED = auto()
-    CIRCLE_COMPLETE = auto()
-    TICK = auto()  # Regular timer tick
+class Event(IntEnum):
+    RIGHT_CLICK = 0
+    TARGET_REACHED = 1
+    TIRED = 2
+    RECOVERED = 3
+    CIRCLE_COMPLETE = 4
+    TICK = 5  # Regular timer tick
+    WANDER = 6  # Idle wander roll came up
+    SIT_REQUESTED = 7  # "Sit" from the context menu
+    STAND_REQUESTED = 8  # "Stand" from the context menu
+
+
+class State(IntEnum):
+    IDLE = 0
+    WALK = 1
+    FLY = 2
+    CIRCLE = 3
+    SIT = 4
+    HOVER = 5
+
+
+STATE_NAMES = tuple(state.name.lower() for state in State)
+MOVING_STATES = (State.WALK, State.FLY, State.CIRCLE)
+GROUNDED_STATES = (State.WALK, State.SIT, State.IDLE)
+# What the sprites show for each state
+DISPLAY_NAMES = ("idle", "walk", "fly", "fly", "sit", "idle")
+
+
+class TransitionTable:
+    # STATE_TRANSITIONS compiled into tuples indexed by [state][event], each entry the allowed next states
+    def __init__(self, transitions, initial_state=INITIAL_STATE):
+        self.problems = []
+        states = {name: State[name.upper()] for name in STATE_NAMES}
+
+        for name in transitions:
+            if name not in states:
+                raise ValueError(f"STATE_TRANSITIONS declares unknown state '{name}'")
+        events = {event.name.lower(): event for event in Event}
+
+        table = []
+        for name in STATE_NAMES:
+            rules = transitions.get(name)
+            if rules is None:
+                self.problems.append(f"state '{name}' has no transitions declared")
+                rules = {}
+
+            compiled = {}
+            for event_name, targets in rules.items():
+                if event_name != "default" and event_name not in events:
+                    raise ValueError(f"STATE_TRANSITIONS['{name}'] uses unknown event '{event_name}'")
+                targets = targets if isinstance(targets, list) else [targets]
+                for target in targets:
+                    if target not in states:
+                        raise ValueError(f"STATE_TRANSITIONS['{name}']['{event_name}'] targets undeclared state '{target}'")
+                compiled[event_name] = tuple(states[target] for target in targets)
+
+            default = compiled.get("default", (states[name],))
+            table.append(tuple(compiled.get(event.name.lower(), default) for event in Event))
+        self.targets = tuple(table)
+
+        # Every state should be reachable from the initial one
+        reachable = {states[initial_state]}
+        frontier = [states[initial_state]]
+        while frontier:
+            state = frontier.pop()
+            for targets in self.targets[state]:
+                for target in targets:
+                    if target not in reachable:
+                        reachable.add(target)
+                        frontier.append(target)
+        for state in State:
+            if state not in reachable:
+                self.problems.append(f"state '{STATE_NAMES[state]}' is unreachable from '{initial_state}'")
+
+    def allows(self, state, event, target):
+        return target in self.targets[state][event]
+
+
+TRANSITION_TABLE = TransitionTable(STATE_TRANSITIONS)
+for problem in TRANSITION_TABLE.problems:
+    log(f"State transitions: {problem}", level="WARNING")
+
+
+class StateSnapshot:
+    # Immutable view of the state machine, a new one is only built after something changes
+    __slots__ = ("version", "state", "direction", "frame_index", "position", "tiredness")
+
+    def __init__(self, version, state, direction, frame_index, position, tiredness):
+        self.version = version
+        self.state = state
+        self.direction = direction
+        self.frame_index = frame_index
+        self.position = position
+        self.tiredness = tiredness
+
+    def __getitem__(self, key):
+        # Keeps dict-style access working for older callers
+        return getattr(self, key)
 
 
 class TailsStateMachine:
-    def __init__(self, screen_width, taskbar_y, canvas_width, canvas_height):
+    def __init__(self, screen_width, taskbar_y, canvas_width, canvas_height, clock=time.time, rng=random,
+                 table=TRANSITION_TABLE, navigator=None, recorder=None):
         self.lock = Lock()
+
+        # Injectable so behavior can be simulated headlessly and reproduced
+        self.clock = clock
+        self.rng = rng
+        self.table = table
+        # NavigationMap for multi-monitor setups, without one Tails stays on a single screen
+        self.navigator = navigator
+        # EventRecorder that logs every event for replay.py
+        self.recorder = recorder
         
         # Position state
         self.x = screen_width // 2 - canvas_width // 2 
@@ -31,176 +136,324 @@ class TailsStateMachine:
         self.canvas_width = canvas_width
         
         # Animation state
-        self.current_state = "sit" 
+        self.state = State[INITIAL_STATE.upper()]
         self.direction = "R"
         self.frame_index = 0
         
-        # Movement state
+        # Movement state, position while moving is evaluated from the segment rather than stepped
         self.target = None
-        self.circle_start_time = None
-        self.circle_center = None
+        self.segment = None
         
-        # Tiredness state (100 = full energy, 0 = tired)
+        # Tiredness state (100 = full energy, 0 = tired), changes at tiredness_rate per second
         self.tiredness = 100.0
-        self.last_update_time = time.time()
+        self.tiredness_rate = 0.0
+        self.last_update_time = self.clock()
+        # Clock is read once per event so a replayed event sees exactly the same time
+        self.now = self.last_update_time
         
         self.forced_sit = False 
-        self.idle_time = 0 
         self.screen_width = screen_width  
+
+        # Wandering, tiredness thresholds and segment ends are timers, a tick only does work when one is due
+        self.timers = TimerWheel(SCHEDULER_RESOLUTION_MS / 1000.0, SCHEDULER_SLOTS, start=self.now)
+        self._segment_timer = None
+        self._tiredness_timer = None
+        self._wander_timer = None
+        self._planned = None  # (state, forced_sit) the timers were last armed for
+
+        # Bumped on every change that's visible through get_state()
+        self.version = 0
+        self._snapshot = None
+
+        # Dispatch tables, indexed by Event and State
+        self._event_handlers = (
+            self._on_right_click,  # RIGHT_CLICK
+            None,  # TARGET_REACHED
+            None,  # TIRED
+            None,  # RECOVERED
+            None,  # CIRCLE_COMPLETE
+            self._on_tick,  # TICK
+            None,  # WANDER
+            self._on_sit_requested,  # SIT_REQUESTED
+            self._on_stand_requested,  # STAND_REQUESTED
+        )
+        self._plan()
+
+    @property
+    def current_state(self):
+        return STATE_NAMES[self.state]
+
+    @current_state.setter
+    def current_state(self, name):
+        self.state = State[name.upper()]
+
+    @property
+    def ground_y(self):
+        if self.navigator:
+            return self.navigator.surface_at(self.x, self.y).y
+        return self.taskbar_y - self.canvas_height
     
     def process_event(self, event, **kwargs):
         with self.lock:
-            old_state = self.current_state
-            
-            if event == Event.RIGHT_CLICK:
-                # Handle right click
-                target_x = kwargs.get('x')
-                target_y = kwargs.get('y')
-                
-                if target_x is None or target_y is None:
-                    return False
-                
-                # whether to walk or fly based on vertical distance
-                vertical_distance = abs(target_y - self.y)
-                new_state = "fly" if vertical_distance > 75 else "walk"
-                
-                self.target = (target_x, target_y)
-                self.current_state = new_state
-                self.circle_start_time = None
-                
-                self.direction = "L" if target_x < self.x else "R"
-                
-                return old_state != self.current_state
-            
-            elif event == Event.TICK:
-                dt = kwargs.get('dt', 0)
-                return self._update_state(dt)
-            
-            next_state = self._get_next_state(event)
-            if next_state != self.current_state:
-                self.current_state = next_state
-                self.frame_index = 0
-                return True
-                
-            return False
-    
-    def _get_next_state(self, event):
-        event_name = event.name.lower()
-        
-        transitions = STATE_TRANSITIONS.get(self.current_state, {})
-        
-        next_state = transitions.get(event_name, transitions.get("default", self.current_state))
-        
-        if isinstance(next_state, list):
-            next_state = next_state[0]
-            
-        return next_state
-    
-    def _update_state(self, dt):
-        state_changed = False
-        
-        # Update tiredness based on current state
-        if self.current_state == "walk":
-            self.tiredness = max(0, self.tiredness - TIREDNESS_DECREASE_RATE * dt)
-            # Check if tired
-            if self.tiredness < TIRED_THRESHOLD:
-                self.current_state = "sit"
-                self.frame_index = 0
-                state_changed = True
-        elif self.current_state == "sit":
-            self.tiredness = min(100, self.tiredness + (TIREDNESS_RECOVERY_RATE * 0.5) * (dt / 2.0))
-            if self.tiredness > RECOVERY_THRESHOLD and not self.forced_sit:
-                self.current_state = "idle"
-                self.frame_index = 0
-                state_changed = True
-        
-        if self.current_state in ("walk", "fly") and self.target:
-            dx = self.target[0] - self.x
-            dy = self.target[1] - self.y
-            distance = math.hypot(dx, dy)
-            increment = WALK_INCREMENT if self.current_state == "walk" else FLY_INCREMENT
-
-            if distance > increment:
-                # Continue moving
-                angle = math.atan2(dy, dx)
-                self.x += math.cos(angle) * increment
-                self.y += math.sin(angle) * increment
-                self.direction = "L" if dx < 0 else "R"
+            self.now = self.clock()
+            if self.recorder:
+                self.recorder.record(event, self.now, kwargs)
+            before = (self.state, self.direction, self.frame_index, self.x, self.y, self.tiredness)
+            handler = self._event_handlers[event]
+            if handler:
+                changed = handler(**kwargs)
             else:
-                # Target reached
-                self.x = self.target[0]
-                self.y = self.target[1]
-
-                if self.current_state == "fly":
-                    self.current_state = "circle"
-                    self.circle_start_time = time.time()
-                    self.circle_center = (self.x, self.y)
-                    self.frame_index = 0
-                    state_changed = True
+                changed = self._transition(event)
+            if (self.state, self.forced_sit) != self._planned:
+                self._plan()
+            if before != (self.state, self.direction, self.frame_index, self.x, self.y, self.tiredness):
+                self.version += 1
+            return changed
+
+    def _transition(self, event, target=None, reset_frame=True):
+        # Move to target if the table allows it, the first allowed state when no target is given
+        allowed = self.table.targets[self.state][event]
+        if target is None:
+            target = allowed[0]
+        elif target not in allowed:
+            return False
+
+        if target == self.state:
+            return False
+        self.state = target
+        if reset_frame:
+            self.frame_index = 0
+        return True
+
+    def set_screen(self, screen_width, taskbar_y, navigator=None):
+        # Pushed by the screen geometry service after a resolution, monitor or taskbar change
+        with self.lock:
+            self.now = self.clock()
+            if self.recorder:
+                self.recorder.record_screen(self.now, screen_width, taskbar_y, navigator)
+            self.screen_width = screen_width
+            self.taskbar_y = taskbar_y
+            self.navigator = navigator
+
+            # Standing or sitting Tails follows the taskbar instead of floating where it used to be
+            if self.state in (State.IDLE, State.SIT):
+                if navigator:
+                    self.x, self.y = navigator.surface_at(self.x, self.y).clamp_x(self.x), self.ground_y
                 else:
-                    if abs(self.y - (self.taskbar_y - self.canvas_height)) < 5:
-                        self.current_state = "idle"
-                        self.y = self.taskbar_y - self.canvas_height
-                    else:
-                        self.current_state = "hover"
-                    self.frame_index = 0
-                    state_changed = True
-                self.target = None
-        
-        elif self.current_state == "circle" and self.circle_start_time:
-            elapsed = time.time() - self.circle_start_time
-            if elapsed < CIRCLE_DURATION:
-                angle = (elapsed / CIRCLE_DURATION) * 2 * math.pi
-                self.x = self.circle_center[0] + CIRCLE_RADIUS * math.cos(angle)
-                self.y = self.circle_center[1] + CIRCLE_RADIUS * math.sin(angle)
-                self.direction = "L" if math.cos(angle) < 0 else "R"
+                    self.x, self.y = min(max(self.x, 0), max(0, screen_width - self.canvas_width)), self.ground_y
+            self.version += 1
+
+    def _on_right_click(self, x=None, y=None, **kwargs):
+        if x is None or y is None:
+            return False
+
+        # whether to walk or fly based on vertical distance
+        vertical_distance = abs(y - self.y)
+        new_state = State.FLY if vertical_distance > 75 else State.WALK
+        if not self.table.allows(self.state, Event.RIGHT_CLICK, new_state):
+            return False
+
+        speed = FLY_SPEED if new_state == State.FLY else WALK_SPEED
+        if self.navigator:
+            # Go around gaps between screens instead of straight through them
+            route = self.navigator.route((self.x, self.y), (x, y))
+            x, y = route[-1]
+            if len(route) > 2:
+                self._start_segment(PolylineSegment(route, speed, self.now))
             else:
-                # Circle complete
-                self.current_state = "idle"
-                self.circle_start_time = None
-                state_changed = True
-        
-        if self.current_state in ("walk", "sit", "idle"):
-            y_ground = self.taskbar_y - self.canvas_height
-            if abs(self.y - y_ground) < 5:
-                self.y = y_ground
-        elif self.current_state == "idle":
-            if abs(self.y - (self.taskbar_y - self.canvas_height)) < 5:
-                self.y = self.taskbar_y - self.canvas_height
-        
-        # Random walk when idle
-        if self.current_state == "idle":
-            self.idle_time += dt
-            # Every 2-5 seconds, 20% chance to start walking
-            if self.idle_time > random.uniform(2, 5) and random.random() < 0.2:
-                # Pick a random x position within screen bounds
-                new_x = random.randint(0, self.screen_width - self.canvas_width)
-                y_ground = self.taskbar_y - self.canvas_height
-                self.target = (new_x, y_ground)
-                self.current_state = "walk"
-                self.frame_index = 0
-                self.idle_time = 0
-                state_changed = True
+                self._start_segment(LineSegment(route[0], route[1], speed, self.now))
+        else:
+            self._start_segment(LineSegment((self.x, self.y), (x, y), speed, self.now))
+        self.direction = "L" if x < self.x else "R"
+        return self._transition(Event.RIGHT_CLICK, new_state, reset_frame=False)
+
+    def _on_sit_requested(self, **kwargs):
+        if self.state == State.SIT:
+            return False
+        if not self._transition(Event.SIT_REQUESTED, State.SIT):
+            return False
+        self._clear_segment()
+        self.forced_sit = True
+        return True
+
+    def _on_stand_requested(self, **kwargs):
+        if DISPLAY_NAMES[self.state] == "idle":
+            return False
+
+        # If in air, fly down to ground
+        if DISPLAY_NAMES[self.state] == "fly" and abs(int(self.y) - self.ground_y) > 5:
+            if not self.table.allows(self.state, Event.STAND_REQUESTED, State.FLY):
+                return False
+            # Eased drop with a slight sideways swoop instead of a straight line
+            start, end = (self.x, self.y), (int(self.x), self.ground_y)
+            duration = math.hypot(end[0] - start[0], end[1] - start[1]) / FLY_SPEED
+            self._start_segment(EasedArcSegment(start, end, self.now, duration, LANDING_ARC_LIFT))
+            self.state = State.FLY
+            self.frame_index = 0
+            changed = True
         else:
-            self.idle_time = 0
+            changed = self._transition(Event.STAND_REQUESTED, State.IDLE)
+        self.forced_sit = False
+        return changed
+
+    def _on_tick(self):
+        return self._update_state()
 
+    def _get_next_state(self, event):
+        return STATE_NAMES[self.table.targets[self.state][event][0]]
+
+    def _update_state(self):
+        # Timed behaviors come off the timer wheel, movement is sampled from the segment
+        now = self.now
+        self._update_tiredness(now)
+
+        state_changed = self.timers.fire_due(now)
+
+        moving = self.segment is not None and self.state in MOVING_STATES
+        if moving:
+            self._sample_segment(now)
+
+        if (moving or state_changed) and self.state in GROUNDED_STATES:
+            if abs(self.y - self.ground_y) < 5:
+                self.y = self.ground_y
         return state_changed
+
+    def _update_tiredness(self, now):
+        if self.tiredness_rate:
+            self.tiredness = min(100, max(0, self.tiredness + self.tiredness_rate * (now - self.last_update_time)))
+        self.last_update_time = now
+
+    def _plan(self):
+        # Arm the timers for the state we just entered, the next wander roll or tiredness threshold is worked out once here
+        now = self.now
+        self._update_tiredness(now)
+        self._planned = (self.state, self.forced_sit)
+        self.timers.cancel(self._tiredness_timer)
+        self.timers.cancel(self._wander_timer)
+        self._tiredness_timer = self._wander_timer = None
+
+        if self.state == State.WALK:
+            self.tiredness_rate = -TIREDNESS_DECREASE_RATE
+            due = now + max(0, self.tiredness - TIRED_THRESHOLD) / TIREDNESS_DECREASE_RATE
+            self._tiredness_timer = self.timers.schedule(due, self._on_tired)
+        elif self.state == State.SIT:
+            self.tiredness_rate = (TIREDNESS_RECOVERY_RATE * 0.5) / 2.0
+            if not self.forced_sit:
+                due = now + max(0, RECOVERY_THRESHOLD - self.tiredness) / self.tiredness_rate
+                self._tiredness_timer = self.timers.schedule(due, self._on_recovered)
+        else:
+            self.tiredness_rate = 0.0
+            if self.state == State.IDLE:
+                # Every 2-5 seconds, 20% chance to start walking
+                self._wander_timer = self.timers.schedule(now + self.rng.uniform(2, 5), self._on_wander_roll)
+
+    def _on_tired(self, due):
+        if self.state != State.WALK:
+            return False
+        self._clear_segment()
+        return self._transition(Event.TIRED, State.SIT)
+
+    def _on_recovered(self, due):
+        if self.state != State.SIT or self.forced_sit:
+            return False
+        return self._transition(Event.RECOVERED, State.IDLE)
+
+    def _on_wander_roll(self, due):
+        if self.state != State.IDLE:
+            return False
+        if self.rng.random() >= 0.2:
+            # Next roll is timed from this one rather than from the tick that noticed it
+            self._wander_timer = self.timers.schedule(due + self.rng.uniform(2, 5), self._on_wander_roll)
+            return False
+
+        # Pick a random x position within screen bounds
+        if self.navigator:
+            surface = self.navigator.surface_at(self.x, self.y)
+            new_x, ground_y = self.rng.randint(int(surface.x1), int(surface.x2)), surface.y
+        else:
+            new_x, ground_y = self.rng.randint(0, self.screen_width - self.canvas_width), self.ground_y
+        self._start_segment(LineSegment((self.x, self.y), (new_x, ground_y), WALK_SPEED, self.now))
+        return self._transition(Event.WANDER, State.WALK)
+
+    def _start_segment(self, segment):
+        self.timers.cancel(self._segment_timer)
+        self.segment = segment
+        self.target = segment.end
+        self._segment_timer = self.timers.schedule(segment.end_time, self._on_segment_end)
+
+    def _clear_segment(self):
+        self.timers.cancel(self._segment_timer)
+        self._segment_timer = None
+        self.segment = None
+        self.target = None
+
+    def _sample_segment(self, now):
+        self.x, self.y = self.segment.position_at(now)
+        self.direction = "L" if self.segment.facing_left_at(now) else "R"
+
+    def _on_segment_end(self, due):
+        segment = self.segment
+        self._segment_timer = None
+        if segment is None:
+            return False
+
+        if self.state == State.CIRCLE:
+            # Circle complete, it ends where it started
+            self.x, self.y = segment.end
+            self._clear_segment()
+            return self._transition(Event.CIRCLE_COMPLETE, State.IDLE, reset_frame=False)
+        if self.state not in (State.WALK, State.FLY):
+            return False
+
+        # Target reached
+        self.x, self.y = segment.end
+        self._clear_segment()
+
+        if self.state == State.FLY:
+            # Circling is timed from when the flight actually ended, not from this tick
+            self._start_segment(CircleSegment.through((self.x, self.y), CIRCLE_RADIUS, due, CIRCLE_DURATION))
+            return self._transition(Event.TARGET_REACHED, State.CIRCLE)
+
+        if abs(self.y - self.ground_y) < 5:
+            self.y = self.ground_y
+            return self._transition(Event.TARGET_REACHED, State.IDLE)
+        return self._transition(Event.TARGET_REACHED, State.HOVER)
+
+    def position_at(self, t=None):
+        # Where Tails is at time t, in between simulation steps while moving
+        segment = self.segment
+        if segment is None or self.state not in (State.WALK, State.FLY, State.CIRCLE):
+            return int(self.x), int(self.y)
+        x, y = segment.position_at(self.clock() if t is None else t)
+        return int(x), int(y)
     
     def get_state(self):
+        # Lock-free when nothing changed, readers share the last snapshot
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == self.version:
+            return snapshot
+
+        with self.lock:
+            snapshot = StateSnapshot(
+                self.version,
+                DISPLAY_NAMES[self.state],
+                self.direction,
+                self.frame_index,
+                (int(self.x), int(self.y)),
+                self.tiredness
+            )
+            self._snapshot = snapshot
+            return snapshot
+
+    def changed_since(self, version):
+        return self.version != version
+
+    def mark_changed(self):
+        # For callers that set attributes directly
         with self.lock:
-            display_state = self.current_state
-            if self.current_state == "circle":
-                display_state = "fly"
-            if self.current_state == "hover":
-                display_state = "idle"
-            return {
-                "state": display_state,
-                "direction": self.direction,
-                "frame_index": self.frame_index,
-                "position": (int(self.x), int(self.y)),
-                "tiredness": self.tiredness
-            }
+            self.version += 1
     
     def increment_frame(self):
         with self.lock:
-            self.frame_index += 1
\ No newline at end of file
+            self.frame_index += 1
+            self.version += 1
@@ -0,0 +1,161 @@
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from fake_gemini import RESPONSES
+
+# Local stand-in for the Gemini API with made-up latency, for benchmarks and offline testing.
+# Point Tails at it with LLM_STUB_URL in config.py.
+
+
+class StubSettings:
+    def __init__(self, first_token_ms=400, tokens_per_second=80, fail_rate=0.0, fail_status=503, retry_after=None,
+                 responses=RESPONSES, seed=0):
+        self.first_token_ms = first_token_ms
+        self.tokens_per_second = tokens_per_second
+        self.fail_rate = fail_rate  # Chance any request fails with fail_status
+        self.fail_status = fail_status
+        self.retry_after = retry_after  # Sent as Retry-After on failures when set
+        self.responses = responses
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "failures": 0, "tokens": 0}
+
+    def pick(self, contents):
+        # Only the newest message counts, earlier turns would make every answer after a code one a code one too
+        if isinstance(contents, list) and contents:
+            contents = contents[-1]
+        text = json.dumps(contents).lower()
+        # Same rule as the fake backend so the code path can be tried
+        if "list" in text or "code" in text:
+            return self.responses[1]
+        with self.lock:
+            return self.rng.choice(self.responses)
+
+    def should_fail(self):
+        with self.lock:
+            self.stats["requests"] += 1
+            if self.fail_rate and self.rng.random() < self.fail_rate:
+                self.stats["failures"] += 1
+                return True
+            return False
+
+
+def tokens(text):
+    # About four characters each, the same estimate the chat session budgets with
+    return [text[i:i + 4] for i in range(0, len(text), 4)]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    settings = None  # Set on the subclass StubServer makes
+
+    def log_message(self, format, *args):
+        pass
+
+    def _json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _fail(self):
+        settings = self.settings
+        if not settings.should_fail():
+            return False
+        body = json.dumps({"error": "injected failure"}).encode()
+        self.send_response(settings.fail_status)
+        if settings.retry_after is not None:
+            self.send_header("Retry-After", str(settings.retry_after))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return True
+
+    def do_GET(self):
+        if self._fail():
+            return
+        if self.path.startswith("/models/"):
+            self._json({"name": self.path[len("/models/"):]})
+        else:
+            self._json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self._fail():
+            return
+        settings = self.settings
+        if self.path == "/count_tokens":
+            self._json({"total_tokens": len(tokens(json.dumps(payload.get("contents"))))})
+            return
+        if self.path not in ("/generate", "/stream"):
+            self._json({"error": "not found"}, 404)
+            return
+
+        pieces = tokens(settings.pick(payload.get("contents")))
+        with settings.lock:
+            settings.stats["tokens"] += len(pieces)
+        time.sleep(settings.first_token_ms / 1000)
+        per_token = 1 / settings.tokens_per_second if settings.tokens_per_second else 0
+        if self.path == "/generate":
+            time.sleep(per_token * (len(pieces) - 1))
+            self._json({"text": "".join(pieces)})
+            return
+
+        # Closing the connection ends the stream, so there's no length up front
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        for i, piece in enumerate(pieces):
+            if i:
+                time.sleep(per_token)
+            self.wfile.write(json.dumps({"text": piece}).encode() + b"\n")
+            self.wfile.flush()
+
+
+class StubServer:
+    def __init__(self, settings=None, host="127.0.0.1", port=0):
+        handler = type("BoundStubHandler", (StubHandler,), {"settings": settings or StubSettings()})
+        self.settings = handler.settings
+        # The default backlog of 5 resets connections when a benchmark opens dozens at once
+        server = type("StubHTTPServer", (ThreadingHTTPServer,), {"request_queue_size": 128})
+        self.httpd = server((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve fake model responses with configurable latency and failures")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--first-token-ms", type=float, default=400)
+    parser.add_argument("--tokens-per-second", type=float, default=80)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--fail-status", type=int, default=503)
+    parser.add_argument("--retry-after", type=float)
+    args = parser.parse_args()
+
+    server = StubServer(StubSettings(args.first_token_ms, args.tokens_per_second, args.fail_rate, args.fail_status, args.retry_after),
+                        port=args.port)
+    print(f"stub model server on {server.url}, set LLM_STUB_URL = \"{server.url}\" in config.py")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,217 @@
+import time
+import numpy as np
+
+from state_machine import StateSnapshot, State, DISPLAY_NAMES
+from config import (
+    WALK_INCREMENT, FLY_INCREMENT, CIRCLE_DURATION, CIRCLE_RADIUS,
+    TIREDNESS_DECREASE_RATE, TIREDNESS_RECOVERY_RATE, TIRED_THRESHOLD, RECOVERY_THRESHOLD
+)
+
+# Same state codes as TailsStateMachine's transition table
+IDLE, WALK, FLY, CIRCLE, SIT, HOVER = (int(state) for state in State)
+
+
+class SwarmEngine:
+    def __init__(self, count, screen_width, taskbar_y, canvas_width, canvas_height, seed=None, clock=time.time):
+        self.count = count
+        self.screen_width = screen_width
+        self.taskbar_y = taskbar_y
+        self.canvas_width = canvas_width
+        self.canvas_height = canvas_height
+        self.clock = clock
+        self.rng = np.random.default_rng(seed)
+        self.version = 0
+
+        # Spread the pets along the taskbar, sitting like a freshly started Tails
+        self.x = self.rng.uniform(0, screen_width - canvas_width, count)
+        self.y = np.full(count, float(self.ground_y))
+        self.target_x = np.zeros(count)
+        self.target_y = np.zeros(count)
+        self.has_target = np.zeros(count, dtype=bool)
+        self.state = np.full(count, SIT, dtype=np.int8)
+        self.facing_left = np.zeros(count, dtype=bool)
+        self.frame_index = np.zeros(count, dtype=np.int64)
+        self.tiredness = np.full(count, 100.0)
+        self.wander_due = np.full(count, np.inf)  # Time of each idle pet's next wander roll
+        self.circle_start = np.zeros(count)
+        self.circle_x = np.zeros(count)
+        self.circle_y = np.zeros(count)
+        self.forced_sit = np.zeros(count, dtype=bool)
+
+    @property
+    def ground_y(self):
+        return self.taskbar_y - self.canvas_height
+
+    def set_screen(self, screen_width, taskbar_y):
+        self.screen_width = screen_width
+        self.taskbar_y = taskbar_y
+        # Standing and sitting pets follow the taskbar
+        grounded = (self.state == IDLE) | (self.state == SIT)
+        self.y[grounded] = self.ground_y
+        self.x = np.minimum(self.x, max(0, screen_width - self.canvas_width))
+        self.version += 1
+
+    def right_click(self, x, y, pets=None):
+        # Send the given pets (all by default) towards a target, flying if it's far above or below
+        pets = slice(None) if pets is None else pets
+        fly = np.abs(y - self.y[pets]) > 75
+        self.state[pets] = np.where(fly, FLY, WALK)
+        self.target_x[pets] = x
+        self.target_y[pets] = y
+        self.has_target[pets] = True
+        self.facing_left[pets] = x < self.x[pets]
+        self.version += 1
+
+    def force_state(self, pet, state):
+        # Context menu actions for a single pet
+        if state == "sit":
+            self.state[pet] = SIT
+            self.forced_sit[pet] = True
+        elif state == "idle":
+            if abs(self.y[pet] - self.ground_y) > 5:
+                self.target_x[pet], self.target_y[pet] = self.x[pet], self.ground_y
+                self.has_target[pet] = True
+                self.state[pet] = FLY
+            else:
+                self.state[pet] = IDLE
+            self.forced_sit[pet] = False
+        elif state == "fly":
+            self.right_click(self.x[pet], self.y[pet] - 200, pets=[pet])
+        self.frame_index[pet] = 0
+        self.version += 1
+
+    def increment_frame(self):
+        self.frame_index += 1
+        self.version += 1
+
+    def step(self, dt, now=None):
+        # One vectorized pass of TailsStateMachine._update_state over every pet
+        now = self.clock() if now is None else now
+        state = self.state
+        ground_y = self.ground_y
+
+        # Tiredness, masks are taken up front so a pet that just got tired doesn't also recover this tick
+        walking = state == WALK
+        sitting = state == SIT
+        self.tiredness[walking] = np.maximum(0, self.tiredness[walking] - TIREDNESS_DECREASE_RATE * dt)
+        tired = walking & (self.tiredness < TIRED_THRESHOLD)
+        state[tired] = SIT
+        self.frame_index[tired] = 0
+
+        self.tiredness[sitting] = np.minimum(100, self.tiredness[sitting] + (TIREDNESS_RECOVERY_RATE * 0.5) * (dt / 2.0))
+        recovered = sitting & (self.tiredness > RECOVERY_THRESHOLD) & ~self.forced_sit
+        state[recovered] = IDLE
+        self.frame_index[recovered] = 0
+
+        # Movement towards targets, stepped per tick since a segment object per pet wouldn't vectorize
+        # Pets that land start circling from the next tick
+        moving = ((state == WALK) | (state == FLY)) & self.has_target
+        circling = state == CIRCLE
+        if moving.any():
+            dx = self.target_x - self.x
+            dy = self.target_y - self.y
+            distance = np.hypot(dx, dy)
+            increment = np.where(state == WALK, WALK_INCREMENT, FLY_INCREMENT)
+
+            advancing = moving & (distance > increment)
+            scale = np.divide(increment, distance, out=np.zeros_like(distance), where=advancing)
+            self.x += dx * scale
+            self.y += dy * scale
+            self.facing_left[advancing] = dx[advancing] < 0
+
+            arrived = moving & ~advancing
+            self.x[arrived] = self.target_x[arrived]
+            self.y[arrived] = self.target_y[arrived]
+            self.has_target[arrived] = False
+            self.frame_index[arrived] = 0
+
+            landed_flight = arrived & (state == FLY)
+            state[landed_flight] = CIRCLE
+            self.circle_start[landed_flight] = now
+            # Centered to the left like CircleSegment.through, so the circle starts and ends where the pet landed
+            self.circle_x[landed_flight] = self.x[landed_flight] - CIRCLE_RADIUS
+            self.circle_y[landed_flight] = self.y[landed_flight]
+
+            walked = arrived & (state == WALK)
+            on_ground = np.abs(self.y - ground_y) < 5
+            state[walked & on_ground] = IDLE
+            self.y[walked & on_ground] = ground_y
+            state[walked & ~on_ground] = HOVER
+
+        # Circling
+        if circling.any():
+            elapsed = now - self.circle_start
+            still_circling = circling & (elapsed < CIRCLE_DURATION)
+            angle = elapsed[still_circling] / CIRCLE_DURATION * 2 * np.pi
+            cos_angle = np.cos(angle)
+            self.x[still_circling] = self.circle_x[still_circling] + CIRCLE_RADIUS * cos_angle
+            self.y[still_circling] = self.circle_y[still_circling] + CIRCLE_RADIUS * np.sin(angle)
+            self.facing_left[still_circling] = cos_angle < 0
+            done = circling & ~still_circling
+            self.x[done] = self.circle_x[done] + CIRCLE_RADIUS
+            self.y[done] = self.circle_y[done]
+            state[done] = IDLE
+
+        # Snap grounded states to the taskbar
+        grounded = ((state == WALK) | (state == SIT) | (state == IDLE)) & (np.abs(self.y - ground_y) < 5)
+        self.y[grounded] = ground_y
+
+        # Random walk when idle, a roll every 2-5 seconds with a 20% chance, drawn once like the state machine's timers
+        idle = state == IDLE
+        due = self.wander_due
+        due[~idle] = np.inf
+        entered = idle & np.isinf(due)
+        due[entered] = now + self.rng.uniform(2, 5, entered.sum())
+        rolled = idle & (due <= now)
+        wander = rolled & (self.rng.random(self.count) < 0.2)
+        missed = rolled & ~wander
+        due[missed] += self.rng.uniform(2, 5, missed.sum())
+        if wander.any():
+            self.target_x[wander] = self.rng.integers(0, self.screen_width - self.canvas_width, wander.sum(), endpoint=True)
+            self.target_y[wander] = ground_y
+            self.has_target[wander] = True
+            state[wander] = WALK
+            self.frame_index[wander] = 0
+            due[wander] = np.inf
+
+        self.version += 1
+
+    def any_moving(self):
+        state = self.state
+        return bool(((state == WALK) | (state == FLY) | (state == CIRCLE)).any())
+
+    def pet(self, index):
+        return SwarmPet(self, index)
+
+
+class SwarmPet:
+    # Looks like a TailsStateMachine to TailsWidget, backed by one row of the engine
+    def __init__(self, engine, index):
+        self.engine = engine
+        self.index = index
+        self._snapshot = None
+
+    @property
+    def version(self):
+        return self.engine.version
+
+    def changed_since(self, version):
+        return self.engine.version != version
+
+    def get_state(self):
+        engine = self.engine
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == engine.version:
+            return snapshot
+
+        i = self.index
+        snapshot = StateSnapshot(
+            engine.version,
+            DISPLAY_NAMES[engine.state[i]],
+            "L" if engine.facing_left[i] else "R",
+            int(engine.frame_index[i]),
+            (int(engine.x[i]), int(engine.y[i])),
+            float(engine.tiredness[i])
+        )
+        self._snapshot = snapshot
+        return snapshot
@@ -1,6 +1,6 @@
-import time
+import random
 from PyQt5.QtCore import QTimer, QSize, Qt
-from PyQt5.QtWidgets import QApplication, QLabel, QVBoxLayout, QWidget
+from PyQt5.QtWidgets import QLabel, QVBoxLayout, QWidget
 from pynput import mouse
 from PyQt5.QtGui import QPixmap
 
@@ -8,7 +8,16 @@ from sprite_manager import SpriteManager
 from state_machine import TailsStateMachine, Event
 from tails_widget import TailsWidget
 from gemini_manager import GeminiManager
-from config import CANVAS_SIZE_WIDTH, CANVAS_SIZE_HEIGHT, TICK_MS
+from game_loop import GameLoop
+from input_bridge import ClickBridge
+from navigation import NavigationMap
+from screen_geometry import ScreenGeometry
+from utils import log
+from config import (
+    CANVAS_SIZE_WIDTH, CANVAS_SIZE_HEIGHT, SIM_STEP_MS, ANIMATION_MS,
+    RENDER_FPS, IDLE_RENDER_FPS, MAX_CATCHUP_STEPS, SWARM_SIZE, RECORD_EVENTS,
+    GEMINI_WARMUP_DELAY_MS
+)
 
 class TailsApp(QWidget):
     def __init__(self, path_config):
@@ -17,108 +26,163 @@ class TailsApp(QWidget):
 
         self._init_components(path_config)
 
-        self._setup_timers()
+        self._setup_game_loop()
 
         self._setup_mouse_listener()
 
     def _get_screen_info(self):
-        screen = QApplication.primaryScreen()
-        full_geometry = screen.geometry()
-        available_geometry = screen.availableGeometry()
-
-        self.screen_width = full_geometry.width()
-        self.taskbar_y = available_geometry.height()
+        # Cached by the geometry service, which tells us when screens or the taskbar change
+        self.screen_geometry = ScreenGeometry()
+        self.screen_geometry.changed.connect(self._on_screen_geometry_changed)
+        self._read_screen_geometry()
+
+    def _read_screen_geometry(self):
+        self.screen_width = self.screen_geometry.screen_width
+        self.taskbar_y = self.screen_geometry.taskbar_y
+
+        # Every monitor, so clicks on another screen route through where the screens touch
+        screens, work_areas = self.screen_geometry.rect_tuples()
+        self.navigator = NavigationMap(screens, work_areas, CANVAS_SIZE_WIDTH, CANVAS_SIZE_HEIGHT)
+
+    def _on_screen_geometry_changed(self):
+        self._read_screen_geometry()
+        log(f"Screen geometry changed, {len(self.screen_geometry.screens)} screen(s), taskbar at {self.taskbar_y}", level="INFO")
+        self.state_machine.set_screen(self.screen_width, self.taskbar_y, self.navigator)
+        if self.swarm:
+            self.swarm.set_screen(self.screen_width, self.taskbar_y)
 
     def _init_components(self, path_config):
         canvas_size = QSize(CANVAS_SIZE_WIDTH, CANVAS_SIZE_HEIGHT)
 
         self.sprite_manager = SpriteManager(path_config, canvas_size)
 
+        # A recorded session needs its own seeded RNG so replay makes the same random choices
+        self.recorder = None
+        rng = random
+        if RECORD_EVENTS:
+            from replay import EventRecorder
+
+            seed = random.randrange(2 ** 63)
+            rng = random.Random(seed)
+            self.recorder = EventRecorder(RECORD_EVENTS, seed)
+
         self.state_machine = TailsStateMachine(
             self.screen_width,
             self.taskbar_y,
             CANVAS_SIZE_WIDTH,
-            CANVAS_SIZE_HEIGHT
+            CANVAS_SIZE_HEIGHT,
+            rng=rng,
+            navigator=self.navigator
         )
+        if self.recorder:
+            self.recorder.attach(self.state_machine)
+
+        self.gemini_manager_instance = GeminiManager(self.state_machine, self.screen_geometry)
+        # Connect to Gemini in the background once startup is out of the way
+        QTimer.singleShot(GEMINI_WARMUP_DELAY_MS, self.gemini_manager_instance.warm_up)
 
-        self.gemini_manager_instance = GeminiManager(self.state_machine)
+        # Clicks arrive on pynput's hook thread, they're queued and applied by the game loop
+        self.click_bridge = ClickBridge()
 
         self.widget = TailsWidget(self.sprite_manager, self.state_machine, self.gemini_manager_instance)
 
         # Connect signals
         self.widget.state_changed.connect(self._handle_state_change)
-        self.last_tick_time = time.time()
 
         self.widget.update_sprite()
         self.widget.show()
 
-    def _setup_timers(self):
-        # Animation timer
-        self.animation_timer = QTimer()
-        self.animation_timer.timeout.connect(self._animation_tick)
-        self.animation_timer.start(TICK_MS)
-
-        self.state_timer = QTimer()
-        self.state_timer.timeout.connect(self._state_tick)
-        self.state_timer.start(TICK_MS)
+        self._init_swarm(SWARM_SIZE)
+
+    def _init_swarm(self, count):
+        self.swarm = None
+        self.companions = []
+        if count <= 0:
+            return
+
+        # Only needed for companions, so numpy stays optional
+        from swarm import SwarmEngine
+
+        self.swarm = SwarmEngine(count, self.screen_width, self.taskbar_y, CANVAS_SIZE_WIDTH, CANVAS_SIZE_HEIGHT)
+        for i in range(count):
+            companion = TailsWidget(self.sprite_manager, self.swarm.pet(i), self.gemini_manager_instance)
+            companion.state_changed.connect(lambda state, i=i: self.swarm.force_state(i, state))
+            companion.update_sprite()
+            companion.show()
+            self.companions.append(companion)
+
+    def _setup_game_loop(self):
+        # One timer drives simulation, animation and rendering
+        self.game_loop = GameLoop(
+            simulate=self._simulate,
+            animate=self._animate,
+            render=self._render,
+            step_ms=SIM_STEP_MS,
+            animation_ms=ANIMATION_MS,
+            active_fps=RENDER_FPS,
+            idle_fps=IDLE_RENDER_FPS,
+            max_catchup_steps=MAX_CATCHUP_STEPS,
+            poll_input=self._poll_input
+        )
+        self.game_loop.start()
 
     def _setup_mouse_listener(self):
         def on_click(x, y, button, pressed):
             # Only handle right mouse button presses
             if pressed and button == mouse.Button.right:
-                target_x = x - CANVAS_SIZE_WIDTH // 2
-                target_y = y - CANVAS_SIZE_HEIGHT // 2
-
-                # Process right click event in state machine
-                self.state_machine.process_event(
-                    Event.RIGHT_CLICK,
-                    x=target_x,
-                    y=target_y
-                )
-
-                self.widget.update_sprite()
+                self.click_bridge.push(x, y)
 
         self.mouse_listener = mouse.Listener(on_click=on_click)
         self.mouse_listener.start()
 
-    def _animation_tick(self):
-        self.state_machine.increment_frame()
+    def _poll_input(self):
+        click = self.click_bridge.drain()
+        if click is None:
+            return
 
-        self.widget.update_sprite()
+        x, y = click
+        target_x = x - CANVAS_SIZE_WIDTH // 2
+        target_y = y - CANVAS_SIZE_HEIGHT // 2
+
+        # Process right click event in state machine
+        self.state_machine.process_event(
+            Event.RIGHT_CLICK,
+            x=target_x,
+            y=target_y
+        )
+        if self.swarm:
+            self.swarm.right_click(target_x, target_y)
 
-    def _state_tick(self):
-        current_time = time.time()
-        dt = current_time - self.last_tick_time
-        self.last_tick_time = current_time
+    def _simulate(self, dt):
+        self.state_machine.process_event(Event.TICK)
+        if self.swarm:
+            self.swarm.step(dt)
 
-        state_changed = self.state_machine.process_event(Event.TICK, dt=dt)
+    def _animate(self):
+        self.state_machine.increment_frame()
+        if self.swarm:
+            self.swarm.increment_frame()
 
-        if state_changed:
-            self.widget.update_sprite()
+    def _render(self):
+        state = self.state_machine.get_state()
+        moving = state.state in ("walk", "fly")
+        self.game_loop.set_active(moving or bool(self.swarm and self.swarm.any_moving()))
 
-    def _handle_state_change(self, state):
-        current_tails_state = self.state_machine.get_state()["state"]
+        # Sample the trajectory at render time rather than waiting for the next simulation step
+        position = self.state_machine.position_at() if moving else state.position
+        self.widget.update_sprite(position)
+        for companion in self.companions:
+            companion.update_sprite()
+        self.click_bridge.frame_rendered()
 
+    def _handle_state_change(self, state):
+        # Menu actions go through the state machine's transition table like every other event
         if state == "sit":
-            if current_tails_state != "sit":
-                self.state_machine.current_state = "sit"
-                self.state_machine.frame_index = 0
-                self.state_machine.forced_sit = True
+            self.state_machine.process_event(Event.SIT_REQUESTED)
         elif state == "idle":
-            if current_tails_state != "idle":
-                # If in air, fly down to ground
-                pos = self.state_machine.get_state()["position"]
-                y_ground = self.state_machine.taskbar_y - self.state_machine.canvas_height
-                if current_tails_state in ("hover", "fly") and abs(pos[1] - y_ground) > 5:
-                    self.state_machine.target = (pos[0], y_ground)
-                    self.state_machine.current_state = "fly"
-                else:
-                    self.state_machine.current_state = "idle"
-                self.state_machine.frame_index = 0
-                self.state_machine.forced_sit = False
+            self.state_machine.process_event(Event.STAND_REQUESTED)
         elif state == "fly":
-            current_state_data = self.state_machine.get_state()
-            pos = current_state_data["position"]
+            pos = self.state_machine.get_state().position
             target_x = pos[0]
             target_y = pos[1] - 200
             self.state_machine.process_event(
@@ -130,13 +194,18 @@ class TailsApp(QWidget):
         self.widget.update_sprite()
         
     def close(self):
-        # Stop timers
-        self.animation_timer.stop()
-        self.state_timer.stop()
+        # Stop the game loop
+        self.game_loop.stop()
 
         # Stop mouse listener
         if hasattr(self, 'mouse_listener'):
             self.mouse_listener.stop()
 
-        # Close widget
+        if self.recorder:
+            self.recorder.close()
+        self.gemini_manager_instance.close()
+
+        # Close widgets
+        for companion in self.companions:
+            companion.close()
         self.widget.close()
\ No newline at end of file
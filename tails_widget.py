@@ -1,6 +1,6 @@
 import math
-from PyQt5.QtWidgets import QWidget, QMenu, QAction, QInputDialog, QLineEdit 
-from PyQt5.QtCore import Qt, QTimer, QSize, pyqtSignal
+from PyQt5.QtWidgets import QApplication, QWidget, QMenu, QAction, QInputDialog, QLineEdit 
+from PyQt5.QtCore import Qt, QTimer, QSize, QRect, QPoint, pyqtSignal
 from PyQt5.QtGui import QPainter, QPixmap, QFontMetrics
 from state_machine import Event
 
@@ -14,6 +14,17 @@ class TailsWidget(QWidget):
         self.state_machine = state_machine
         self.gemini_manager = gem
         self.current_sprite = None
+
+        # Last state pushed to the window, so no-op ticks don't touch it
+        self._drawn_sprite = None
+        self._drawn_geometry = None
+        self.render_stats = {
+            "repaints": 0,
+            "skipped_repaints": 0,
+            "moves": 0,
+            "resizes": 0,
+            "skipped_geometry": 0,
+        }
         
         self._setup_widget()
         self._setup_context_menu()
@@ -49,29 +60,53 @@ class TailsWidget(QWidget):
         self.context_menu.addSeparator()
         
         exit_action = QAction("Exit", self)
-        exit_action.triggered.connect(self.close)
+        # Closing a tool window doesn't end the app, quitting runs TailsApp.close through aboutToQuit
+        exit_action.triggered.connect(QApplication.instance().quit)
         self.context_menu.addAction(exit_action)
     
     def _set_state(self, state):
         self.state_changed.emit(state)
 
-    def update_sprite(self):
+    def update_sprite(self, position=None):
         state = self.state_machine.get_state()
         self.current_sprite = self.sprite_manager.get_sprite(
-            state["state"], 
-            state["direction"], 
-            state["frame_index"]
+            state.state, 
+            state.direction, 
+            state.frame_index
         )
-        self.move(*state["position"])
-        self.resize(self.current_sprite.size())
-        self.update()
+        # Window hugs the visible sprite, the state machine keeps working in canvas coordinates
+        # An explicit position is the render loop's interpolated one
+        geometry = self.current_sprite.window_rect(*(position or state.position))
+        last = self._drawn_geometry
+        moved = last is None or geometry.topLeft() != last.topLeft()
+        resized = last is None or geometry.size() != last.size()
+
+        if moved and resized:
+            self.setGeometry(geometry)
+        elif moved:
+            self.move(geometry.topLeft())
+        elif resized:
+            self.resize(geometry.size())
+        else:
+            self.render_stats["skipped_geometry"] += 1
+        self.render_stats["moves"] += moved
+        self.render_stats["resizes"] += resized
+        self._drawn_geometry = geometry
+
+        if self.current_sprite is not self._drawn_sprite:
+            self._drawn_sprite = self.current_sprite
+            self.render_stats["repaints"] += 1
+            self.update()
+        else:
+            self.render_stats["skipped_repaints"] += 1
     
     def paintEvent(self, event):
         painter = QPainter(self)
         painter.setRenderHint(QPainter.Antialiasing)
         painter.setRenderHint(QPainter.SmoothPixmapTransform)
         
-        painter.drawPixmap(0, 0, self.current_sprite)
+        frame = self.current_sprite
+        painter.drawPixmap(QRect(QPoint(0, 0), frame.source.size()), frame.pixmap, frame.source)
         painter.end()
     
     def contextMenuEvent(self, event):
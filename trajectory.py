@@ -0,0 +1,122 @@
+import math
+from abc import ABC, abstractmethod
+
+class Segment(ABC):
+    # A piece of movement that can be evaluated in closed form for any timestamp
+    def __init__(self, start_time, duration):
+        self.start_time = start_time
+        self.duration = max(0.0, duration)
+        self.end_time = start_time + self.duration
+
+    def progress(self, t):
+        if self.duration <= 0:
+            return 1.0
+        return min(1.0, max(0.0, (t - self.start_time) / self.duration))
+
+    def finished(self, t):
+        return t >= self.end_time
+
+    @abstractmethod
+    def position_at(self, t):
+        pass
+
+    @abstractmethod
+    def facing_left_at(self, t):
+        pass
+
+
+class LineSegment(Segment):
+    def __init__(self, start, end, speed, start_time):
+        self.start = start
+        self.end = end
+        self.dx = end[0] - start[0]
+        self.dy = end[1] - start[1]
+        length = math.hypot(self.dx, self.dy)
+        super().__init__(start_time, length / speed if speed > 0 else 0.0)
+
+    def position_at(self, t):
+        u = self.progress(t)
+        return self.start[0] + self.dx * u, self.start[1] + self.dy * u
+
+    def facing_left_at(self, t):
+        return self.dx < 0
+
+
+class PolylineSegment(Segment):
+    # Constant speed through a list of waypoints, used for routes that cross between screens
+    def __init__(self, points, speed, start_time):
+        self.points = points
+        self.start = points[0]
+        self.end = points[-1]
+        self.lengths = [math.hypot(b[0] - a[0], b[1] - a[1]) for a, b in zip(points, points[1:])]
+        super().__init__(start_time, sum(self.lengths) / speed if speed > 0 else 0.0)
+
+    def _leg(self, t):
+        # Which leg t falls on and how far along it
+        remaining = self.progress(t) * sum(self.lengths)
+        for index, length in enumerate(self.lengths):
+            if remaining <= length or index == len(self.lengths) - 1:
+                return index, (remaining / length if length else 1.0)
+            remaining -= length
+        return 0, 1.0
+
+    def position_at(self, t):
+        index, u = self._leg(t)
+        (x1, y1), (x2, y2) = self.points[index], self.points[index + 1]
+        return x1 + (x2 - x1) * u, y1 + (y2 - y1) * u
+
+    def facing_left_at(self, t):
+        index, _ = self._leg(t)
+        return self.points[index + 1][0] < self.points[index][0]
+
+
+class EasedArcSegment(Segment):
+    # Smoothstep along the chord, bowed sideways by lift pixels at the midpoint
+    def __init__(self, start, end, start_time, duration, lift=0.0):
+        super().__init__(start_time, duration)
+        self.start = start
+        self.end = end
+        self.dx = end[0] - start[0]
+        self.dy = end[1] - start[1]
+        length = math.hypot(self.dx, self.dy) or 1.0
+        self.normal = (-self.dy / length, self.dx / length)
+        self.lift = lift
+
+    def position_at(self, t):
+        s = self.progress(t)
+        u = s * s * (3 - 2 * s)
+        bow = self.lift * math.sin(math.pi * s)
+        return (self.start[0] + self.dx * u + self.normal[0] * bow,
+                self.start[1] + self.dy * u + self.normal[1] * bow)
+
+    def facing_left_at(self, t):
+        # Horizontal velocity sign, falling back to the chord for straight drops
+        s = self.progress(t)
+        vx = self.dx * 6 * s * (1 - s) + self.normal[0] * self.lift * math.pi * math.cos(math.pi * s)
+        return vx < 0 if abs(vx) > 1e-9 else self.dx < 0
+
+
+class CircleSegment(Segment):
+    # One full turn, starting at start_angle and running clockwise on screen (y points down)
+    def __init__(self, center, radius, start_time, duration, start_angle=0.0):
+        super().__init__(start_time, duration)
+        self.center = center
+        self.radius = radius
+        self.start_angle = start_angle
+        self.start = self.end = self.position_at(start_time)
+
+    @classmethod
+    def through(cls, point, radius, start_time, duration):
+        # Circle that starts and ends at point, so there's no jump entering or leaving it
+        return cls((point[0] - radius, point[1]), radius, start_time, duration)
+
+    def angle_at(self, t):
+        return self.start_angle + self.progress(t) * 2 * math.pi
+
+    def position_at(self, t):
+        angle = self.angle_at(t)
+        return self.center[0] + self.radius * math.cos(angle), self.center[1] + self.radius * math.sin(angle)
+
+    def facing_left_at(self, t):
+        # Matches the old per-tick rule of facing left on the left half of the circle
+        return math.cos(self.angle_at(t)) < 0
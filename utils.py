@@ -52,7 +52,11 @@ class PathFinder:
 
 class AssetValidator:
     @staticmethod
-    def validate_assets(path_config):
+    def validate_assets(path_config, mirror_left=None):
+        from config import FRAME_COUNTS, SPRITE_CONFIG, SPRITE_MIRROR_LEFT
+        if mirror_left is None:
+            mirror_left = SPRITE_MIRROR_LEFT
+
         missing_files = []
         
         # Check each directory
@@ -62,7 +66,6 @@ class AssetValidator:
                 continue
                 
             # Check for required frame files
-            from config import FRAME_COUNTS, SPRITE_CONFIG
             frame_count = FRAME_COUNTS.get(state, 4)
             
             # Check right-facing sprites
@@ -72,6 +75,10 @@ class AssetValidator:
                 if not os.path.exists(file_path):
                     missing_files.append(file_path)
             
+            # Left-facing sprites are mirrored at load time, the B files aren't needed
+            if mirror_left:
+                continue
+
             # Check left-facing sprites
             left_prefix = SPRITE_CONFIG[state]["left"]
             for i in range(1, frame_count + 1):